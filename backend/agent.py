@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+from app.agent import Agent
+
+def main():
+    server = os.getenv('AGENT_SERVER')
+    if not server:
+        print("Set AGENT_SERVER to the collector's base URL, e.g. http://monitor.example:8000")
+        raise SystemExit(1)
+    agent = Agent(
+        server,
+        agent_id=os.getenv('AGENT_ID'),
+        site=os.getenv('AGENT_SITE'),
+        spool_path=os.getenv('AGENT_SPOOL'),
+    )
+    try:
+        asyncio.run(agent.run())
+    except KeyboardInterrupt:
+        print("Agent stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+from .models import TestType
+
+PROBE = "probe"
+HTTP = "http"
+BANDWIDTH = "bandwidth"
+
+TEST_CLASSES = {
+    TestType.PING.value: PROBE,
+    TestType.DNS.value: PROBE,
+    TestType.TRACEROUTE.value: PROBE,
+    TestType.HTTP.value: HTTP,
+    TestType.SPEEDTEST_OOKLA.value: BANDWIDTH,
+    TestType.SPEEDTEST_FAST.value: BANDWIDTH,
+    TestType.IPERF3.value: BANDWIDTH,
+}
+
+# Bandwidth tests are dispatched first so latency probes can't starve them
+_DISPATCH_ORDER = (BANDWIDTH, HTTP, PROBE)
+# How often held-back work rechecks a BandwidthGate; other processes
+# can't wake this one when they finish
+GATE_POLL_SECONDS = float(os.getenv('ADMISSION_GATE_POLL', '0.05'))
+
+
+class BandwidthGate:
+    """The bandwidth rule across probe worker processes.
+
+    Bandwidth tests all run in one worker, but latency probes run in every
+    worker. Each worker counts its in-flight latency probes in a shared
+    counter; the bandwidth worker raises the hold flag while a bandwidth
+    test is waiting or running and only starts it once the counter is 0.
+    A probe counts itself before looking at the flag and the bandwidth
+    worker raises the flag before looking at the count, so one of the two
+    always sees the other.
+    """
+
+    def __init__(self, context):
+        self._hold = context.Event()
+        self._active = context.Value('i', 0)
+
+    def enter(self) -> bool:
+        """Count a latency probe in; False (and not counted) while held"""
+        with self._active.get_lock():
+            self._active.value += 1
+        if self._hold.is_set():
+            self.leave()
+            return False
+        return True
+
+    def leave(self):
+        with self._active.get_lock():
+            self._active.value -= 1
+
+    def claim(self) -> bool:
+        """Hold latency probes everywhere; True once none are in flight"""
+        self._hold.set()
+        with self._active.get_lock():
+            return self._active.value == 0
+
+    def release(self):
+        self._hold.clear()
+
+    def stats(self) -> dict:
+        return {"hold": self._hold.is_set(), "latency_in_flight": self._active.value}
+
+
+class AdmissionController:
+    """Caps how many scheduled tests run at once, globally and per test class.
+
+    Bandwidth tests run one at a time, and only once no latency probe
+    (ping, dns, traceroute, http) is in flight. While one is running or
+    waiting, new latency probes are held back so they neither distort
+    it nor get distorted by it. Waiters are served FIFO within a class.
+    With a BandwidthGate the same rule holds across worker processes.
+    """
+
+    def __init__(self, global_limit: int = None, probe_limit: int = None, http_limit: int = None,
+                 gate: BandwidthGate = None):
+        self.gate = gate
+        self._recheck: Optional[asyncio.TimerHandle] = None
+        self.global_limit = global_limit or int(os.getenv('ADMISSION_GLOBAL_LIMIT', '64'))
+        self.limits = {
+            PROBE: probe_limit or int(os.getenv('ADMISSION_PROBE_LIMIT', '32')),
+            HTTP: http_limit or int(os.getenv('ADMISSION_HTTP_LIMIT', '16')),
+            BANDWIDTH: 1,
+        }
+        self._running: Dict[str, int] = {name: 0 for name in self.limits}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {name: deque() for name in self.limits}
+        self._total = 0
+        self._admitted: Dict[str, int] = {name: 0 for name in self.limits}
+        self._wait_seconds: Dict[str, float] = {name: 0.0 for name in self.limits}
+        self._max_wait: Dict[str, float] = {name: 0.0 for name in self.limits}
+
+    @staticmethod
+    def classify(test_type) -> str:
+        return TEST_CLASSES.get(getattr(test_type, 'value', test_type), PROBE)
+
+    def _can_start(self, name: str) -> bool:
+        if self._total >= self.global_limit or self._running[name] >= self.limits[name]:
+            return False
+        if name == BANDWIDTH:
+            return self._running[PROBE] == 0 and self._running[HTTP] == 0
+        return self._running[BANDWIDTH] == 0 and not self._waiters[BANDWIDTH]
+
+    def _admit(self, name: str) -> bool:
+        """_can_start plus the other processes' say, through the gate"""
+        if not self._can_start(name):
+            return False
+        if self.gate is None:
+            return True
+        admitted = self.gate.claim() if name == BANDWIDTH else self.gate.enter()
+        if not admitted and self._recheck is None:
+            self._recheck = asyncio.get_running_loop().call_later(GATE_POLL_SECONDS, self._poll)
+        return admitted
+
+    def _poll(self):
+        self._recheck = None
+        self._dispatch()
+
+    def _start(self, name: str):
+        self._running[name] += 1
+        self._total += 1
+        self._admitted[name] += 1
+
+    def _dispatch(self):
+        for name in _DISPATCH_ORDER:
+            waiters = self._waiters[name]
+            while waiters and waiters[0].done():
+                waiters.popleft()
+            while waiters and self._admit(name):
+                waiter = waiters.popleft()
+                if waiter.done():
+                    self._unadmit(name)
+                    continue
+                self._start(name)
+                waiter.set_result(None)
+        self._release_gate()
+
+    def _unadmit(self, name: str):
+        if self.gate is not None and name != BANDWIDTH:
+            self.gate.leave()
+
+    def _release_gate(self):
+        # Latency probes elsewhere may go again once no bandwidth test is
+        # running or waiting here
+        if self.gate is not None and not self._running[BANDWIDTH] and not any(
+                not waiter.done() for waiter in self._waiters[BANDWIDTH]):
+            self.gate.release()
+
+    def _release(self, name: str):
+        self._running[name] -= 1
+        self._total -= 1
+        self._unadmit(name)
+        self._dispatch()
+
+    async def acquire(self, test_type) -> str:
+        name = self.classify(test_type)
+        if not self._waiters[name] and self._admit(name):
+            self._start(name)
+            return name
+
+        started = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[name].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just before the cancel landed; hand the slot back
+                self._release(name)
+            else:
+                try:
+                    self._waiters[name].remove(waiter)
+                except ValueError:
+                    pass
+                self._dispatch()
+            raise
+
+        waited = time.perf_counter() - started
+        self._wait_seconds[name] += waited
+        self._max_wait[name] = max(self._max_wait[name], waited)
+        return name
+
+    @asynccontextmanager
+    async def slot(self, test_type):
+        name = await self.acquire(test_type)
+        try:
+            yield
+        finally:
+            self._release(name)
+
+    def stats(self) -> dict:
+        stats = {
+            "global_limit": self.global_limit,
+            "running": self._total,
+            "classes": {
+                name: {
+                    "limit": self.limits[name],
+                    "running": self._running[name],
+                    "queued": sum(1 for waiter in self._waiters[name] if not waiter.done()),
+                    "admitted": self._admitted[name],
+                    "wait_seconds_total": self._wait_seconds[name],
+                    "wait_seconds_max": self._max_wait[name],
+                }
+                for name in self.limits
+            },
+        }
+        if self.gate is not None:
+            stats["bandwidth_gate"] = self.gate.stats()
+        return stats
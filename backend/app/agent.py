@@ -0,0 +1,287 @@
+import asyncio
+import os
+import socket
+import zlib
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import aiohttp
+
+from .admission import AdmissionController
+from .bulk_ingest import check_error, decompress, loads
+from .database import ConnectionPool
+from .models import HttpBodyMode, TestConfig, TestResult, TestType
+from .network_tests import NetworkTester
+from .result_encoding import dumps
+from .scheduler import Scheduler
+
+# Results per POST
+BATCH_SIZE = int(os.getenv('AGENT_BATCH_SIZE', '5000'))
+# Seconds between spool flushes; results newer than this are lost on a crash
+FLUSH_INTERVAL = float(os.getenv('AGENT_FLUSH_INTERVAL', '1'))
+# Seconds between shipping attempts when the spool is drained
+SHIP_INTERVAL = float(os.getenv('AGENT_SHIP_INTERVAL', '5'))
+CONFIG_INTERVAL = float(os.getenv('AGENT_CONFIG_INTERVAL', '60'))
+# Oldest results are dropped past this many spooled rows
+SPOOL_MAX_ROWS = int(os.getenv('AGENT_SPOOL_MAX_ROWS', '1000000'))
+MAX_BACKOFF = 60.0
+
+# Decompressed size cap for one incoming batch on the collector
+BATCH_MAX_BYTES = int(os.getenv('AGENT_BATCH_MAX_BYTES', str(64 * 1024 * 1024)))
+
+SPOOL_TABLE = '''
+    CREATE TABLE IF NOT EXISTS spool (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        body BLOB NOT NULL
+    )
+'''
+
+
+def encode_result(result: TestResult) -> bytes:
+    """A spool line: the result without its server-side id and agent.
+
+    The timestamp goes out in UTC; a naive one is taken as this host's
+    local time, so the collector never has to guess the agent's zone.
+    """
+    body = result.dict()
+    del body["id"], body["agent_id"]
+    body["timestamp"] = result.timestamp.astimezone(timezone.utc).isoformat()
+    return dumps(body)
+
+
+def encode_batch(rows: List[Tuple[int, bytes]]) -> bytes:
+    """gzip'd NDJSON, one result per line with its spool seq spliced in"""
+    lines = b"".join(b'{"seq":%d,%s\n' % (seq, body[1:]) for seq, body in rows)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(lines) + compressor.flush()
+
+
+def decode_batch(body: bytes) -> List[Tuple[int, TestResult]]:
+    """Parse an agent batch into (seq, result) pairs, raising ValueError on bad input"""
+    body = decompress(body, BATCH_MAX_BYTES)
+    batch = []
+    for number, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            item = loads(line)
+            seq = item["seq"]
+            if not isinstance(seq, int) or seq <= 0:
+                raise ValueError("seq must be a positive integer")
+            data = item.get("data")
+            if data is not None and not isinstance(data, dict):
+                raise ValueError("data must be an object")
+            timestamp = datetime.fromisoformat(item["timestamp"].replace('Z', '+00:00'))
+            if timestamp.tzinfo is None:
+                raise ValueError("timestamp must carry a UTC offset")
+            success = item["success"]
+            if not isinstance(success, bool):
+                raise ValueError("success must be true or false")
+            response_time = item.get("response_time")
+            batch.append((seq, TestResult(
+                config_id=str(item["config_id"]),
+                timestamp=timestamp,
+                success=success,
+                response_time=float(response_time) if response_time is not None else None,
+                error=check_error(item.get("error")),
+                data=data,
+            )))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise ValueError(f"Line {number}: {e!r}")
+    return batch
+
+
+def config_from_dict(item: dict) -> TestConfig:
+    return TestConfig(
+        id=item["id"],
+        name=item["name"],
+        test_type=TestType(item["test_type"]),
+        target=item["target"],
+        interval=item.get("interval", 30),
+        timeout=item.get("timeout", 5),
+        enabled=item.get("enabled", True),
+        dns_servers=item.get("dns_servers"),
+        ping_count=item.get("ping_count", 1),
+        ping_spacing=item.get("ping_spacing", 0.2),
+        http_keepalive=item.get("http_keepalive", True),
+        http_body=HttpBodyMode(item.get("http_body", HttpBodyMode.STREAM.value)),
+        # Raw output isn't shipped, so there is no point keeping it
+        store_raw=False,
+    )
+
+
+def _append(conn, lines: List[bytes]):
+    conn.executemany("INSERT INTO spool (body) VALUES (?)", [(line,) for line in lines])
+    # seqs are dense, so the size can be bounded by range without a COUNT
+    high = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM spool").fetchone()[0]
+    cursor = conn.execute("DELETE FROM spool WHERE seq <= ?", (high - SPOOL_MAX_ROWS,))
+    return cursor.rowcount
+
+
+def _pending(conn, limit: int) -> List[Tuple[int, bytes]]:
+    return conn.execute("SELECT seq, body FROM spool ORDER BY seq LIMIT ?", (limit,)).fetchall()
+
+
+def _ack(conn, last_seq: int):
+    conn.execute("DELETE FROM spool WHERE seq <= ?", (last_seq,))
+
+
+def _resume(conn, last_seq: int):
+    """Drop what the collector already has and never issue a seq at or below it.
+
+    Covers a crash between the collector storing a batch and the ack, and a
+    lost or recreated spool file, whose seqs would otherwise restart at 1
+    and be skipped as resends.
+    """
+    _ack(conn, last_seq)
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'spool'").fetchone()
+    if row is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('spool', ?)", (last_seq,))
+    elif row[0] < last_seq:
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'spool'", (last_seq,))
+
+
+class Agent:
+    """Headless probe runner that reports to a central pingdumb instance.
+
+    Configs are pulled from the collector and re-checked every
+    CONFIG_INTERVAL. Results are appended to a local SQLite spool and
+    shipped oldest first as gzip'd NDJSON batches. Each result carries its
+    spool seq; AUTOINCREMENT means a seq is never reused, and the collector
+    skips anything at or below the last seq it stored, so a batch resent
+    after a timeout or a restart is not duplicated. Rows are only removed
+    from the spool once the collector acknowledges them, so an agent that
+    loses its link catches up when it comes back.
+    """
+
+    def __init__(self, server: str, agent_id: str = None, site: str = None, spool_path: str = None):
+        self.server = server.rstrip('/')
+        self.agent_id = agent_id or socket.gethostname()
+        self.site = site
+        self.spool = ConnectionPool(spool_path or f"agent_spool_{self.agent_id}.db", readers=1)
+        self.tester = NetworkTester()
+        self.admission = AdmissionController()
+        self.scheduler = Scheduler(self._run_test)
+        self._buffer: List[bytes] = []
+        self._configs: dict = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.shipped = 0
+        self.dropped = 0
+
+    def _url(self, path: str) -> str:
+        return f"{self.server}/api/agents/{self.agent_id}/{path}"
+
+    def _params(self) -> dict:
+        return {"site": self.site} if self.site else {}
+
+    async def _run_test(self, config: TestConfig):
+        async with self.admission.slot(config.test_type):
+            result = await self.tester.run_test(config)
+        self._buffer.append(encode_result(result))
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        dropped = await self.spool.write(_append, lines)
+        if dropped:
+            self.dropped += dropped
+            print(f"Spool full, dropped {dropped} oldest results")
+
+    async def _fetch_configs(self) -> int:
+        """Apply the collector's config set; returns the last seq it has stored"""
+        async with self._session.get(self._url("configs"), params=self._params()) as response:
+            response.raise_for_status()
+            payload = await response.json()
+
+        configs = {item["id"]: config_from_dict(item) for item in payload["configs"]}
+        for config_id in set(self._configs) - set(configs):
+            self.scheduler.remove(config_id)
+        for config_id, config in configs.items():
+            if self._configs.get(config_id) != config:
+                self.scheduler.upsert(config)
+        self._configs = configs
+        return payload["last_seq"]
+
+    async def _ship(self) -> bool:
+        """Send one batch; returns True if there may be more to send"""
+        rows = await self.spool.read(_pending, BATCH_SIZE)
+        if not rows:
+            return False
+        headers = {"Content-Encoding": "gzip", "Content-Type": "application/x-ndjson"}
+        async with self._session.post(self._url("batches"), data=encode_batch(rows),
+                                      headers=headers, params=self._params()) as response:
+            if response.status == 400:
+                # Retrying a batch the collector can't parse would block the
+                # spool forever; skip it instead
+                print(f"Collector rejected results {rows[0][0]}-{rows[-1][0]}: {await response.text()}")
+                await self.spool.write(_ack, rows[-1][0])
+                return True
+            response.raise_for_status()
+            payload = await response.json()
+        await self.spool.write(_ack, payload["last_seq"])
+        self.shipped += payload["accepted"]
+        if payload.get("unknown"):
+            print(f"Collector skipped {payload['unknown']} results for configs it no longer has")
+        return len(rows) == BATCH_SIZE
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self._flush()
+            except Exception as e:
+                print(f"Spool write error: {e}")
+
+    async def _ship_forever(self):
+        backoff = SHIP_INTERVAL
+        while True:
+            try:
+                more = await self._ship()
+                backoff = SHIP_INTERVAL
+            except Exception as e:
+                print(f"Shipping to {self.server} failed, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            if not more:
+                await asyncio.sleep(SHIP_INTERVAL)
+
+    async def _configs_forever(self):
+        while True:
+            await asyncio.sleep(CONFIG_INTERVAL)
+            try:
+                await self._fetch_configs()
+            except Exception as e:
+                print(f"Config refresh from {self.server} failed: {e}")
+
+    async def run(self):
+        await self.spool.write(lambda conn: conn.execute(SPOOL_TABLE))
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        backoff = SHIP_INTERVAL
+        while True:
+            try:
+                last_seq = await self._fetch_configs()
+                break
+            except Exception as e:
+                print(f"Can't reach {self.server}, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+        await self.spool.write(_resume, last_seq)
+        print(f"Agent {self.agent_id} running {len(self._configs)} configs, reporting to {self.server}")
+
+        tasks = [
+            asyncio.create_task(self.scheduler.run_forever()),
+            asyncio.create_task(self._flush_forever()),
+            asyncio.create_task(self._ship_forever()),
+            asyncio.create_task(self._configs_forever()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self._flush()
+            await self.tester.close()
+            await self._session.close()
+            await self.spool.close()
@@ -0,0 +1,239 @@
+import math
+import os
+import sqlite3
+from itertools import chain, groupby
+from typing import Dict, Iterable, List, Optional, Sequence
+from .rollups import RESOLUTIONS, Aggregate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PERCENTILES = (50, 90, 99)
+# Outage intervals listed per config, newest first; the totals cover all of them
+MAX_INTERVALS = 100
+# Longest window computed from raw probes, where every probe in it is read;
+# the default matches the raw retention of ping, HTTP and DNS results.
+# Longer windows are summarized from the hourly rollups instead.
+MAX_HOURS = int(os.getenv('ANALYTICS_MAX_HOURS', str(7 * 24)))
+# Rollups kept for good by default, so any window can be summarized
+ROLLUP_RESOLUTION = '1h'
+# Rows fetched from SQLite at a time while filling the columns
+CHUNK_ROWS = 65536
+
+# Rows go straight into typed columns a chunk at a time, so memory is
+# bounded by the columns themselves. A missing response time comes back
+# as -1; real ones are never negative.
+_PROBES_QUERY = '''
+    SELECT timestamp, success != 0, ifnull(response_time, -1.0) FROM test_results
+    WHERE config_id = ? AND timestamp >= ? AND timestamp < ?
+    ORDER BY timestamp
+'''
+
+# data.results of a DNS test holds one entry per server queried
+_DNS_QUERY = '''
+    SELECT server, 0, ok, ifnull(rt, -1.0)
+    FROM (
+        SELECT json_extract(s.value, '$.server') AS server,
+               json_extract(s.value, '$.success') != 0 AS ok,
+               json_extract(s.value, '$.response_time') AS rt
+        FROM test_results r, json_each(r.data, '$.results') s
+        WHERE r.config_id = ? AND r.timestamp >= ? AND r.timestamp < ?
+    )
+    WHERE server IS NOT NULL AND ok IS NOT NULL
+    ORDER BY server
+'''
+
+_ROLLUP_QUERY = f'''
+    SELECT count, success_count, rt_count, rt_sum, rt_min, rt_max, sketch
+    FROM results_rollup_{ROLLUP_RESOLUTION}
+    WHERE config_id = ? AND bucket >= ? AND bucket < ?
+'''
+
+_PROBE = numpy.dtype([('timestamp', 'i8'), ('up', '?'), ('response_time', 'f8')]) if numpy is not None else None
+
+
+def _rows(cursor: sqlite3.Cursor) -> Iterable[tuple]:
+    """A query's rows, fetched CHUNK_ROWS at a time"""
+    return chain.from_iterable(iter(lambda: cursor.fetchmany(CHUNK_ROWS), []))
+
+
+def _columns(rows: Iterable[tuple]):
+    """Timestamps, up flags and successful response times from (timestamp, ok, response_time) rows"""
+    if numpy is not None:
+        probes = numpy.fromiter(rows, _PROBE)
+        up, times = probes['up'], probes['response_time']
+        return probes['timestamp'], up, times[up & (times >= 0)]
+    timestamps, up, times = [], [], []
+    for timestamp, ok, response_time in rows:
+        timestamps.append(timestamp)
+        up.append(bool(ok))
+        if ok and response_time >= 0:
+            times.append(response_time)
+    return timestamps, up, times
+
+
+def _count(flags) -> int:
+    return int(numpy.count_nonzero(flags)) if numpy is not None else sum(flags)
+
+
+def percentiles(values) -> Dict[str, Optional[float]]:
+    """Linearly interpolated p50/p90/p99, matching numpy.percentile's default"""
+    if not len(values):
+        return {f"p{p}": None for p in PERCENTILES}
+    if numpy is not None:
+        return {f"p{p}": float(v) for p, v in zip(PERCENTILES, numpy.percentile(values, PERCENTILES))}
+    ordered = sorted(values)
+    out = {}
+    for p in PERCENTILES:
+        rank = (len(ordered) - 1) * p / 100
+        low = math.floor(rank)
+        high = min(low + 1, len(ordered) - 1)
+        out[f"p{p}"] = ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+    return out
+
+
+def latency(values) -> dict:
+    if not len(values):
+        summary = {"mean": None}
+    else:
+        summary = {"mean": float(values.mean()) if numpy is not None else sum(values) / len(values)}
+    summary.update(percentiles(values))
+    return summary
+
+
+def _failure_runs(up) -> List[tuple]:
+    """(first index, index after the run) for each run of failed probes"""
+    if numpy is not None:
+        edges = numpy.diff((~up).astype(numpy.int8), prepend=0, append=0)
+        return list(zip(numpy.flatnonzero(edges == 1).tolist(), numpy.flatnonzero(edges == -1).tolist()))
+    runs, start = [], None
+    for i, ok in enumerate(up):
+        if not ok and start is None:
+            start = i
+        elif ok and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(up)))
+    return runs
+
+
+def outages(timestamps: Sequence[int], up: Sequence[bool], min_failures: int = 1) -> dict:
+    """Outage intervals and MTBF/MTTR from a config's probes in time order.
+
+    An outage is a run of at least min_failures failed probes; it starts
+    at the first failure and ends at the next successful probe, or is
+    still ongoing if the window ends first. MTTR is the mean duration of
+    the outages that ended; MTBF is observed uptime per outage.
+    """
+    intervals = []
+    for first, after in _failure_runs(up):
+        if after - first < min_failures:
+            continue
+        start = int(timestamps[first])
+        end = int(timestamps[after]) if after < len(timestamps) else None
+        duration = (end if end is not None else int(timestamps[-1])) - start
+        intervals.append({"start": start, "end": end, "duration_ms": duration, "failures": after - first})
+
+    observed = int(timestamps[-1]) - int(timestamps[0]) if len(timestamps) else 0
+    downtime = sum(interval["duration_ms"] for interval in intervals)
+    ended = [interval["duration_ms"] for interval in intervals if interval["end"] is not None]
+    return {
+        "count": len(intervals),
+        "observed_ms": observed,
+        "downtime_ms": downtime,
+        "mttr_ms": sum(ended) / len(ended) if ended else None,
+        "mtbf_ms": (observed - downtime) / len(intervals) if intervals else None,
+        "intervals": intervals[::-1][:MAX_INTERVALS],
+    }
+
+
+def _dns_servers(conn: sqlite3.Connection, config_id: str, start: int, end: int) -> List[dict]:
+    servers = []
+    rows = _rows(conn.execute(_DNS_QUERY, (config_id, start, end)))
+    for server, group in groupby(rows, key=lambda row: row[0]):
+        _, up, times = _columns(row[1:] for row in group)
+        count = len(up)
+        success_count = _count(up)
+        entry = {
+            "server": server,
+            "count": count,
+            "availability": success_count / count * 100 if count else None,
+        }
+        # Per-server times are stored in milliseconds
+        entry.update(latency(times))
+        servers.append(entry)
+    # Fastest typical response first
+    return sorted(servers, key=lambda entry: (entry["p50"] is None, entry["p50"] or 0))
+
+
+def configs(conn: sqlite3.Connection, config_ids: Optional[List[str]] = None) -> List[tuple]:
+    """(id, name, test_type) of every config (or the given ones), by name"""
+    rows = conn.execute("SELECT id, name, test_type FROM test_configs ORDER BY name").fetchall()
+    if config_ids is not None:
+        wanted = set(config_ids)
+        rows = [row for row in rows if row[0] in wanted]
+    return rows
+
+
+def analyze_config(conn: sqlite3.Connection, config_id: str, name: str, test_type: str, start: int, end: int,
+                   min_failures: int = 1, dns_servers: bool = False) -> dict:
+    """Availability, latency percentiles and outages for one config over [start, end)"""
+    timestamps, up, times = _columns(_rows(conn.execute(_PROBES_QUERY, (config_id, start, end))))
+    count = len(up)
+    success_count = _count(up)
+    analysis = {
+        "config_id": config_id,
+        "name": name,
+        "test_type": test_type,
+        "count": count,
+        "success_count": success_count,
+        "availability": success_count / count * 100 if count else None,
+    }
+    analysis.update(latency(times))
+    analysis["outages"] = outages(timestamps, up, min_failures)
+    # json_each over every result costs more than the probes themselves
+    if dns_servers and test_type == 'dns':
+        analysis["dns_servers"] = _dns_servers(conn, config_id, start, end)
+    return analysis
+
+
+def summarize_config(conn: sqlite3.Connection, config_id: str, name: str, test_type: str, start: int,
+                     end: int) -> dict:
+    """analyze_config's availability and latency from the hourly rollups.
+
+    Reads one row per hour rather than every probe. The window is widened
+    to whole hours, percentiles are sketch estimates (within ~2%), and
+    outages are left out since the rollups don't keep probe order.
+    """
+    width = RESOLUTIONS[ROLLUP_RESOLUTION]
+    total = Aggregate()
+    for row in conn.execute(_ROLLUP_QUERY, (config_id, start - start % width, end)):
+        total.merge(Aggregate.from_row(row))
+    analysis = {
+        "config_id": config_id,
+        "name": name,
+        "test_type": test_type,
+        "count": total.count,
+        "success_count": total.success_count,
+        "availability": total.success_count / total.count * 100 if total.count else None,
+        "mean": total.rt_sum / total.rt_count if total.rt_count else None,
+    }
+    analysis.update({f"p{p}": total.quantile(p / 100) for p in PERCENTILES})
+    analysis["outages"] = None
+    return analysis
+
+
+def analyze(conn: sqlite3.Connection, start: int, end: int, config_ids: Optional[List[str]] = None,
+            min_failures: int = 1, dns_servers: bool = False) -> List[dict]:
+    """analyze_config for every config (or the given ones) on one connection"""
+    return [analyze_config(conn, config_id, name, test_type, start, end, min_failures, dns_servers)
+            for config_id, name, test_type in configs(conn, config_ids)]
+
+
+def summarize(conn: sqlite3.Connection, start: int, end: int, config_ids: Optional[List[str]] = None) -> List[dict]:
+    """summarize_config for every config (or the given ones) on one connection"""
+    return [summarize_config(conn, config_id, name, test_type, start, end)
+            for config_id, name, test_type in configs(conn, config_ids)]
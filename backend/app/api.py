@@ -1,13 +1,28 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import asyncio
 import json
-from typing import List, Optional
-from datetime import datetime, timedelta
-from .models import TestConfig, TestResult, TestType
+import os
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import Optional
+from .models import HttpBodyMode, TestConfig, TestType
 from .network_tests import NetworkTester
-from .database import Database
+from .database import (
+    COLUMNAR_COLUMNS, RESULT_COLUMNS, Database, decode_cursor, encode_cursor, event_json, page_cursor, to_epoch_ms
+)
+from .result_encoding import ResultRow
+from .admission import AdmissionController
+from .agent import decode_batch
+from .bulk_ingest import BULK_MAX_BYTES, decode as decode_bulk
+from .broadcast import BroadcastHub
+from .detector import Detector
+from .hot_cache import HotCache
+from .result_sink import ResultSink
+from .retention import RetentionManager
+from .scheduler import Scheduler
+from .workers import PROBE_WORKERS, WorkerPool
 
 app = FastAPI(title="pingdumb API", version="1.0.0")
 
@@ -17,20 +32,63 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Sync-Cursor"],
 )
 
 db = Database()
 tester = NetworkTester()
-active_connections: List[WebSocket] = []
+result_sink = ResultSink(db)
+retention = RetentionManager(db)
+admission = AdmissionController()
+hub = BroadcastHub()
+hot_cache = HotCache()
+detector = Detector()
+# PROBE_WORKERS > 0: probes run in worker processes and this one serves reads
+workers = WorkerPool() if PROBE_WORKERS else None
+
+# json: buffered list (default); ndjson and columnar stream from the cursor
+RESULT_FORMATS = ("json", "ndjson", "columnar")
 
-# Task scheduler state
-task_schedule = {}  # {config_id: next_run_time}
-running_tasks = set()  # Track currently running tests
+# Upper bound on one /api/results/sync page
+SYNC_LIMIT_MAX = 10000
+# Worker mode: how often to look for rows the writer process committed
+FOLLOW_INTERVAL = float(os.getenv('FOLLOW_INTERVAL', '0.25'))
+# Uploaded results older than this are stored but not pushed to WebSocket clients
+LIVE_SECONDS = int(os.getenv('LIVE_SECONDS', '300'))
+# Probe results waiting on their commit before publish() pushes them
+publishing = set()
 
 @app.on_event("startup")
 async def startup():
     await db.init_db()
-    asyncio.create_task(scheduler_loop())
+    # Nothing writes results until the probes start below, so the cache
+    # and the follow cursor see the same rows
+    position = await db.sync_position()
+    since = hot_cache.warm_since()
+    recent = await db.get_results_by_timerange(since=since)
+    hot_cache.warm(recent, since, decode_cursor(position, 's', 1)[0])
+    # Baselines come from the same rows, statuses from the last stored events
+    detector.restore(await db.get_event_states())
+    detector.prime(row for row in reversed(recent) if row.agent_id is None)
+    configs = await db.get_configs()
+    if workers:
+        workers.start(configs)
+        asyncio.create_task(follow_results(position))
+        return
+    await result_sink.start()
+    scheduler.load(configs)
+    asyncio.create_task(scheduler.run_forever())
+    asyncio.create_task(retention.run_forever())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await hub.close()
+    if workers:
+        await workers.close()
+    else:
+        await tester.close()
+        await result_sink.close()
+    await db.close()
 
 @app.get("/api/health")
 async def health():
@@ -50,10 +108,15 @@ async def create_config(config_data: dict):
         interval=config_data.get("interval", 30),
         timeout=config_data.get("timeout", 5),
         enabled=config_data.get("enabled", True),
-        dns_servers=config_data.get("dns_servers")
+        dns_servers=config_data.get("dns_servers"),
+        ping_count=config_data.get("ping_count", 1),
+        ping_spacing=config_data.get("ping_spacing", 0.2),
+        http_keepalive=config_data.get("http_keepalive", True),
+        http_body=HttpBodyMode(config_data.get("http_body", HttpBodyMode.STREAM.value)),
+        store_raw=config_data.get("store_raw", False)
     )
     result = await db.save_config(config)
-    update_task_schedule(result)  # Add to scheduler
+    probes().upsert(result)
     return result.dict()
 
 @app.put("/api/configs/{config_id}")
@@ -66,16 +129,23 @@ async def update_config(config_id: str, config_data: dict):
         interval=config_data.get("interval", 30),
         timeout=config_data.get("timeout", 5),
         enabled=config_data.get("enabled", True),
-        dns_servers=config_data.get("dns_servers")
+        dns_servers=config_data.get("dns_servers"),
+        ping_count=config_data.get("ping_count", 1),
+        ping_spacing=config_data.get("ping_spacing", 0.2),
+        http_keepalive=config_data.get("http_keepalive", True),
+        http_body=HttpBodyMode(config_data.get("http_body", HttpBodyMode.STREAM.value)),
+        store_raw=config_data.get("store_raw", False)
     )
     result = await db.update_config(config)
-    update_task_schedule(result)  # Update scheduler
+    probes().upsert(result)
     return result.dict()
 
 @app.delete("/api/configs/{config_id}")
 async def delete_config(config_id: str):
     await db.delete_config(config_id)
-    remove_from_schedule(config_id)  # Remove from scheduler
+    hot_cache.drop(config_id)
+    detector.drop(config_id)
+    probes().remove(config_id)
     return {"status": "deleted"}
 
 @app.get("/api/results")
@@ -83,93 +153,303 @@ async def get_results(
     limit: Optional[int] = None, 
     hours: Optional[int] = None,
     config_id: Optional[str] = None,
-    since: Optional[str] = None
+    since: Optional[str] = None,
+    format: str = "json",
+    cursor: Optional[str] = None,
+    agent_id: Optional[str] = None
+):
+    if format not in RESULT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    results = None
+    if format == "json" and not cursor and not agent_id:
+        try:
+            results = hot_cache.query(hours, limit, config_id, since)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if results is not None:
+        # The cache holds every result up to its last id, so a hit needs no read
+        headers = {"X-Sync-Cursor": encode_cursor('s', hot_cache.last_id)}
+    else:
+        # Taken before the query so a client resuming from it via
+        # /api/results/sync can't miss rows committed in between
+        headers = {"X-Sync-Cursor": await db.sync_position()}
+    try:
+        if format == "json":
+            if results is None:
+                results = await db.get_results_by_timerange(hours, limit, config_id, since, cursor, agent_id)
+        else:
+            columns = COLUMNAR_COLUMNS if format == "columnar" else RESULT_COLUMNS
+            chunks = db.stream_results(hours, limit, config_id, since, columns, cursor, agent_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "json":
+        if limit and len(results) == limit:
+            headers["X-Next-Cursor"] = page_cursor(results[-1])
+        # Rows serialize themselves; skips FastAPI's jsonable_encoder pass
+        return Response(b"[" + b",".join(result.to_json() for result in results) + b"]",
+                        media_type="application/json", headers=headers)
+    encode = _columnar_lines if format == "columnar" else _ndjson_lines
+    return StreamingResponse(encode(chunks), media_type="application/x-ndjson", headers=headers)
+
+async def _ndjson_lines(chunks):
+    """One result per line, same shape as the json format"""
+    # Close the row stream too when the client goes away mid-response,
+    # handing its reader connection back to the pool
+    async with aclosing(chunks):
+        async for rows in chunks:
+            yield b"".join(ResultRow(row).to_json() + b"\n" for row in rows)
+
+async def _columnar_lines(chunks):
+    """One line per chunk of parallel arrays; timestamps are epoch ms"""
+    async with aclosing(chunks):
+        async for rows in chunks:
+            config_ids, timestamps, successes, response_times = zip(*rows)
+            yield json.dumps({
+                "config_id": config_ids,
+                "timestamp": timestamps,
+                "success": [bool(success) for success in successes],
+                "response_time": response_times,
+            }, separators=(",", ":")) + "\n"
+
+@app.get("/api/results/sync")
+async def sync_results(cursor: Optional[str] = None, config_id: Optional[str] = None, limit: int = 1000):
+    """Results committed after cursor, oldest first; poll with the returned cursor"""
+    limit = max(1, min(limit, SYNC_LIMIT_MAX))
+    try:
+        results, next_cursor = await db.sync_results(cursor, config_id, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(
+        b'{"results":[' + b",".join(result.to_json() for result in results) + b'],'
+        + json.dumps({"cursor": next_cursor, "has_more": len(results) == limit})[1:].encode(),
+        media_type="application/json",
+    )
+
+@app.get("/api/results/{result_id}/raw")
+async def get_result_raw(result_id: int):
+    raw = await db.get_raw(result_id)
+    if raw is None:
+        raise HTTPException(status_code=404, detail="No raw output stored for this result")
+    return raw
+
+@app.get("/api/results/aggregate")
+async def get_result_aggregates(
+    bucket: Optional[str] = None,
+    hours: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    config_id: Optional[str] = None
+):
+    try:
+        return await db.get_aggregates(bucket, hours, since, until, config_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/analytics")
+async def get_analytics(
+    hours: Optional[int] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    config_id: Optional[str] = None,
+    min_failures: int = 1,
+    dns_servers: bool = False
+):
+    """SLA stats for many configs at once; config_id takes a comma-separated list"""
+    config_ids = [item for item in config_id.split(",") if item] if config_id else None
+    try:
+        return await db.get_analytics(hours, since, until, config_ids, min_failures, dns_servers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/events")
+async def get_events(
+    hours: Optional[int] = None,
+    since: Optional[str] = None,
+    config_id: Optional[str] = None,
+    limit: int = 100
 ):
-    results = await db.get_results_by_timerange(hours, limit, config_id, since)
-    return [result.dict() for result in results]
+    """Degraded, down and recovered events from the detector, newest first"""
+    try:
+        return await db.get_events(hours, since, config_id, max(1, min(limit, SYNC_LIMIT_MAX)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/agents")
+async def get_agents():
+    return await db.get_agents()
+
+@app.get("/api/agents/{agent_id}/configs")
+async def get_agent_configs(agent_id: str, site: Optional[str] = None):
+    """Config set for a remote agent, plus the last spool seq stored for it"""
+    last_seq = await db.register_agent(agent_id, site)
+    configs = await db.get_configs()
+    return {"last_seq": last_seq, "configs": [config.dict() for config in configs if config.enabled]}
+
+@app.post("/api/agents/{agent_id}/batches")
+async def post_agent_batch(agent_id: str, request: Request, site: Optional[str] = None):
+    """Store a gzip'd NDJSON batch from an agent's spool; resent results are skipped"""
+    try:
+        batch = decode_batch(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    results, last_seq, unknown = await db.ingest_agent_batch(agent_id, batch, site)
+    await announce(results)
+    return {"accepted": len(results), "duplicates": len(batch) - len(results) - unknown,
+            "unknown": unknown, "last_seq": last_seq}
+
+async def read_limited(request: Request, limit: int) -> bytes:
+    """The request body, refused with a 413 before more than limit bytes are buffered"""
+    too_large = HTTPException(status_code=413, detail=f"Body larger than {limit} bytes")
+    try:
+        declared = int(request.headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if declared > limit:
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise too_large
+    return bytes(body)
+
+@app.post("/api/results/bulk")
+async def post_results_bulk(request: Request):
+    """Store many results at once from NDJSON or the PDR1 binary format.
+
+    The upload is validated as a whole and stored in one transaction, or
+    rejected with every problem found (up to a limit). Results carrying an
+    idempotency_key that is already stored are skipped, so a client can
+    retry an upload whose response it never saw.
+    """
+    body = await read_limited(request, BULK_MAX_BYTES)
+    loop = asyncio.get_running_loop()
+    try:
+        # Thousands of rows is enough parsing to stall other requests
+        columns = await loop.run_in_executor(None, decode_bulk, body, request.headers.get("content-type"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    configs = await db.get_configs()
+    problems = await loop.run_in_executor(None, columns.validate, [config.id for config in configs])
+    if problems:
+        raise HTTPException(status_code=400, detail=problems)
+    results = await db.ingest_results(await loop.run_in_executor(None, columns.results))
+    await announce(results, configs)
+    return {"received": len(columns), "inserted": len(results), "duplicates": len(columns) - len(results)}
+
+@app.get("/api/retention")
+async def get_retention():
+    last_run = workers.retention_last_run() if workers else retention.last_run
+    return {"policy": retention.policy(), "last_run": last_run}
+
+@app.get("/api/metrics")
+async def get_metrics():
+    if workers:
+        metrics = {"workers": workers.stats()}
+    else:
+        metrics = {
+            "scheduler": scheduler.stats(),
+            "admission": admission.stats(),
+            "result_sink": result_sink.stats(),
+        }
+    metrics["websocket"] = hub.stats()
+    metrics["hot_cache"] = hot_cache.stats()
+    metrics["detector"] = detector.stats()
+    return metrics
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    active_connections.append(websocket)
-    
+    client = await hub.connect(websocket)
     try:
         while True:
-            await websocket.receive_text()
+            hub.handle_message(client, await websocket.receive_text())
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
-
-async def broadcast_result(result: TestResult):
-    if active_connections:
-        message = json.dumps(result.dict())
-        for connection in active_connections[:]:
-            try:
-                await connection.send_text(message)
-            except:
-                active_connections.remove(connection)
-
-async def scheduler_loop():
-    """Main scheduler loop that respects individual test intervals"""
-    while True:
-        try:
-            now = datetime.utcnow()
-            configs = await db.get_configs()
-            
-            for config in configs:
-                if not config.enabled:
-                    continue
-                    
-                # Skip if test is currently running
-                if config.id in running_tasks:
-                    continue
-                
-                # Check if it's time to run this test
-                next_run = task_schedule.get(config.id, now)
-                if now >= next_run:
-                    # Schedule the test
-                    asyncio.create_task(run_scheduled_test(config))
-                    
-            await asyncio.sleep(10)  # Check every 10 seconds
-        except Exception as e:
-            print(f"Scheduler error: {e}")
-            await asyncio.sleep(10)
+        pass
+    finally:
+        hub.disconnect(client)
 
 async def run_scheduled_test(config: TestConfig):
-    """Run a single test and handle scheduling"""
+    """Run a single test and queue it for storage.
+
+    Returns as soon as the result is queued, so the scheduler doesn't see
+    the config as still running while the sink waits to commit; publish()
+    caches and pushes the result once it is stored.
+    """
     try:
-        # Mark as running
-        running_tasks.add(config.id)
-        
-        # Run the test
-        result = await tester.run_test(config)
-        await db.save_result(result)
-        await broadcast_result(result)
-        
-        # Schedule next run
-        next_run = datetime.utcnow() + timedelta(seconds=config.interval)
-        task_schedule[config.id] = next_run
-        
+        async with admission.slot(config.test_type):
+            result = await tester.run_test(config)
+        event = detector.observe(config.id, to_epoch_ms(result.timestamp), result.success, result.response_time)
+        committed = await result_sink.put(result)
     except Exception as e:
         print(f"Test error for {config.name}: {e}")
-        # Still schedule next run even on error
-        next_run = datetime.utcnow() + timedelta(seconds=config.interval)
-        task_schedule[config.id] = next_run
-    finally:
-        # Mark as no longer running
-        running_tasks.discard(config.id)
-
-def update_task_schedule(config: TestConfig):
-    """Update scheduling for a config (called when config is added/updated)"""
-    if config.enabled:
-        # Schedule to run immediately if new, or keep existing schedule
-        if config.id not in task_schedule:
-            task_schedule[config.id] = datetime.utcnow()
-    else:
-        # Remove from schedule if disabled
-        task_schedule.pop(config.id, None)
-        running_tasks.discard(config.id)
-
-def remove_from_schedule(config_id: str):
-    """Remove a config from scheduling (called when config is deleted)"""
-    task_schedule.pop(config_id, None)
-    running_tasks.discard(config_id)
+        return
+    task = asyncio.create_task(publish(config, result, committed, event))
+    publishing.add(task)
+    task.add_done_callback(publishing.discard)
+
+async def publish(config: TestConfig, result, committed, event):
+    """Cache a probe result and push it to live clients once it is committed"""
+    try:
+        await committed
+        # Commits resolve in id order and nothing awaits before this, so the
+        # cache's last_id never passes a committed result it hasn't seen
+        hot_cache.add(result)
+        hub.publish(result, config.test_type)
+        if event:
+            await record_events([event], {config.id: config.test_type})
+    except Exception as e:
+        print(f"Test error for {config.name}: {e}")
+
+async def announce(results, configs=None):
+    """Cache and broadcast results stored outside the probe path"""
+    # Worker mode picks these up through follow_results instead
+    if not results or workers:
+        return
+    hot_cache.add_many(results)
+    # Only live results go to clients; a backfill of old ones would flood them
+    cutoff = to_epoch_ms(datetime.now(timezone.utc)) - LIVE_SECONDS * 1000
+    live = [result for result in results if to_epoch_ms(result.timestamp) >= cutoff]
+    if live:
+        test_types = {config.id: config.test_type for config in configs or await db.get_configs()}
+        for result in live:
+            hub.publish(result, test_types.get(result.config_id))
+
+async def record_events(events, test_types):
+    """Store detector events and push them to live clients"""
+    try:
+        await db.save_events(events)
+    except Exception as e:
+        print(f"Event store error: {e}")
+    for event in events:
+        hub.publish_event(event_json(event), test_types.get(event["config_id"]))
+
+async def follow_results(cursor: str):
+    """Worker mode: cache and broadcast rows the writer process committed"""
+    while True:
+        try:
+            rows, cursor = await db.sync_results(cursor, limit=SYNC_LIMIT_MAX)
+        except Exception as e:
+            print(f"Result follow error: {e}")
+            rows = []
+        cutoff = to_epoch_ms(datetime.now(timezone.utc)) - LIVE_SECONDS * 1000
+        events = []
+        for row in rows:
+            hot_cache.add_row(row)
+            if row.timestamp_ms >= cutoff:
+                hub.publish(row, workers.test_types.get(row.config_id))
+                # Same detector stage as run_scheduled_test, for the workers' probes
+                if row.agent_id is None:
+                    event = detector.observe(row.config_id, row.timestamp_ms, row.success, row.response_time)
+                    if event:
+                        events.append(event)
+        if events:
+            await record_events(events, workers.test_types)
+        if len(rows) < SYNC_LIMIT_MAX:
+            await asyncio.sleep(FOLLOW_INTERVAL)
+
+def probes():
+    """Whatever schedules probes: the worker pool, or the in-process scheduler"""
+    return workers if workers else scheduler
+
+scheduler = Scheduler(run_scheduled_test)
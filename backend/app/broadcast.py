@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Deque, Optional, Set
+
+from fastapi import WebSocket
+from .models import TestResult
+from .result_encoding import dumps
+
+# Messages buffered per client before the oldest are dropped
+QUEUE_SIZE = int(os.getenv('WS_QUEUE_SIZE', '256'))
+# Results a batch-mode client can collect in one window before the oldest
+# are dropped; room for hundreds of fast configs over the longest window
+BATCH_SIZE = int(os.getenv('WS_BATCH_SIZE', '20000'))
+# A send that takes longer than this means the client is gone or hopeless
+SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT', '10'))
+# Longest batch window a client may ask for
+MAX_BATCH_MS = 5000
+
+# What a client in summary mode gets per result
+SUMMARY_FIELDS = ('id', 'config_id', 'timestamp', 'success', 'response_time')
+
+
+class _Client:
+    def __init__(self, websocket: WebSocket, queue_size: int, batch_size: int):
+        self.websocket = websocket
+        self.queue: Deque[str] = deque(maxlen=queue_size)
+        # Batch mode collects a whole window of results, so it gets its own
+        # buffer rather than the per-message queue
+        self.batch: Deque[str] = deque(maxlen=batch_size)
+        # Detector events skip batching and don't compete with results for space
+        self.events: Deque[str] = deque(maxlen=queue_size)
+        self.ready = asyncio.Event()
+        self.config_ids: Optional[Set[str]] = None
+        self.test_types: Optional[Set[str]] = None
+        self.batch_window = 0.0
+        self.summary = False
+        self.dropped = 0
+        # Drops the client hasn't been told about yet
+        self.unreported = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def wants(self, config_id: str, test_type: str) -> bool:
+        if self.config_ids is not None and config_id not in self.config_ids:
+            return False
+        return self.test_types is None or test_type in self.test_types
+
+    def push(self, message: str):
+        buffer = self.batch if self.batch_window > 0 else self.queue
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+            self.unreported += 1
+        buffer.append(message)
+        self.ready.set()
+
+    def take_dropped(self) -> int:
+        count, self.unreported = self.unreported, 0
+        return count
+
+    def push_event(self, message: str):
+        self.events.append(message)
+        self.ready.set()
+
+
+class BroadcastHub:
+    """Fans live results out to WebSocket clients without waiting on them.
+
+    publish() serializes a result once and appends it to each interested
+    client's bounded queue; a writer task per client drains its own queue.
+    A slow client only loses its own oldest messages, and is told how many
+    with a {"type": "dropped", "count": n} message; a send stuck for
+    SEND_TIMEOUT drops the connection.
+
+    Clients narrow what they receive by sending
+    {"action": "subscribe", "config_ids": [...], "test_types": [...]};
+    an omitted or null list matches everything, and
+    {"action": "unsubscribe"} goes back to receiving all results.
+
+    {"action": "batch", "window_ms": 250, "summary": true} switches a
+    client to one {"type": "batch", "results": [...]} message per window,
+    optionally with only SUMMARY_FIELDS per result; window_ms 0 goes back
+    to a message per result. A window's results collect in a buffer of
+    batch_size, and a batch that follows losses carries "dropped": n.
+
+    Detector events go to the same subscribers as their config's results,
+    as their own {"type": "event", "event": {...}} messages, ahead of any
+    queued results.
+    """
+
+    def __init__(self, queue_size: int = None, batch_size: int = None):
+        self.queue_size = queue_size or QUEUE_SIZE
+        self.batch_size = batch_size or BATCH_SIZE
+        self._clients: Set[_Client] = set()
+        self._published = 0
+        self._dropped = 0
+        self._disconnected = 0
+        self._batches = 0
+
+    async def connect(self, websocket: WebSocket) -> _Client:
+        await websocket.accept()
+        client = _Client(websocket, self.queue_size, self.batch_size)
+        client.task = asyncio.create_task(self._writer(client))
+        self._clients.add(client)
+        return client
+
+    def disconnect(self, client: _Client):
+        if client in self._clients:
+            self._clients.discard(client)
+            self._dropped += client.dropped
+            self._disconnected += 1
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def handle_message(self, client: _Client, text: str):
+        """Apply a subscription message sent by the client"""
+        try:
+            message = json.loads(text)
+            action = message.get("action")
+        except (ValueError, AttributeError):
+            return
+        if action == "subscribe":
+            config_ids = message.get("config_ids")
+            test_types = message.get("test_types")
+            client.config_ids = set(config_ids) if config_ids is not None else None
+            client.test_types = set(test_types) if test_types is not None else None
+        elif action == "unsubscribe":
+            client.config_ids = None
+            client.test_types = None
+        elif action == "batch":
+            try:
+                window_ms = min(max(float(message.get("window_ms") or 0), 0), MAX_BATCH_MS)
+            except (TypeError, ValueError):
+                return
+            client.batch_window = window_ms / 1000
+            client.summary = bool(message.get("summary")) and client.batch_window > 0
+
+    def publish(self, result: TestResult, test_type):
+        """Queue a result for every subscribed client; never blocks"""
+        test_type = getattr(test_type, 'value', test_type)
+        targets = [client for client in self._clients if client.wants(result.config_id, test_type)]
+        if not targets:
+            return
+        full = result.dict()
+        message = summary = None
+        for client in targets:
+            # Each variant is serialized at most once, however many clients want it
+            if client.summary:
+                if summary is None:
+                    summary = dumps({field: full[field] for field in SUMMARY_FIELDS}).decode()
+                client.push(summary)
+            else:
+                if message is None:
+                    message = dumps(full).decode()
+                client.push(message)
+        self._published += 1
+
+    def publish_event(self, event: dict, test_type):
+        """Queue a detector event for every client subscribed to its config"""
+        test_type = getattr(test_type, 'value', test_type)
+        message = None
+        for client in self._clients:
+            if client.wants(event["config_id"], test_type):
+                if message is None:
+                    message = dumps({"type": "event", "event": event}).decode()
+                client.push_event(message)
+
+    async def _send_events(self, client: _Client):
+        while client.events:
+            message = client.events.popleft()
+            await asyncio.wait_for(client.websocket.send_text(message), SEND_TIMEOUT)
+
+    async def _writer(self, client: _Client):
+        try:
+            while True:
+                await client.ready.wait()
+                if client.batch_window > 0:
+                    # Events don't wait for the window
+                    await self._send_events(client)
+                    # Let the window fill, then send everything queued as one frame
+                    await asyncio.sleep(client.batch_window)
+                    client.ready.clear()
+                    await self._send_events(client)
+                    # Anything queued before batching was switched on goes first
+                    results = list(client.queue) + list(client.batch)
+                    client.queue.clear()
+                    client.batch.clear()
+                    dropped = client.take_dropped()
+                    if results or dropped:
+                        batch = '{"type":"batch","results":[' + ','.join(results) + ']'
+                        batch += f',"dropped":{dropped}}}' if dropped else '}'
+                        await asyncio.wait_for(client.websocket.send_text(batch), SEND_TIMEOUT)
+                        self._batches += 1
+                    continue
+                client.ready.clear()
+                await self._send_events(client)
+                dropped = client.take_dropped()
+                if dropped:
+                    await asyncio.wait_for(
+                        client.websocket.send_text(f'{{"type":"dropped","count":{dropped}}}'), SEND_TIMEOUT
+                    )
+                # Leftovers from a batch window that was just switched off
+                while client.batch:
+                    client.queue.appendleft(client.batch.pop())
+                while client.queue:
+                    message = client.queue.popleft()
+                    await asyncio.wait_for(client.websocket.send_text(message), SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"WebSocket send failed, dropping client: {e}")
+            self.disconnect(client)
+            try:
+                await client.websocket.close()
+            except Exception:
+                pass
+
+    async def close(self):
+        for client in list(self._clients):
+            self.disconnect(client)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "published": self._published,
+            "queued": sum(len(client.queue) + len(client.batch) + len(client.events) for client in self._clients),
+            "dropped": self._dropped + sum(client.dropped for client in self._clients),
+            "disconnected": self._disconnected,
+            "batches": self._batches,
+        }
@@ -0,0 +1,233 @@
+import json
+import math
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Sequence
+
+from .models import TestResult
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Limits for one POST /api/results/bulk request
+BULK_MAX_ROWS = int(os.getenv('BULK_MAX_ROWS', '100000'))
+BULK_MAX_BYTES = int(os.getenv('BULK_MAX_BYTES', str(64 * 1024 * 1024)))
+# Errors reported back for a rejected request
+MAX_ERRORS = 20
+
+NDJSON = "application/x-ndjson"
+# Little-endian fixed-width records for backfills with no data payload:
+#   b"PDR1", uint16 config count, then per config uint16 length + utf-8 id,
+#   then records of (uint16 config index, int64 timestamp ms, uint8 success,
+#   float64 response_time with NaN for none, 16 byte idempotency key with
+#   all zero bytes for none). The key is stored as 32 hex digits.
+BINARY = "application/vnd.pingdumb.results"
+BINARY_MAGIC = b"PDR1"
+RECORD = struct.Struct('<HqBd16s')
+_NO_KEY = bytes(16)
+
+# Anything earlier than this is a unit mistake (seconds for milliseconds)
+MIN_TIMESTAMP_MS = 946684800000  # 2000-01-01
+FUTURE_SLACK_MS = 24 * 3600 * 1000
+# Last millisecond of year 9999, the most a datetime can hold
+MAX_TIMESTAMP_MS = 253402300799999
+
+
+def decompress(body: bytes, limit: int = BULK_MAX_BYTES) -> bytes:
+    """Gunzip body if it is gzip'd, refusing to inflate past limit"""
+    if body[:2] != b'\x1f\x8b':
+        return body
+    decompressor = zlib.decompressobj(31)
+    try:
+        body = decompressor.decompress(body, limit)
+    except zlib.error as e:
+        raise ValueError(f"Bad gzip body: {e}")
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"Body larger than {limit} bytes")
+    return body
+
+
+def _reject_constant(name: str):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def loads(line: bytes):
+    """json.loads without NaN and Infinity, which stored data would hand back as invalid JSON"""
+    return json.loads(line, parse_constant=_reject_constant)
+
+
+def check_error(error):
+    """An uploaded error message, which must be a string when present"""
+    if error is not None and not isinstance(error, str):
+        raise ValueError("error must be a string")
+    return error
+
+
+def _timestamp_ms(value) -> int:
+    if isinstance(value, str):
+        timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return int(timestamp.timestamp() * 1000)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Caught here so Infinity or a huge integer is a bad row, not a
+        # crash in int() or in numpy's int64 conversion
+        if not (math.isfinite(value) and -MAX_TIMESTAMP_MS <= value <= MAX_TIMESTAMP_MS):
+            raise ValueError("timestamp out of range")
+        return int(value)
+    raise ValueError("timestamp must be an ISO string or epoch milliseconds")
+
+
+class Columns:
+    """A request's rows as parallel columns, validated all at once"""
+
+    def __init__(self, config_ids: Sequence[str], timestamps, successes, response_times,
+                 keys: Sequence[Optional[str]], errors: Sequence[Optional[str]] = None,
+                 data: Sequence[Optional[dict]] = None):
+        self.config_ids = config_ids
+        self.timestamps = timestamps
+        self.successes = successes
+        self.response_times = response_times
+        self.keys = keys
+        self.errors = errors
+        self.data = data
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def validate(self, known_configs: Iterable[str]) -> List[str]:
+        """Problems with the rows, as "row N: ..." messages; empty when all are valid"""
+        now = int(time.time() * 1000)
+        known = set(known_configs)
+        unknown = [config_id not in known for config_id in self.config_ids]
+        if numpy is not None:
+            timestamps = numpy.asarray(self.timestamps, dtype=numpy.int64)
+            response_times = numpy.asarray(self.response_times, dtype=numpy.float64)
+            bad_time = (timestamps < MIN_TIMESTAMP_MS) | (timestamps > now + FUTURE_SLACK_MS)
+            # NaN stands for "no response time"
+            bad_response = numpy.isinf(response_times) | (response_times < 0)
+            bad = numpy.flatnonzero(bad_time | bad_response | numpy.asarray(unknown, dtype=bool))
+            rows = bad[:MAX_ERRORS].tolist()
+            bad_time, bad_response = bad_time.tolist(), bad_response.tolist()
+        else:
+            bad_time = [not MIN_TIMESTAMP_MS <= ts <= now + FUTURE_SLACK_MS for ts in self.timestamps]
+            bad_response = [math.isinf(rt) or rt < 0 for rt in self.response_times]
+            rows = [i for i in range(len(self)) if bad_time[i] or bad_response[i] or unknown[i]][:MAX_ERRORS]
+
+        problems = []
+        for i in rows:
+            if unknown[i]:
+                problems.append(f"row {i + 1}: unknown config_id {self.config_ids[i]!r}")
+            elif bad_time[i]:
+                problems.append(f"row {i + 1}: timestamp out of range")
+            else:
+                problems.append(f"row {i + 1}: response_time must be a non-negative number")
+        return problems
+
+    def results(self) -> List[TestResult]:
+        out = []
+        for i in range(len(self)):
+            response_time = float(self.response_times[i])
+            out.append(TestResult(
+                config_id=self.config_ids[i],
+                timestamp=datetime.fromtimestamp(int(self.timestamps[i]) / 1000, tz=timezone.utc),
+                success=bool(self.successes[i]),
+                response_time=None if math.isnan(response_time) else response_time,
+                error=self.errors[i] if self.errors else None,
+                data=self.data[i] if self.data else None,
+                idempotency_key=self.keys[i],
+            ))
+        return out
+
+
+def decode_ndjson(body: bytes) -> Columns:
+    config_ids, timestamps, successes, response_times, keys, errors, data = [], [], [], [], [], [], []
+    for number, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        if len(timestamps) >= BULK_MAX_ROWS:
+            raise ValueError(f"More than {BULK_MAX_ROWS} results")
+        try:
+            item = loads(line)
+            response_time = item.get("response_time")
+            payload = item.get("data")
+            if payload is not None and not isinstance(payload, dict):
+                raise ValueError("data must be an object")
+            key = item.get("idempotency_key")
+            success = item["success"]
+            if not isinstance(success, bool):
+                raise ValueError("success must be true or false")
+            config_ids.append(str(item["config_id"]))
+            timestamps.append(_timestamp_ms(item["timestamp"]))
+            successes.append(success)
+            response_times.append(float(response_time) if response_time is not None else math.nan)
+            keys.append(str(key) if key is not None else None)
+            errors.append(check_error(item.get("error")))
+            data.append(payload)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise ValueError(f"Line {number}: {e!r}")
+    return Columns(config_ids, timestamps, successes, response_times, keys, errors, data)
+
+
+def decode_binary(body: bytes) -> Columns:
+    if body[:4] != BINARY_MAGIC:
+        raise ValueError("Not a PDR1 body")
+    try:
+        (count,) = struct.unpack_from('<H', body, 4)
+        offset = 6
+        config_table = []
+        for _ in range(count):
+            (length,) = struct.unpack_from('<H', body, offset)
+            config_table.append(body[offset + 2:offset + 2 + length].decode())
+            offset += 2 + length
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Bad config table: {e}")
+
+    records = body[offset:]
+    if len(records) % RECORD.size:
+        raise ValueError(f"Record section is not a multiple of {RECORD.size} bytes")
+    rows = len(records) // RECORD.size
+    if rows > BULK_MAX_ROWS:
+        raise ValueError(f"More than {BULK_MAX_ROWS} results")
+
+    if numpy is not None:
+        array = numpy.frombuffer(records, dtype=numpy.dtype([
+            ('config', '<u2'), ('timestamp', '<i8'), ('success', 'u1'),
+            ('response_time', '<f8'), ('key', 'V16'),
+        ]))
+        indexes = array['config']
+        if rows and int(indexes.max()) >= count:
+            raise ValueError(f"row {int(numpy.argmax(indexes >= count)) + 1}: config index out of range")
+        successes = array['success'].tolist()
+        timestamps = array['timestamp'].tolist()
+        response_times = array['response_time'].tolist()
+        raw_keys = [bytes(key) for key in array['key']]
+        indexes = indexes.tolist()
+    else:
+        unpacked = list(RECORD.iter_unpack(records))
+        indexes = [record[0] for record in unpacked]
+        if any(index >= count for index in indexes):
+            raise ValueError(f"row {next(i for i, index in enumerate(indexes) if index >= count) + 1}: "
+                             "config index out of range")
+        timestamps = [record[1] for record in unpacked]
+        successes = [record[2] for record in unpacked]
+        response_times = [record[3] for record in unpacked]
+        raw_keys = [record[4] for record in unpacked]
+
+    return Columns(
+        [config_table[index] for index in indexes], timestamps, successes, response_times,
+        [None if key == _NO_KEY else key.hex() for key in raw_keys],
+    )
+
+
+def decode(body: bytes, content_type: Optional[str]) -> Columns:
+    """Columns for a bulk request body, by content type; raises ValueError"""
+    body = decompress(body)
+    if (content_type or "").split(";")[0].strip() == BINARY:
+        return decode_binary(body)
+    return decode_ndjson(body)
@@ -1,49 +1,207 @@
+import asyncio
+import base64
 import sqlite3
 import json
 import uuid
-from datetime import datetime
-from typing import List, Optional
-from .models import TestConfig, TestResult
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from . import analytics
+from .models import HttpBodyMode, TestConfig, TestResult
+from .result_encoding import ResultRow, decode_raw, encode_data, store_raw
+from .rollups import apply_phase_rollups, apply_rollups, delete_rollups, parse_bucket, query_aggregates
+from .schema import create_schema, migrate
 
 import os
 
+class ConnectionPool:
+    """Long-lived SQLite connections: one writer thread plus a small reader pool.
+
+    Every statement runs on an executor thread so the event loop never blocks
+    on disk I/O. WAL mode lets readers keep going while the writer commits.
+    """
+
+    def __init__(self, db_path: str, readers: int = 4):
+        self.db_path = db_path
+        self.readers = readers
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._reader_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._writer: Optional[sqlite3.Connection] = None
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._reader_count = 0
+        self._connections: List[sqlite3.Connection] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # Only takes effect on a brand new file, so it must come before the
+        # WAL switch; lets retention hand pages back with incremental_vacuum
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self._connections.append(conn)
+        return conn
+
+    def _run_write(self, fn: Callable, args: tuple) -> Any:
+        if self._writer is None:
+            self._writer = self._connect()
+        try:
+            result = fn(self._writer, *args)
+            self._writer.commit()
+            return result
+        except Exception:
+            self._writer.rollback()
+            raise
+
+    async def write(self, fn: Callable, *args) -> Any:
+        """Run fn(conn, *args) on the writer thread inside a single transaction"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_executor, self._run_write, fn, args)
+
+    async def _acquire_reader(self) -> sqlite3.Connection:
+        if self._idle_readers is None:
+            self._idle_readers = asyncio.Queue()
+        if self._idle_readers.empty() and self._reader_count < self.readers:
+            self._reader_count += 1
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._reader_executor, self._connect)
+            except Exception:
+                self._reader_count -= 1
+                raise
+        return await self._idle_readers.get()
+
+    async def read(self, fn: Callable, *args) -> Any:
+        """Run fn(conn, *args) on a pooled reader connection"""
+        conn = await self._acquire_reader()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._reader_executor, fn, conn, *args)
+        finally:
+            self._idle_readers.put_nowait(conn)
+
+    async def stream(self, query: str, params: tuple = (), chunk_size: int = 1000) -> AsyncIterator[list]:
+        """Yield rows in chunks of chunk_size from a reader held for the whole scan"""
+        conn = await self._acquire_reader()
+        loop = asyncio.get_running_loop()
+        cursor = None
+        pending = None
+        try:
+            pending = loop.run_in_executor(self._reader_executor, conn.execute, query, params)
+            cursor = await pending
+            while True:
+                pending = loop.run_in_executor(self._reader_executor, cursor.fetchmany, chunk_size)
+                rows = await pending
+                if not rows:
+                    return
+                yield rows
+        finally:
+            # A disconnecting client cancels us mid-fetch; the executor call
+            # still owns the connection until it finishes
+            if pending is not None and not pending.done():
+                await asyncio.wait([pending])
+            if cursor is not None:
+                # Ends the read transaction so WAL checkpoints can proceed
+                cursor.close()
+            self._idle_readers.put_nowait(conn)
+
+    async def close(self):
+        self._writer_executor.shutdown(wait=True)
+        self._reader_executor.shutdown(wait=True)
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+        self._writer = None
+        self._idle_readers = None
+        self._reader_count = 0
+
+
+def _fetchall(conn: sqlite3.Connection, query: str, params: tuple = ()) -> list:
+    return conn.execute(query, params).fetchall()
+
+
+def _execute(conn: sqlite3.Connection, query: str, params: tuple = ()):
+    conn.execute(query, params)
+
+
+def to_epoch_ms(timestamp: datetime) -> int:
+    """Naive datetimes are treated as UTC, matching the legacy 'Z' suffix"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+
+def from_epoch_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+
+
+def parse_since(since: str) -> int:
+    """Convert an ISO timestamp query parameter into epoch milliseconds"""
+    try:
+        return to_epoch_ms(datetime.fromisoformat(since.replace('Z', '+00:00')))
+    except ValueError:
+        raise ValueError(f"Invalid since timestamp: {since}")
+
+
+def encode_cursor(kind: str, *values: int) -> str:
+    """Opaque cursor; kind keeps page and sync cursors from being mixed up"""
+    raw = ':'.join([kind] + [str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, kind: str, size: int) -> Tuple[int, ...]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        parts = raw.split(':')
+        if parts[0] != kind or len(parts) != size + 1:
+            raise ValueError
+        return tuple(int(part) for part in parts[1:])
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def event_json(event: dict) -> dict:
+    """A detector event as served by the API, with an ISO timestamp"""
+    event = dict(event)
+    event["timestamp"] = from_epoch_ms(event["timestamp"]).isoformat()
+    return event
+
+
+def page_cursor(row: ResultRow) -> str:
+    """Cursor for the page after row, continuing newest-first"""
+    return encode_cursor('p', row.timestamp_ms, row.id)
+
+
+# data is read as a blob so ResultRow can splice the stored JSON bytes as-is
+RESULT_COLUMNS = "id, config_id, timestamp, success, response_time, error, CAST(data AS BLOB), agent_id"
+
+# What the graphs plot; served as parallel arrays by the columnar format
+COLUMNAR_COLUMNS = "config_id, timestamp, success, response_time"
+
+STREAM_CHUNK_SIZE = int(os.getenv('RESULT_STREAM_CHUNK', '1000'))
+
+# Event fields with their own column; the rest are stored as JSON detail
+EVENT_COLUMNS = ("id", "config_id", "timestamp", "type")
+
+# Keys per IN (...) lookup, under SQLite's bound parameter limit
+IN_CHUNK_SIZE = 500
+
+
 class Database:
     def __init__(self, db_path: str = None):
         if db_path is None:
             db_path = os.getenv('DB_PATH', 'network_tests.db')
         self.db_path = db_path
-    
+        self.pool = ConnectionPool(db_path, readers=int(os.getenv('DB_READERS', '4')))
+
     async def init_db(self):
-        conn = sqlite3.connect(self.db_path)
+        await self.pool.write(self._create_schema)
+        await migrate(self.pool)
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        create_schema(conn)
         cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS test_configs (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                test_type TEXT NOT NULL,
-                target TEXT NOT NULL,
-                interval INTEGER DEFAULT 30,
-                timeout INTEGER DEFAULT 5,
-                enabled BOOLEAN DEFAULT 1,
-                dns_servers TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS test_results (
-                id TEXT PRIMARY KEY,
-                config_id TEXT NOT NULL,
-                timestamp TIMESTAMP NOT NULL,
-                success BOOLEAN NOT NULL,
-                response_time REAL,
-                error TEXT,
-                data TEXT,
-                FOREIGN KEY (config_id) REFERENCES test_configs (id)
-            )
-        ''')
-        
+
         # Create default configs
         cursor.execute("SELECT COUNT(*) FROM test_configs")
         if cursor.fetchone()[0] == 0:
@@ -53,34 +211,33 @@ class Database:
                 ("Google HTTP", "http", "https://google.com"),
                 ("Local Gateway", "ping", "192.168.1.1"),
             ]
-            
+
             for name, test_type, target in default_configs:
                 config_id = str(uuid.uuid4())
                 cursor.execute('''
                     INSERT INTO test_configs (id, name, test_type, target)
                     VALUES (?, ?, ?, ?)
                 ''', (config_id, name, test_type, target))
-        
-        conn.commit()
-        conn.close()
-    
+
+    async def close(self):
+        await self.pool.close()
+
     async def get_configs(self) -> List[TestConfig]:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM test_configs ORDER BY created_at")
-        rows = cursor.fetchall()
-        conn.close()
-        
+        rows = await self.pool.read(_fetchall, '''
+            SELECT id, name, test_type, target, interval, timeout, enabled, dns_servers,
+                   created_at, ping_count, ping_spacing, http_keepalive, http_body, store_raw
+            FROM test_configs ORDER BY created_at
+        ''')
+
         configs = []
         for row in rows:
             dns_servers = None
-            if len(row) > 7 and row[7]:  # dns_servers field exists and has value
+            if row[7]:
                 try:
                     dns_servers = json.loads(row[7])
                 except:
                     dns_servers = None
-                    
+
             configs.append(TestConfig(
                 id=row[0],
                 name=row[1],
@@ -90,166 +247,434 @@ class Database:
                 timeout=row[5],
                 enabled=bool(row[6]),
                 dns_servers=dns_servers,
-                created_at=datetime.fromisoformat(row[8]) if len(row) > 8 and row[8] else None
+                created_at=datetime.fromisoformat(row[8]) if row[8] else None,
+                ping_count=row[9] or 1,
+                ping_spacing=row[10] if row[10] is not None else 0.2,
+                http_keepalive=bool(row[11]) if row[11] is not None else True,
+                http_body=row[12] or HttpBodyMode.STREAM.value,
+                store_raw=bool(row[13])
             ))
-        
+
         return configs
-    
+
     async def save_config(self, config: TestConfig) -> TestConfig:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         if not config.id:
             config.id = str(uuid.uuid4())
             dns_servers_json = json.dumps(config.dns_servers) if config.dns_servers else None
-            cursor.execute('''
-                INSERT INTO test_configs (id, name, test_type, target, interval, timeout, enabled, dns_servers)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (config.id, config.name, config.test_type, config.target, 
-                  config.interval, config.timeout, config.enabled, dns_servers_json))
-        else:
-            dns_servers_json = json.dumps(config.dns_servers) if config.dns_servers else None
-            cursor.execute('''
-                UPDATE test_configs 
-                SET name=?, test_type=?, target=?, interval=?, timeout=?, enabled=?, dns_servers=?
-                WHERE id=?
-            ''', (config.name, config.test_type, config.target, config.interval,
-                  config.timeout, config.enabled, dns_servers_json, config.id))
-        
-        conn.commit()
-        conn.close()
-        return config
-    
+            await self.pool.write(_execute, '''
+                INSERT INTO test_configs (id, name, test_type, target, interval, timeout, enabled, dns_servers,
+                                          ping_count, ping_spacing, http_keepalive, http_body, store_raw)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (config.id, config.name, config.test_type, config.target,
+                  config.interval, config.timeout, config.enabled, dns_servers_json,
+                  config.ping_count, config.ping_spacing, config.http_keepalive, config.http_body,
+                  config.store_raw))
+            return config
+
+        return await self.update_config(config)
+
     async def update_config(self, config: TestConfig) -> TestConfig:
         """Update an existing test configuration"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # Prepare DNS servers JSON
         dns_servers_json = json.dumps(config.dns_servers) if config.dns_servers else None
-        
-        cursor.execute('''
-            UPDATE test_configs 
-            SET name=?, test_type=?, target=?, interval=?, timeout=?, enabled=?, dns_servers=?
+
+        await self.pool.write(_execute, '''
+            UPDATE test_configs
+            SET name=?, test_type=?, target=?, interval=?, timeout=?, enabled=?, dns_servers=?,
+                ping_count=?, ping_spacing=?, http_keepalive=?, http_body=?, store_raw=?
             WHERE id=?
         ''', (config.name, config.test_type, config.target, config.interval,
-              config.timeout, config.enabled, dns_servers_json, config.id))
-        
-        conn.commit()
-        conn.close()
+              config.timeout, config.enabled, dns_servers_json,
+              config.ping_count, config.ping_spacing, config.http_keepalive, config.http_body,
+              config.store_raw, config.id))
+
         return config
-    
+
     async def delete_config(self, config_id: str):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM test_configs WHERE id=?", (config_id,))
-        cursor.execute("DELETE FROM test_results WHERE config_id=?", (config_id,))
-        conn.commit()
-        conn.close()
-    
+        def _delete(conn):
+            conn.execute("DELETE FROM test_configs WHERE id=?", (config_id,))
+            conn.execute("DELETE FROM test_results WHERE config_id=?", (config_id,))
+            conn.execute("DELETE FROM events WHERE config_id=?", (config_id,))
+            delete_rollups(conn, config_id)
+
+        await self.pool.write(_delete)
+
     async def save_result(self, result: TestResult):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        result.id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO test_results (id, config_id, timestamp, success, response_time, error, data)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (result.id, result.config_id, result.timestamp.isoformat() + 'Z',
-              result.success, result.response_time, result.error,
-              json.dumps(result.data) if result.data else None))
-        
-        conn.commit()
-        conn.close()
-    
-    async def get_recent_results(self, limit: int = 1000) -> List[TestResult]:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM test_results 
-            ORDER BY timestamp DESC 
+        await self.save_results([result])
+
+    def _insert_results(self, conn: sqlite3.Connection, results: List[TestResult]):
+        """Insert results and fold them into the rollups; runs on the writer"""
+        if not results:
+            return
+        rows = [
+            (result.config_id, to_epoch_ms(result.timestamp),
+             result.success, result.response_time, result.error,
+             encode_data(result.data))
+            for result in results
+        ]
+        raw_ids = [store_raw(conn, result.raw) if result.raw else None for result in results]
+        # SQLite hands out the ids, so a second writer (a worker process's
+        # ingest next to the writer process) can't collide with these. The
+        # transaction holds the write lock for the whole executemany, so
+        # AUTOINCREMENT gives the batch consecutive ids ending at the last one
+        conn.executemany('''
+            INSERT INTO test_results (config_id, timestamp, success, response_time, error, data, raw_id,
+                                      agent_id, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [row + (raw_ids[i], results[i].agent_id, results[i].idempotency_key)
+              for i, row in enumerate(rows)])
+        first_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(results) + 1
+        for i, result in enumerate(results):
+            result.id = first_id + i
+        apply_rollups(conn, (row[:4] for row in rows))
+        apply_phase_rollups(conn, (
+            (row[0], row[1], result.data["timings"])
+            for row, result in zip(rows, results)
+            if result.success and result.data and result.data.get("timings")
+        ))
+
+    async def save_results(self, results: List[TestResult]):
+        """Insert a batch of results in a single transaction"""
+        await self.pool.write(self._insert_results, results)
+
+    async def register_agent(self, agent_id: str, site: Optional[str] = None) -> int:
+        """Record an agent check-in; returns the last sequence number stored for it"""
+        def _register(conn):
+            conn.execute('''
+                INSERT INTO agents (id, site, last_seen) VALUES (?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET site = COALESCE(excluded.site, site), last_seen = excluded.last_seen
+            ''', (agent_id, site, to_epoch_ms(datetime.now(timezone.utc))))
+            return conn.execute("SELECT last_seq FROM agents WHERE id = ?", (agent_id,)).fetchone()[0]
+
+        return await self.pool.write(_register)
+
+    async def ingest_agent_batch(
+        self,
+        agent_id: str,
+        batch: List[Tuple[int, TestResult]],
+        site: Optional[str] = None
+    ) -> Tuple[List[TestResult], int, int]:
+        """Store (seq, result) pairs from an agent's spool in one transaction.
+
+        Anything at or below the agent's last stored seq is a resend and is
+        skipped, so retrying a batch never duplicates rows. Results for
+        configs that don't exist (deleted while the agent spooled them) are
+        skipped too but still count towards last_seq. Returns the results
+        actually inserted, the new last_seq and how many had unknown configs.
+        """
+        def _ingest(conn):
+            row = conn.execute("SELECT last_seq FROM agents WHERE id = ?", (agent_id,)).fetchone()
+            last_seq = row[0] if row else 0
+            fresh = [(seq, result) for seq, result in batch if seq > last_seq]
+            known = {config_id for (config_id,) in conn.execute("SELECT id FROM test_configs")}
+            results = [result for _, result in fresh if result.config_id in known]
+            for result in results:
+                result.agent_id = agent_id
+            self._insert_results(conn, results)
+            last_seq = max([last_seq] + [seq for seq, _ in fresh])
+            conn.execute('''
+                INSERT INTO agents (id, site, last_seq, last_seen) VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET site = COALESCE(excluded.site, site),
+                    last_seq = excluded.last_seq, last_seen = excluded.last_seen
+            ''', (agent_id, site, last_seq, to_epoch_ms(datetime.now(timezone.utc))))
+            return results, last_seq, len(fresh) - len(results)
+
+        return await self.pool.write(_ingest)
+
+    async def ingest_results(self, results: List[TestResult]) -> List[TestResult]:
+        """Store a bulk upload in one transaction; returns the results inserted.
+
+        A result whose idempotency_key is already stored, or appears earlier
+        in the same upload, is skipped, so a retried upload is a no-op.
+        """
+        def _ingest(conn):
+            keys = list({result.idempotency_key for result in results if result.idempotency_key is not None})
+            seen = set()
+            for start in range(0, len(keys), IN_CHUNK_SIZE):
+                chunk = keys[start:start + IN_CHUNK_SIZE]
+                seen.update(key for (key,) in conn.execute(
+                    f"SELECT idempotency_key FROM test_results WHERE idempotency_key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ))
+            fresh = []
+            for result in results:
+                key = result.idempotency_key
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                fresh.append(result)
+            self._insert_results(conn, fresh)
+            return fresh
+
+        return await self.pool.write(_ingest)
+
+    async def save_events(self, events: List[dict]):
+        """Store detector events, setting each one's id"""
+        def _save(conn):
+            for event in events:
+                detail = {key: value for key, value in event.items() if key not in EVENT_COLUMNS}
+                cursor = conn.execute(
+                    "INSERT INTO events (config_id, timestamp, type, detail) VALUES (?, ?, ?, ?)",
+                    (event["config_id"], event["timestamp"], event["type"], json.dumps(detail)),
+                )
+                event["id"] = cursor.lastrowid
+
+        await self.pool.write(_save)
+
+    async def get_events(
+        self,
+        hours: Optional[int] = None,
+        since: Optional[str] = None,
+        config_id: Optional[str] = None,
+        limit: int = 100
+    ) -> List[dict]:
+        """Detector events, newest first"""
+        conditions, params = [], []
+        if hours:
+            conditions.append("timestamp >= ?")
+            params.append(to_epoch_ms(datetime.now(timezone.utc)) - hours * 3600 * 1000)
+        elif since:
+            conditions.append("timestamp >= ?")
+            params.append(parse_since(since))
+        if config_id:
+            conditions.append("config_id = ?")
+            params.append(config_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self.pool.read(_fetchall, f'''
+            SELECT id, config_id, timestamp, type, detail FROM events {where}
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+        ''', tuple(params) + (limit,))
+        return [
+            event_json(dict(json.loads(detail) if detail else {},
+                            id=event_id, config_id=event_config_id, timestamp=timestamp, type=kind))
+            for event_id, event_config_id, timestamp, kind, detail in rows
+        ]
+
+    async def get_event_states(self) -> Dict[str, Tuple[str, int]]:
+        """Each config's status as of its latest event, and when that began"""
+        rows = await self.pool.read(_fetchall, '''
+            SELECT config_id, type, MAX(timestamp) FROM events GROUP BY config_id
+        ''')
+        return {config_id: ("up" if kind == "recovered" else kind, timestamp) for config_id, kind, timestamp in rows}
+
+    async def get_agents(self) -> List[dict]:
+        rows = await self.pool.read(_fetchall, '''
+            SELECT id, site, last_seq, last_seen FROM agents ORDER BY id
+        ''')
+        return [
+            {
+                "id": agent_id,
+                "site": site,
+                "last_seq": last_seq,
+                "last_seen": from_epoch_ms(last_seen).isoformat() if last_seen else None,
+            }
+            for agent_id, site, last_seq, last_seen in rows
+        ]
+
+    async def get_recent_results(self, limit: int = 1000) -> List[ResultRow]:
+        rows = await self.pool.read(_fetchall, f'''
+            SELECT {RESULT_COLUMNS} FROM test_results
+            ORDER BY timestamp DESC, id DESC
             LIMIT ?
         ''', (limit,))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        results = []
-        for row in rows:
-            results.append(TestResult(
-                id=row[0],
-                config_id=row[1],
-                timestamp=datetime.fromisoformat(row[2]),
-                success=bool(row[3]),
-                response_time=row[4],
-                error=row[5],
-                data=json.loads(row[6]) if row[6] else None
-            ))
-        
-        return results
-    
-    async def get_results_by_timerange(
-        self, 
-        hours: Optional[int] = None, 
+
+        return [ResultRow(row) for row in rows]
+
+    def _results_query(
+        self,
+        columns: str,
+        hours: Optional[int] = None,
         limit: Optional[int] = None,
         config_id: Optional[str] = None,
-        since: Optional[str] = None
-    ) -> List[TestResult]:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        since: Optional[str] = None,
+        cursor: Optional[str] = None,
+        agent_id: Optional[str] = None
+    ):
         conditions = []
         params = []
-        
+
+        if cursor:
+            # Keyset continuation; both indexes end in the implicit rowid,
+            # so they are (timestamp, id) and (config_id, timestamp, id)
+            conditions.append("(timestamp, id) < (?, ?)")
+            params.extend(decode_cursor(cursor, 'p', 2))
+
         if hours:
-            conditions.append("timestamp >= datetime('now', '-{} hours')".format(hours))
+            conditions.append("timestamp >= ?")
+            params.append(to_epoch_ms(datetime.now(timezone.utc)) - hours * 3600 * 1000)
         elif since:
             conditions.append("timestamp >= ?")
-            params.append(since)
-            
+            params.append(parse_since(since))
+
         if config_id:
             conditions.append("config_id = ?")
             params.append(config_id)
-        
-        query = "SELECT * FROM test_results"
+
+        if agent_id:
+            conditions.append("agent_id = ?")
+            params.append(agent_id)
+
+        query = f"SELECT {columns} FROM test_results"
         if conditions:
             query += " WHERE " + " AND ".join(conditions)
-        query += " ORDER BY timestamp DESC"
-        
+        query += " ORDER BY timestamp DESC, id DESC"
+
         if limit:
-            query += f" LIMIT {limit}"
-            
-        cursor.execute(query, params)
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        results = []
-        for row in rows:
-            results.append(TestResult(
-                id=row[0],
-                config_id=row[1],
-                timestamp=datetime.fromisoformat(row[2]),
-                success=bool(row[3]),
-                response_time=row[4],
-                error=row[5],
-                data=json.loads(row[6]) if row[6] else None
-            ))
-        
-        return results
-        conn.close()
-        
-        results = []
-        for row in rows:
-            results.append(TestResult(
-                id=row[0],
-                config_id=row[1],
-                timestamp=datetime.fromisoformat(row[2]),
-                success=bool(row[3]),
-                response_time=row[4],
-                error=row[5],
-                data=json.loads(row[6]) if row[6] else None
+            query += " LIMIT ?"
+            params.append(limit)
+
+        return query, tuple(params)
+
+    async def get_results_by_timerange(
+        self,
+        hours: Optional[int] = None,
+        limit: Optional[int] = None,
+        config_id: Optional[str] = None,
+        since: Optional[str] = None,
+        cursor: Optional[str] = None,
+        agent_id: Optional[str] = None
+    ) -> List[ResultRow]:
+        query, params = self._results_query(RESULT_COLUMNS, hours, limit, config_id, since, cursor, agent_id)
+        rows = await self.pool.read(_fetchall, query, params)
+
+        return [ResultRow(row) for row in rows]
+
+    def stream_results(
+        self,
+        hours: Optional[int] = None,
+        limit: Optional[int] = None,
+        config_id: Optional[str] = None,
+        since: Optional[str] = None,
+        columns: str = RESULT_COLUMNS,
+        cursor: Optional[str] = None,
+        agent_id: Optional[str] = None
+    ) -> AsyncIterator[list]:
+        """Chunks of raw rows for the same filters as get_results_by_timerange.
+
+        The query is built up front so bad parameters raise ValueError here
+        rather than halfway through a response.
+        """
+        query, params = self._results_query(columns, hours, limit, config_id, since, cursor, agent_id)
+        return self.pool.stream(query, params, STREAM_CHUNK_SIZE)
+
+    async def sync_position(self) -> str:
+        """Sync cursor for "now": results committed after this call come after it"""
+        rows = await self.pool.read(_fetchall, "SELECT COALESCE(MAX(id), 0) FROM test_results")
+        return encode_cursor('s', rows[0][0])
+
+    async def sync_results(
+        self,
+        cursor: Optional[str] = None,
+        config_id: Optional[str] = None,
+        limit: int = 1000
+    ) -> Tuple[List[ResultRow], str]:
+        """Results committed after cursor, oldest first, and the cursor to resume from.
+
+        Follows ids rather than timestamps: ids are handed out in commit
+        order, so a row whose test started earlier but was written later
+        is never skipped. Without a cursor this returns the current position.
+        """
+        if not cursor:
+            return [], await self.sync_position()
+        after = decode_cursor(cursor, 's', 1)[0]
+
+        query = f"SELECT {RESULT_COLUMNS} FROM test_results WHERE id > ? AND id <= ?"
+        if config_id:
+            # Unary + keeps SQLite on the rowid range instead of the
+            # config index, which would need a sort
+            query += " AND +config_id = ?"
+        query += " ORDER BY id LIMIT ?"
+
+        def _sync(conn):
+            high = conn.execute("SELECT COALESCE(MAX(id), 0) FROM test_results").fetchone()[0]
+            params = (after, high, config_id, limit) if config_id else (after, high, limit)
+            return high, conn.execute(query, params).fetchall()
+
+        high, rows = await self.pool.read(_sync)
+        results = [ResultRow(row) for row in rows]
+        # A short page means everything up to high was checked, even rows
+        # filtered out by config_id
+        position = results[-1].id if len(results) == limit else max(high, after)
+        return results, encode_cursor('s', position)
+
+    async def get_raw(self, result_id: int) -> Optional[dict]:
+        """Stored tool output for one result, or None if it wasn't kept"""
+        rows = await self.pool.read(_fetchall, '''
+            SELECT raw.body FROM test_results r JOIN result_raw raw ON raw.id = r.raw_id
+            WHERE r.id = ?
+        ''', (result_id,))
+        return decode_raw(rows[0][0]) if rows else None
+
+    async def get_aggregates(
+        self,
+        bucket: Optional[str] = None,
+        hours: Optional[int] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        config_id: Optional[str] = None
+    ) -> dict:
+        """Bucketed result statistics served from the rollup tables"""
+        end = parse_since(until) if until else to_epoch_ms(datetime.now(timezone.utc))
+        if hours:
+            start = end - hours * 3600 * 1000
+        elif since:
+            start = parse_since(since)
+        else:
+            start = end - 24 * 3600 * 1000
+        bucket_ms = parse_bucket(bucket) if bucket else None
+
+        aggregates = await self.pool.read(query_aggregates, start, end, bucket_ms, config_id)
+        for entry in aggregates["buckets"]:
+            entry["bucket"] = from_epoch_ms(entry["bucket"]).isoformat()
+        return aggregates
+
+    async def get_analytics(
+        self,
+        hours: Optional[int] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        config_ids: Optional[List[str]] = None,
+        min_failures: int = 1,
+        dns_servers: bool = False
+    ) -> dict:
+        """Availability, latency percentiles and outages per config.
+
+        Exact, from raw results, for windows up to analytics.MAX_HOURS;
+        longer windows are summarized from the hourly rollups.
+        """
+        end = parse_since(until) if until else to_epoch_ms(datetime.now(timezone.utc))
+        if hours:
+            start = end - hours * 3600 * 1000
+        elif since:
+            start = parse_since(since)
+        else:
+            start = end - 24 * 3600 * 1000
+        if min_failures < 1:
+            raise ValueError(f"Invalid min_failures: {min_failures}")
+
+        if end - start > analytics.MAX_HOURS * 3600 * 1000:
+            return {
+                "start": from_epoch_ms(start).isoformat(),
+                "end": from_epoch_ms(end).isoformat(),
+                "source": f"rollup_{analytics.ROLLUP_RESOLUTION}",
+                "configs": await self.pool.read(analytics.summarize, start, end, config_ids),
+            }
+
+        # One read per config, so other reads get a turn on the reader in between
+        configs = []
+        for config_id, name, test_type in await self.pool.read(analytics.configs, config_ids):
+            configs.append(await self.pool.read(
+                analytics.analyze_config, config_id, name, test_type, start, end, min_failures, dns_servers
             ))
-        
-        return results
+        for analysis in configs:
+            for interval in analysis["outages"]["intervals"]:
+                interval["start"] = from_epoch_ms(interval["start"]).isoformat()
+                if interval["end"] is not None:
+                    interval["end"] = from_epoch_ms(interval["end"]).isoformat()
+        return {
+            "start": from_epoch_ms(start).isoformat(),
+            "end": from_epoch_ms(end).isoformat(),
+            "source": "raw",
+            "configs": configs,
+        }
@@ -0,0 +1,145 @@
+import os
+from typing import Dict, Iterable, Optional
+
+# Weight of each new response time in the baseline and spread averages;
+# smaller adapts more slowly to a new normal
+ALPHA = float(os.getenv('DETECTOR_ALPHA', '0.05'))
+# Response times above baseline + THRESHOLD * spread count as slow
+THRESHOLD = float(os.getenv('DETECTOR_THRESHOLD', '6'))
+# Consecutive failed or slow probes before a config is down or degraded
+DOWN_AFTER = int(os.getenv('DETECTOR_DOWN_AFTER', '3'))
+DEGRADED_AFTER = int(os.getenv('DETECTOR_DEGRADED_AFTER', '5'))
+# Consecutive healthy probes before a down or degraded config recovers
+RECOVER_AFTER = int(os.getenv('DETECTOR_RECOVER_AFTER', '3'))
+# Response times seen before latency can flag anything
+WARMUP = int(os.getenv('DETECTOR_WARMUP', '20'))
+# Spread never counts as less than this fraction of the baseline (or
+# MIN_SPREAD_SECONDS), so a very steady series doesn't flag tiny wobbles
+MIN_SPREAD = 0.1
+MIN_SPREAD_SECONDS = 0.0005
+
+UP = "up"
+DEGRADED = "degraded"
+DOWN = "down"
+RECOVERED = "recovered"
+
+
+class _State:
+    __slots__ = ('baseline', 'spread', 'samples', 'failures', 'slow', 'healthy', 'status', 'since')
+
+    def __init__(self):
+        self.baseline = 0.0
+        self.spread = 0.0
+        self.samples = 0
+        self.failures = 0
+        self.slow = 0
+        self.healthy = 0
+        self.status = UP
+        self.since: Optional[int] = None
+
+
+class Detector:
+    """Flags configs going down, degrading and recovering as results arrive.
+
+    Each config keeps a fixed handful of numbers: an EWMA of its response
+    time, an exponentially weighted mean absolute deviation around it (a
+    rolling MAD that needs no window) and counters of consecutive failed,
+    slow and healthy probes. observe() is a few float operations and never
+    touches the database, so it runs inline on every result.
+
+    Slow response times are clipped before they update the baseline and
+    leave the spread alone, so a spike can't drag either up with it, while
+    a lasting shift still becomes the new normal over some dozens of probes.
+    """
+
+    def __init__(self):
+        self._states: Dict[str, _State] = {}
+        self.events = 0
+
+    def restore(self, statuses: Dict[str, tuple]):
+        """Resume from the last stored event per config: {config_id: (status, since_ms)}"""
+        for config_id, (status, since) in statuses.items():
+            state = self._states.setdefault(config_id, _State())
+            state.status, state.since = status, since
+
+    def prime(self, rows: Iterable):
+        """Learn baselines from recent ResultRows (oldest first) without emitting events"""
+        events = self.events
+        for row in rows:
+            state = self._states.setdefault(row.config_id, _State())
+            status, since = state.status, state.since
+            self.observe(row.config_id, row.timestamp_ms, row.success, row.response_time)
+            state.status, state.since = status, since
+        self.events = events
+
+    def drop(self, config_id: str):
+        self._states.pop(config_id, None)
+
+    def observe(self, config_id: str, timestamp_ms: int, success: bool,
+                response_time: Optional[float]) -> Optional[dict]:
+        """Fold in one result; returns an event if the config changed state"""
+        state = self._states.get(config_id)
+        if state is None:
+            state = self._states[config_id] = _State()
+
+        if not success:
+            state.failures += 1
+            state.slow = state.healthy = 0
+        else:
+            state.failures = 0
+            slow = False
+            if response_time is not None:
+                slow = self._update(state, response_time)
+            if slow:
+                state.slow += 1
+                state.healthy = 0
+            else:
+                state.slow = 0
+                state.healthy += 1
+
+        if state.failures >= DOWN_AFTER:
+            status = DOWN
+        elif state.slow >= DEGRADED_AFTER:
+            status = DEGRADED
+        elif state.healthy >= RECOVER_AFTER:
+            status = UP
+        else:
+            return None
+        if status == state.status:
+            return None
+
+        previous, since = state.status, state.since
+        state.status, state.since = status, timestamp_ms
+        self.events += 1
+        return {
+            "config_id": config_id,
+            "timestamp": timestamp_ms,
+            "type": RECOVERED if status == UP else status,
+            "previous": previous,
+            "duration_ms": timestamp_ms - since if since is not None else None,
+            "response_time": response_time,
+            "baseline": state.baseline if state.samples else None,
+            "spread": state.spread if state.samples else None,
+            "failures": state.failures,
+        }
+
+    def _update(self, state: _State, response_time: float) -> bool:
+        """Update the baseline and spread; returns True if response_time was slow"""
+        if not state.samples:
+            state.baseline = response_time
+            state.samples = 1
+            return False
+        limit = state.baseline + THRESHOLD * max(state.spread, state.baseline * MIN_SPREAD, MIN_SPREAD_SECONDS)
+        slow = state.samples >= WARMUP and response_time > limit
+        if not slow:
+            state.spread += ALPHA * (abs(response_time - state.baseline) - state.spread)
+        state.baseline += ALPHA * (min(response_time, limit) - state.baseline)
+        state.samples += 1
+        return slow
+
+    def stats(self) -> dict:
+        by_status = {DEGRADED: [], DOWN: []}
+        for config_id, state in self._states.items():
+            if state.status in by_status:
+                by_status[state.status].append(config_id)
+        return {"configs": len(self._states), "events": self.events, **by_status}
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+import dns.asyncquery
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+
+RESOLV_CONF = os.getenv('RESOLV_CONF', '/etc/resolv.conf')
+
+# Queried alongside the system nameservers when a config lists none
+PUBLIC_DNS_SERVERS = ['8.8.8.8', '1.1.1.1', '8.8.4.4', '1.0.0.1']
+
+# Config value standing for "whatever resolv.conf points at"
+LOCAL_SERVER = 'local'
+
+# First resend of an unanswered query; doubles after each one, and is
+# capped at a third of the timeout so short timeouts still get retries
+RETRANSMIT_INTERVAL = float(os.getenv('DNS_RETRANSMIT_INTERVAL', '1.0'))
+
+
+class _ChannelProtocol(asyncio.DatagramProtocol):
+    def __init__(self, channel: '_ServerChannel'):
+        self.channel = channel
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 2:
+            return
+        future = self.channel.pending.get(int.from_bytes(data[:2], 'big'))
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc: Exception):
+        # On a connected socket this is the server's ICMP error, so it
+        # applies to every query in flight
+        self.channel.fail_pending(exc)
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.channel.transport = None
+        self.channel.fail_pending(exc or ConnectionError("DNS socket closed"))
+
+
+class _ServerChannel:
+    """One connected UDP socket per nameserver, shared by every query to it.
+
+    Replies are matched to queries by message id, so any number of queries
+    can be in flight on the same socket. An unanswered query is resent with
+    the same id and a doubling interval until the timeout runs out, as
+    dnspython's resolver does, so one lost datagram doesn't fail a probe.
+    """
+
+    def __init__(self, server: str, port: int = 53):
+        self.server = server
+        self.port = port
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self._connecting: Optional[asyncio.Future] = None
+
+    async def _ensure_transport(self):
+        if self.transport is not None:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _ChannelProtocol(self), remote_addr=(self.server, self.port)
+            ))
+        try:
+            transport, _ = await asyncio.shield(self._connecting)
+            self.transport = transport
+        finally:
+            self._connecting = None
+
+    def _next_id(self) -> int:
+        while True:
+            query_id = random.getrandbits(16)
+            if query_id not in self.pending:
+                return query_id
+
+    def fail_pending(self, exc: Exception):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    async def query(self, qname: dns.name.Name, rdtype, timeout: float) -> dns.message.Message:
+        await self._ensure_transport()
+        request = dns.message.make_query(qname, rdtype)
+        request.id = self._next_id()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        future = self.pending[request.id] = loop.create_future()
+        wire = request.to_wire()
+        interval = min(RETRANSMIT_INTERVAL, timeout / 3)
+        resend_at = loop.time()
+        try:
+            while True:
+                now = loop.time()
+                if now >= deadline:
+                    raise dns.exception.Timeout(timeout=timeout)
+                if now >= resend_at:
+                    # Same id, so a late reply to an earlier send still counts
+                    self.transport.sendto(wire)
+                    resend_at = now + interval
+                    interval *= 2
+                await asyncio.wait([future], timeout=min(resend_at, deadline) - now)
+                if not future.done():
+                    continue
+                response = dns.message.from_wire(future.result())
+                if request.is_response(response):
+                    break
+                # Late reply to an earlier query that reused this id
+                future = self.pending[request.id] = loop.create_future()
+        finally:
+            self.pending.pop(request.id, None)
+
+        if response.flags & dns.flags.TC:
+            response = await dns.asyncquery.tcp(request, self.server, timeout, self.port)
+        return response
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class ResolverRegistry:
+    """Process-wide nameserver discovery and per-server query channels.
+
+    resolv.conf is parsed once and re-read only when its mtime or size
+    changes. Each nameserver gets one long-lived channel, so a probe is a
+    single send on an already open socket.
+    """
+
+    def __init__(self, resolv_conf: str = RESOLV_CONF):
+        self.resolv_conf = resolv_conf
+        self._resolv_key: Optional[Tuple[int, int]] = None
+        self._system: List[str] = []
+        self._channels: Dict[Tuple[str, int], _ServerChannel] = {}
+
+    def system_nameservers(self) -> List[str]:
+        try:
+            stat = os.stat(self.resolv_conf)
+            key = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            key = None
+        if key != self._resolv_key:
+            self._resolv_key = key
+            self._system = self._read_resolv_conf() if key else []
+        return self._system
+
+    def _read_resolv_conf(self) -> List[str]:
+        servers = []
+        try:
+            with open(self.resolv_conf, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) >= 2 and parts[0] == 'nameserver':
+                        servers.append(parts[1])
+        except OSError:
+            pass
+        return servers
+
+    def servers_for(self, configured: Optional[List[str]]) -> List[str]:
+        """Servers a DNS test should query, with 'local' expanded"""
+        if configured:
+            servers = []
+            for server in configured:
+                if server == LOCAL_SERVER:
+                    servers.extend(self.system_nameservers())
+                else:
+                    servers.append(server)
+        else:
+            # Default: local + Google + Cloudflare, skipping loopback stubs
+            servers = [s for s in self.system_nameservers() if s not in ('127.0.0.1', '::1')]
+            servers.extend(PUBLIC_DNS_SERVERS)
+        # Remove duplicates while preserving order
+        return list(dict.fromkeys(servers))
+
+    def channel(self, server: str, port: int = 53) -> _ServerChannel:
+        channel = self._channels.get((server, port))
+        if channel is None:
+            channel = self._channels[(server, port)] = _ServerChannel(server, port)
+        return channel
+
+    async def resolve(self, server: str, target: str, record_type: str,
+                      timeout: float, port: int = 53) -> dns.resolver.Answer:
+        """Query one server and return its answer, raising like dns.resolver"""
+        qname = dns.name.from_text(target)
+        rdtype = dns.rdatatype.from_text(record_type)
+        response = await self.channel(server, port).query(qname, rdtype, timeout)
+
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXDOMAIN:
+            raise dns.resolver.NXDOMAIN(qnames=[qname], responses={qname: response})
+        if rcode != dns.rcode.NOERROR:
+            raise Exception(f"{server} answered {dns.rcode.to_text(rcode)}")
+        return dns.resolver.Answer(qname, rdtype, dns.rdataclass.IN, response, server, port)
+
+    def close(self):
+        for channel in self._channels.values():
+            channel.close()
+        self._channels.clear()
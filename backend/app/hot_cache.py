@@ -0,0 +1,211 @@
+import bisect
+import heapq
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice, takewhile
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterable, List, Optional
+
+from .database import parse_since, to_epoch_ms
+from .models import TestResult
+from .result_encoding import ResultRow, encode_data
+
+# Kept a little past an hour so the dashboard's 1h range is still served
+# when the browser clock runs slightly behind
+MAX_AGE_SECONDS = int(os.getenv('HOT_CACHE_SECONDS', str(65 * 60)))
+# One probe a second for the whole window
+MAX_PER_CONFIG = int(os.getenv('HOT_CACHE_PER_CONFIG', '4000'))
+MAX_BYTES = int(os.getenv('HOT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Rough per-row overhead on top of the stored data: the slotted object,
+# its strings and the deque slot
+_ROW_OVERHEAD = sys.getsizeof(ResultRow((0, '', 0, 0, 0.0, None, None, None))) + 160
+
+
+def row_from_result(result: TestResult) -> ResultRow:
+    """The ResultRow a read of this committed result would return"""
+    data = encode_data(result.data)
+    return ResultRow((result.id, result.config_id, to_epoch_ms(result.timestamp), result.success,
+                      result.response_time, result.error, data.encode() if data else None,
+                      result.agent_id))
+
+
+def _order(row: ResultRow):
+    return row.timestamp_ms, row.id
+
+
+def _size(row: ResultRow) -> int:
+    return _ROW_OVERHEAD + len(row._data_json or b'') + len(row.error or '')
+
+
+class HotCache:
+    """Recent results per config, kept in memory to answer short-range reads.
+
+    Each config has a ring of its newest results, sorted by (timestamp,
+    id), and a floor: every committed result with timestamp >= floor is
+    in the ring. Evicting a row (by count, age or the global byte budget)
+    raises the floor past it, and a query is only answered here when its
+    whole range lies above the floor.
+
+    last_id is the newest result id seen. Rows arrive in commit order, so
+    every result up to it has been recorded (or deliberately left out)
+    and it is the sync position of an answer served from here.
+    """
+
+    def __init__(self, max_age: int = None, max_per_config: int = None, max_bytes: int = None):
+        self.max_age_ms = (max_age or MAX_AGE_SECONDS) * 1000
+        self.max_per_config = max_per_config or MAX_PER_CONFIG
+        self.max_bytes = max_bytes or MAX_BYTES
+        self._rings: Dict[str, Deque[ResultRow]] = {}
+        self._floors: Dict[str, int] = {}
+        # Floor for configs with nothing cached: everything since warm()
+        self._floor: Optional[int] = None
+        self.last_id: Optional[int] = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _now_ms(self) -> int:
+        return int(time.time() * 1000)
+
+    def warm_since(self) -> str:
+        """ISO timestamp to load from the database at startup"""
+        return datetime.fromtimestamp((self._now_ms() - self.max_age_ms) / 1000, tz=timezone.utc).isoformat()
+
+    def warm(self, rows: Iterable[ResultRow], since: str, last_id: int):
+        """Load rows read from the database for everything since `since`,
+        as of the newest committed id `last_id`"""
+        self._floor = parse_since(since)
+        self.last_id = last_id
+        for row in sorted(rows, key=lambda row: (row.timestamp_ms, row.id)):
+            self._append(row)
+        self._evict()
+
+    def add(self, result: TestResult):
+        """Record a just-committed result"""
+        if result.id is not None:
+            self.add_row(row_from_result(result))
+
+    def add_row(self, row: ResultRow):
+        if self._floor is None:
+            return
+        self.last_id = max(self.last_id, row.id)
+        self._append(row)
+        self._evict()
+
+    def add_many(self, results: Iterable[TestResult]):
+        """Record a batch of committed results, evicting once at the end"""
+        if self._floor is None:
+            return
+        # Backfilled rows past the window would only be evicted again
+        cutoff = self._now_ms() - self.max_age_ms
+        for result in results:
+            if result.id is None:
+                continue
+            self.last_id = max(self.last_id, result.id)
+            timestamp_ms = to_epoch_ms(result.timestamp)
+            if timestamp_ms >= cutoff:
+                self._append(row_from_result(result))
+            else:
+                # Left out, so the config's floor must move past it
+                floor = self._floors.get(result.config_id, self._floor)
+                self._floors[result.config_id] = max(floor, timestamp_ms + 1)
+        self._evict()
+
+    def drop(self, config_id: str):
+        ring = self._rings.pop(config_id, None)
+        if ring:
+            self._bytes -= sum(_size(row) for row in ring)
+        # Its results are gone from the database too, so nothing is missing
+        self._floors.pop(config_id, None)
+
+    def _append(self, row: ResultRow):
+        ring = self._rings.get(row.config_id)
+        if ring is None:
+            ring = self._rings[row.config_id] = deque()
+            self._floors.setdefault(row.config_id, self._floor)
+        key = _order(row)
+        if not ring or _order(ring[-1]) <= key:
+            ring.append(row)
+        else:
+            # Committed after a newer result of the same config
+            ring.insert(bisect.bisect_right(ring, key, key=_order), row)
+        self._bytes += _size(row)
+
+    def _pop_oldest(self, config_id: str):
+        ring = self._rings[config_id]
+        oldest = ring.popleft()
+        self._bytes -= _size(oldest)
+        self._floors[config_id] = max(self._floors[config_id], oldest.timestamp_ms + 1)
+        self.evicted += 1
+        if not ring:
+            del self._rings[config_id]
+
+    def _evict(self):
+        cutoff = self._now_ms() - self.max_age_ms
+        for config_id in list(self._rings):
+            ring = self._rings[config_id]
+            while ring and (len(ring) > self.max_per_config or ring[0].timestamp_ms < cutoff):
+                self._pop_oldest(config_id)
+        while self._bytes > self.max_bytes and self._rings:
+            config_id = min(self._rings, key=lambda key: self._rings[key][0].timestamp_ms)
+            self._pop_oldest(config_id)
+
+    def _floor_for(self, config_id: Optional[str]) -> int:
+        if config_id is not None:
+            return self._floors.get(config_id, self._floor)
+        return max([self._floor] + list(self._floors.values()))
+
+    def query(
+        self,
+        hours: Optional[int] = None,
+        limit: Optional[int] = None,
+        config_id: Optional[str] = None,
+        since: Optional[str] = None
+    ) -> Optional[List[ResultRow]]:
+        """Same rows as Database.get_results_by_timerange, or None on a miss"""
+        if self._floor is None:
+            self.misses += 1
+            return None
+
+        lower = None
+        if hours:
+            lower = self._now_ms() - hours * 3600 * 1000
+        elif since:
+            lower = parse_since(since)
+        if lower is None and not limit:
+            self.misses += 1
+            return None
+
+        config_id = config_id or None
+        floor = self._floor_for(config_id)
+        rings = [self._rings.get(config_id, ())] if config_id is not None else self._rings.values()
+        bound = floor if lower is None else max(floor, lower)
+        # Rings are sorted, so newest-first is a lazy merge of their tails
+        newest = heapq.merge(*(takewhile(lambda row: row.timestamp_ms >= bound, reversed(ring))
+                               for ring in rings), key=_order, reverse=True)
+        rows = list(islice(newest, limit) if limit else newest)
+
+        if lower is not None and lower >= floor:
+            self.hits += 1
+            return rows
+        if limit and len(rows) >= limit:
+            # The missing rows are all older than floor, below the top `limit`
+            self.hits += 1
+            return rows
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "configs": len(self._rings),
+            "entries": sum(len(ring) for ring in self._rings.values()),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
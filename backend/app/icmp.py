@@ -0,0 +1,254 @@
+import asyncio
+import ipaddress
+import os
+import socket
+import struct
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# Linux values; the socket module doesn't export them
+SO_TIMESTAMPING = getattr(socket, 'SO_TIMESTAMPING', 37)
+SCM_TIMESTAMPING = SO_TIMESTAMPING
+SOF_TIMESTAMPING_TX_SOFTWARE = 1 << 1
+SOF_TIMESTAMPING_RX_SOFTWARE = 1 << 3
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+MSG_ERRQUEUE = getattr(socket, 'MSG_ERRQUEUE', 0x2000)
+# scm_timestamping holds three timespecs; the first is the software one
+_TIMESPEC = struct.Struct('@ll')
+_HEADER = struct.Struct('!BBHHH')
+_PAYLOAD = struct.Struct('!Q')
+_PACKET_SIZE = _HEADER.size + _PAYLOAD.size
+
+RECEIVE_BUFFER = int(os.getenv('ICMP_RECEIVE_BUFFER', str(4 * 1024 * 1024)))
+
+
+class IcmpUnavailable(Exception):
+    """Raised when no ICMP socket can be opened or the target isn't IPv4"""
+
+
+def _checksum(packet: bytes) -> int:
+    if len(packet) % 2:
+        packet += b'\0'
+    total = sum(struct.unpack(f'!{len(packet) // 2}H', packet))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _timestamp(ancdata) -> Optional[int]:
+    """Kernel software timestamp (ns) from SCM_TIMESTAMPING ancillary data"""
+    for level, kind, value in ancdata:
+        if level == socket.SOL_SOCKET and kind == SCM_TIMESTAMPING and len(value) >= _TIMESPEC.size:
+            seconds, nanoseconds = _TIMESPEC.unpack_from(value)
+            if seconds or nanoseconds:
+                return seconds * 1_000_000_000 + nanoseconds
+    return None
+
+
+def _sent_packet(frame: bytes) -> Optional[bytes]:
+    """Our echo request inside a looped-back TX timestamp frame.
+
+    The kernel hands back the frame as sent, link-layer header and any
+    padding included, so find the IPv4 header that carries exactly one
+    echo request rather than assuming an offset.
+    """
+    for offset in range(min(len(frame) - 20, 64) + 1):
+        if frame[offset] >> 4 != 4 or frame[offset + 9] != socket.IPPROTO_ICMP:
+            continue
+        header_size = (frame[offset] & 0x0f) * 4
+        if header_size < 20 or int.from_bytes(frame[offset + 2:offset + 4], 'big') != header_size + _PACKET_SIZE:
+            continue
+        packet = frame[offset + header_size:offset + header_size + _PACKET_SIZE]
+        if len(packet) == _PACKET_SIZE and packet[0] == ICMP_ECHO_REQUEST:
+            return packet
+    return None
+
+
+class _Request:
+    __slots__ = ('future', 'nonce', 'sent_ns', 'sent_kernel_ns')
+
+    def __init__(self, future: asyncio.Future, nonce: int):
+        self.future = future
+        self.nonce = nonce
+        self.sent_ns = 0
+        self.sent_kernel_ns: Optional[int] = None
+
+
+class IcmpEngine:
+    """Asyncio ICMP echo client that multiplexes every probe over one socket.
+
+    Prefers an unprivileged datagram ICMP socket (net.ipv4.ping_group_range)
+    and falls back to a raw socket when running as root. Outstanding
+    requests are keyed by (identifier, sequence number) and matched against
+    an 8 byte nonce echoed back in the payload.
+
+    RTTs come from kernel software timestamps (SO_TIMESTAMPING) taken as
+    the request leaves and the reply arrives. When the kernel doesn't
+    report a send timestamp for a request, both ends are read from the
+    monotonic clock in userspace instead, so an RTT never mixes the two.
+    """
+
+    def __init__(self):
+        self._sock: Optional[socket.socket] = None
+        self._raw = False
+        self._ident = os.getpid() & 0xffff
+        self._seq = 0
+        self._pending: Dict[Tuple[int, int], _Request] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._kernel_timestamps = False
+        self.available: Optional[bool] = None
+
+    def _open(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            raw = False
+        except OSError:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+                raw = True
+            except OSError as e:
+                self.available = False
+                raise IcmpUnavailable(f"Cannot open ICMP socket: {e}")
+
+        sock.setblocking(False)
+        # Replies to a large burst arrive together; the default buffer only
+        # holds a few hundred packets
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        except OSError:
+            pass
+        if sys.platform.startswith('linux'):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING,
+                                SOF_TIMESTAMPING_TX_SOFTWARE | SOF_TIMESTAMPING_RX_SOFTWARE
+                                | SOF_TIMESTAMPING_SOFTWARE)
+                self._kernel_timestamps = True
+            except OSError:
+                self._kernel_timestamps = False
+
+        self._sock = sock
+        self._raw = raw
+        if not raw:
+            # Ping sockets get their echo identifier from the bound port
+            sock.bind(('0.0.0.0', 0))
+            self._ident = sock.getsockname()[1]
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable)
+        self.available = True
+
+    def close(self):
+        if self._sock is not None:
+            self._loop.remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+        for request in self._pending.values():
+            if not request.future.done():
+                request.future.set_exception(IcmpUnavailable("ICMP engine closed"))
+        self._pending.clear()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _next_seq(self) -> int:
+        for _ in range(0x10000):
+            self._seq = (self._seq + 1) & 0xffff
+            if (self._ident, self._seq) not in self._pending:
+                return self._seq
+        raise RuntimeError("Too many outstanding ICMP requests")
+
+    async def resolve(self, host: str) -> str:
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM
+            )
+            if not infos:
+                raise IcmpUnavailable(f"No IPv4 address for {host}")
+            return infos[0][4][0]
+        if address.version != 4:
+            raise IcmpUnavailable("ICMP engine only handles IPv4 targets")
+        return host
+
+    async def ping(self, host: str, timeout: float) -> float:
+        """Send one echo request and return the round trip time in ms"""
+        if self._sock is None:
+            if self.available is False:
+                raise IcmpUnavailable("ICMP socket unavailable")
+            self._open()
+
+        address = await self.resolve(host)
+        seq = self._next_seq()
+        nonce = time.monotonic_ns() & 0xffffffffffffffff
+        payload = _PAYLOAD.pack(nonce)
+        header = _HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, self._ident, seq)
+        checksum = _checksum(header + payload)
+        packet = _HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, self._ident, seq) + payload
+
+        key = (self._ident, seq)
+        request = self._pending[key] = _Request(asyncio.get_running_loop().create_future(), nonce)
+        try:
+            request.sent_ns = time.monotonic_ns()
+            self._sock.sendto(packet, (address, 0))
+            rtt_ns = await asyncio.wait_for(request.future, timeout)
+        except asyncio.TimeoutError:
+            raise Exception(f"Request timed out after {timeout}s")
+        finally:
+            self._pending.pop(key, None)
+
+        return rtt_ns / 1_000_000
+
+    def _on_readable(self):
+        # Send timestamps queue up on the error queue, which also keeps
+        # the socket readable until it is drained
+        if self._kernel_timestamps:
+            self._read_send_timestamps()
+        while True:
+            try:
+                data, ancdata, _, _ = self._sock.recvmsg(2048, 1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            self._on_reply(data, time.monotonic_ns(), _timestamp(ancdata))
+
+    def _read_send_timestamps(self):
+        while True:
+            try:
+                data, ancdata, _, _ = self._sock.recvmsg(2048, 1024, MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            sent_kernel_ns = _timestamp(ancdata)
+            packet = _sent_packet(data)
+            if sent_kernel_ns is None or packet is None:
+                continue
+            _, _, _, ident, seq = _HEADER.unpack_from(packet)
+            request = self._pending.get((ident, seq))
+            if request is not None and _PAYLOAD.unpack_from(packet, _HEADER.size)[0] == request.nonce:
+                request.sent_kernel_ns = sent_kernel_ns
+
+    def _on_reply(self, data: bytes, received_ns: int, received_kernel_ns: Optional[int]):
+        if self._raw:
+            # Raw sockets deliver the IP header too
+            data = data[(data[0] & 0x0f) * 4:]
+        if len(data) < _PACKET_SIZE:
+            return
+
+        kind, _, _, ident, seq = _HEADER.unpack_from(data)
+        if kind != ICMP_ECHO_REPLY:
+            return
+        request = self._pending.get((ident, seq))
+        if request is None or request.future.done():
+            return
+        if _PAYLOAD.unpack_from(data, _HEADER.size)[0] != request.nonce:
+            return
+        if request.sent_kernel_ns is not None and received_kernel_ns is not None:
+            request.future.set_result(received_kernel_ns - request.sent_kernel_ns)
+        else:
+            request.future.set_result(received_ns - request.sent_ns)
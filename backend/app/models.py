@@ -12,6 +12,10 @@ class TestType(str, Enum):
     SPEEDTEST_FAST = "speedtest_fast"
     IPERF3 = "iperf3"
 
+class HttpBodyMode(str, Enum):
+    STREAM = "stream"  # Count body bytes as they arrive, without buffering
+    HEADERS = "headers"  # Stop after the response headers
+
 @dataclass
 class TestConfig:
     name: str
@@ -23,6 +27,11 @@ class TestConfig:
     id: Optional[str] = None
     created_at: Optional[datetime] = None
     dns_servers: Optional[List[str]] = None  # For DNS tests
+    ping_count: int = 1  # Echo requests per ping test
+    ping_spacing: float = 0.2  # Seconds between echo requests in a burst
+    http_keepalive: bool = True  # Reuse pooled connections; False opens a fresh one per probe
+    http_body: HttpBodyMode = HttpBodyMode.STREAM
+    store_raw: bool = False  # Keep verbatim tool output (compressed) alongside results
     
     def dict(self):
         return asdict(self)
@@ -35,10 +44,14 @@ class TestResult:
     response_time: Optional[float] = None
     error: Optional[str] = None
     data: Optional[Dict[str, Any]] = None
-    id: Optional[str] = None
+    id: Optional[int] = None
+    agent_id: Optional[str] = None  # Remote agent that ran the test; None when run here
+    idempotency_key: Optional[str] = None  # Client key for bulk uploads; never serialized
+    raw: Optional[Dict[str, Any]] = None  # Tool output bound for result_raw; never serialized
     
     def dict(self):
         result = asdict(self)
+        del result['raw'], result['idempotency_key']
         # Convert datetime to string for JSON serialization
         if result['timestamp']:
             result['timestamp'] = result['timestamp'].isoformat()
@@ -3,24 +3,218 @@ import time
 import socket
 import subprocess
 import json
+import math
+import os
 import re
-from datetime import datetime
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from typing import Dict, Any, Optional
 import aiohttp
 try:
     import dns.resolver
+    from .dns_resolvers import ResolverRegistry
 except ImportError:
     dns = None
-from .models import TestConfig, TestResult, TestType
+from .icmp import IcmpEngine, IcmpUnavailable
+from .models import HttpBodyMode, TestConfig, TestResult, TestType
+from .result_encoding import split_raw
+
+
+def _percentile(values, q: float) -> float:
+    """Linear interpolation between closest ranks of sorted values"""
+    rank = q * (len(values) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def _ping_stats(rtts, sent: int) -> Dict[str, Any]:
+    """Summarise a burst of echo replies (ms) the way ping -c prints it"""
+    if not rtts:
+        raise Exception(f"100% packet loss ({sent} sent)")
+    rtts = sorted(rtts)
+    received = len(rtts)
+    avg = sum(rtts) / received
+    # Same jitter measure as iputils ping: sqrt(mean(x^2) - mean(x)^2)
+    mdev = math.sqrt(max(0.0, sum(rtt * rtt for rtt in rtts) / received - avg * avg))
+    return {
+        "rtt": avg,
+        "min": rtts[0],
+        "avg": avg,
+        "max": rtts[-1],
+        "mdev": mdev,
+        "p50": _percentile(rtts, 0.50),
+        "p95": _percentile(rtts, 0.95),
+        "p99": _percentile(rtts, 0.99),
+        "sent": sent,
+        "received": received,
+        "loss_percent": (sent - received) / sent * 100,
+    }
+
+
+# Connection pool for HTTP probes and the Fast.com test
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+HTTP_POOL_PER_HOST = int(os.getenv('HTTP_POOL_PER_HOST', '4'))
+HTTP_DNS_TTL = int(os.getenv('HTTP_DNS_TTL', '300'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+
+# Response headers worth keeping on a probe result; the rest are dropped
+HTTP_RESULT_HEADERS = (
+    'Content-Type', 'Content-Length', 'Content-Encoding', 'Server', 'Location',
+    'Cache-Control', 'Age', 'Via', 'X-Cache', 'CF-Cache-Status',
+)
+
+
+class _HttpTimer:
+    """Trace marks for one HTTP probe, fed by the session's TraceConfig"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks: Dict[str, float] = {}
+        # DNS, pool waits and connects repeat across redirects; sum them
+        self.durations = {"queue": 0.0, "dns": 0.0, "tcp": 0.0, "tls": 0.0}
+        self.seen = set()
+        self.reused_connection = False
+        self._protocol = None
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.marks[name] = now
+        phase, _, edge = name.rpartition('_')
+        if edge != 'end' or phase + '_start' not in self.marks:
+            return
+        if phase == 'connect':
+            self._connected(now)
+        else:
+            self.durations[phase] += now - self.marks[phase + '_start']
+            self.seen.add(phase)
+
+    def tcp_connected(self, protocol):
+        """The socket is up and any TLS handshake is about to start"""
+        self.marks["tcp_end"] = time.perf_counter()
+        self._protocol = protocol
+
+    def _connected(self, now: float):
+        start = self.marks["connect_start"]
+        # Connection creation includes resolving the host
+        dns = 0.0
+        if self.marks.get("dns_start", 0.0) >= start and "dns_end" in self.marks:
+            dns = self.marks["dns_end"] - self.marks["dns_start"]
+        tcp_end = self.marks.get("tcp_end", 0.0)
+        if tcp_end < start:
+            # No mark from _TimedConnector; the whole connect is all we know
+            self.durations["tcp"] += max(now - start - dns, 0.0)
+            self.seen.add("tcp")
+            return
+        self.durations["tcp"] += max(tcp_end - start - dns, 0.0)
+        self.seen.add("tcp")
+        transport = getattr(self._protocol, 'transport', None)
+        if transport is not None and transport.get_extra_info('sslcontext') is not None:
+            self.durations["tls"] += now - tcp_end
+            self.seen.add("tls")
+
+    def timings(self, finished: float) -> Dict[str, Optional[float]]:
+        """Per-phase milliseconds; None for phases that didn't happen"""
+        def ms(seconds):
+            return seconds * 1000
+
+        sent = self.marks.get("headers_sent", self.start)
+        response = self.marks.get("response")
+        timings = {
+            phase + "_ms": ms(self.durations[phase]) if phase in self.seen else None
+            for phase in ("queue", "dns", "tcp", "tls")
+        }
+        timings.update({
+            "ttfb_ms": ms(response - sent) if response else None,
+            "transfer_ms": ms(finished - response) if response else None,
+            "total_ms": ms(finished - self.start),
+        })
+        return timings
+
+
+# The _HttpTimer of the HTTP probe running in the current task
+_current_timer: ContextVar[Optional[_HttpTimer]] = ContextVar('_current_timer', default=None)
+
+
+class _TimedConnector(aiohttp.TCPConnector):
+    """TCPConnector that tells the probe's _HttpTimer when TCP is up.
+
+    aiohttp connects the socket first and then hands it, with this
+    connector's protocol factory, to loop.create_connection, which calls
+    the factory before starting any TLS handshake. Wrapping the factory
+    marks the boundary between the TCP and TLS phases.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        factory = self._factory
+
+        def timed_factory():
+            protocol = factory()
+            timer = _current_timer.get()
+            if timer is not None:
+                timer.tcp_connected(protocol)
+            return protocol
+
+        self._factory = timed_factory
+
+
+def _http_trace_config() -> aiohttp.TraceConfig:
+    def marker(name):
+        async def handler(session, context, params):
+            timer = context.trace_request_ctx
+            if isinstance(timer, _HttpTimer):
+                timer.mark(name)
+        return handler
+
+    async def reused(session, context, params):
+        if isinstance(context.trace_request_ctx, _HttpTimer):
+            context.trace_request_ctx.reused_connection = True
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_queued_start.append(marker("queue_start"))
+    trace.on_connection_queued_end.append(marker("queue_end"))
+    trace.on_dns_resolvehost_start.append(marker("dns_start"))
+    trace.on_dns_resolvehost_end.append(marker("dns_end"))
+    trace.on_connection_create_start.append(marker("connect_start"))
+    trace.on_connection_create_end.append(marker("connect_end"))
+    trace.on_connection_reuseconn.append(reused)
+    trace.on_request_headers_sent.append(marker("headers_sent"))
+    # Fires once the response headers are in, before the body is read
+    trace.on_request_end.append(marker("response"))
+    return trace
+
 
 class NetworkTester:
     def __init__(self):
         self.session = None
+        self.fresh_session = None
+        self.icmp = IcmpEngine()
+        self.resolvers = ResolverRegistry() if dns is not None else None
     
-    async def get_session(self):
-        if not self.session:
-            self.session = aiohttp.ClientSession()
-        return self.session
+    async def get_session(self, keepalive: bool = True):
+        """Shared pooled session, or one that opens a new connection per request"""
+        if keepalive:
+            if not self.session or self.session.closed:
+                connector = _TimedConnector(
+                    limit=HTTP_POOL_LIMIT,
+                    limit_per_host=HTTP_POOL_PER_HOST,
+                    ttl_dns_cache=HTTP_DNS_TTL,
+                    keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                )
+                self.session = aiohttp.ClientSession(connector=connector, trace_configs=[_http_trace_config()])
+            return self.session
+
+        if not self.fresh_session or self.fresh_session.closed:
+            # Cold path on every probe: resolve, connect and handshake again
+            connector = _TimedConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_PER_HOST,
+                use_dns_cache=False,
+                force_close=True,
+            )
+            self.fresh_session = aiohttp.ClientSession(connector=connector, trace_configs=[_http_trace_config()])
+        return self.fresh_session
     
     async def run_test(self, config: TestConfig) -> TestResult:
         start_time = time.time()
@@ -51,28 +245,80 @@ class NetworkTester:
                 raise ValueError(f"Unknown test type: {config.test_type}")
             
             response_time = time.time() - start_time
+            if config.test_type == TestType.PING and result.get("rtt") is not None:
+                # The measured RTT (a burst's mean), not the coroutine's wall
+                # time, which adds socket setup, scheduling and a burst's spacing
+                response_time = result["rtt"] / 1000
+            
+            # Verbatim tool output is only kept when the config asks for it
+            result, raw = split_raw(config.test_type, result)
             
             return TestResult(
                 config_id=config.id,
-                timestamp=datetime.now(),
+                timestamp=datetime.now(timezone.utc),
                 success=True,
                 response_time=response_time,
-                data=result
+                data=result,
+                raw=raw if config.store_raw else None
             )
         
         except Exception as e:
             return TestResult(
                 config_id=config.id,
-                timestamp=datetime.now(),
+                timestamp=datetime.now(timezone.utc),
                 success=False,
                 error=str(e),
                 response_time=time.time() - start_time
             )
     
+    async def close(self):
+        self.icmp.close()
+        if self.resolvers is not None:
+            self.resolvers.close()
+        for session in (self.session, self.fresh_session):
+            if session and not session.closed:
+                await session.close()
+
     async def _ping_test(self, config: TestConfig) -> Dict[str, Any]:
+        # Shared ICMP socket first; fork ping where it can't be used (no
+        # raw/ping socket permission, IPv6 targets)
+        count = max(1, config.ping_count or 1)
+        if self.icmp.available is not False:
+            try:
+                if count == 1:
+                    rtt = await self.icmp.ping(config.target, config.timeout)
+                    return {"rtt": rtt}
+                return await self._ping_burst(config, count)
+            except IcmpUnavailable:
+                pass
+        return await self._ping_subprocess(config)
+
+    async def _ping_burst(self, config: TestConfig, count: int) -> Dict[str, Any]:
+        """Send count echoes spaced ping_spacing apart without waiting for replies"""
+        # Resolve once up front so every packet goes to the same address
+        address = await self.icmp.resolve(config.target)
+        spacing = max(0.0, config.ping_spacing or 0.0)
+
+        async def probe(index: int) -> float:
+            if index:
+                await asyncio.sleep(index * spacing)
+            return await self.icmp.ping(address, config.timeout)
+
+        replies = await asyncio.gather(*(probe(i) for i in range(count)), return_exceptions=True)
+        for reply in replies:
+            if isinstance(reply, IcmpUnavailable):
+                raise reply
+        rtts = [reply for reply in replies if not isinstance(reply, BaseException)]
+        return _ping_stats(rtts, count)
+
+    async def _ping_subprocess(self, config: TestConfig) -> Dict[str, Any]:
         # Use system ping command for better compatibility
+        count = max(1, config.ping_count or 1)
+        args = ['ping', '-c', str(count), '-W', str(config.timeout * 1000)]
+        if count > 1:
+            args += ['-i', str(config.ping_spacing)]
         proc = await asyncio.create_subprocess_exec(
-            'ping', '-c', '1', '-W', str(config.timeout * 1000), config.target,
+            *args, config.target,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
@@ -81,22 +327,45 @@ class NetworkTester:
         if proc.returncode == 0:
             output = stdout.decode()
             # Parse ping output for response time
-            import re
+            if count > 1:
+                rtts = [float(value) for value in re.findall(r'time=(\d+\.?\d*)', output)]
+                result = _ping_stats(rtts, count)
+                result["output"] = output
+                return result
             match = re.search(r'time=(\d+\.?\d*)', output)
             rtt = float(match.group(1)) if match else None
             return {"rtt": rtt, "output": output}
         else:
             raise Exception(stderr.decode())
-    
+
     async def _http_test(self, config: TestConfig) -> Dict[str, Any]:
-        session = await self.get_session()
+        session = await self.get_session(config.http_keepalive)
         timeout = aiohttp.ClientTimeout(total=config.timeout)
         
-        async with session.get(config.target, timeout=timeout) as response:
+        timer = _HttpTimer()
+        token = _current_timer.set(timer)
+        try:
+            return await self._http_request(session, config, timeout, timer)
+        finally:
+            _current_timer.reset(token)
+
+    async def _http_request(self, session, config: TestConfig, timeout, timer: _HttpTimer) -> Dict[str, Any]:
+        async with session.get(config.target, timeout=timeout, trace_request_ctx=timer) as response:
+            if config.http_body == HttpBodyMode.HEADERS:
+                # Closing without reading drops the connection instead of
+                # draining a body we don't want
+                content_length = response.content_length
+                response.close()
+            else:
+                content_length = 0
+                async for chunk in response.content.iter_any():
+                    content_length += len(chunk)
             return {
                 "status_code": response.status,
-                "headers": dict(response.headers),
-                "content_length": len(await response.read())
+                "headers": {name: response.headers[name] for name in HTTP_RESULT_HEADERS if name in response.headers},
+                "content_length": content_length,
+                "reused_connection": timer.reused_connection,
+                "timings": timer.timings(time.perf_counter())
             }
     
     async def _dns_test(self, config: TestConfig) -> Dict[str, Any]:
@@ -109,61 +378,15 @@ class NetworkTester:
         if ':' in config.target:
             target, record_type = config.target.split(':', 1)
         
-        # Get DNS servers to test - check if custom servers specified
-        dns_servers = []
-        if hasattr(config, 'dns_servers') and config.dns_servers:
-            dns_servers = config.dns_servers
-        else:
-            # Default: local + Google + Cloudflare
-            import socket
-            try:
-                # Get system DNS servers
-                with open('/etc/resolv.conf', 'r') as f:
-                    for line in f:
-                        if line.startswith('nameserver'):
-                            server = line.split()[1]
-                            if server not in ['127.0.0.1', '::1']:  # Skip localhost
-                                dns_servers.append(server)
-            except:
-                pass
-            
-            # Add public DNS servers
-            dns_servers.extend(['8.8.8.8', '1.1.1.1', '8.8.4.4', '1.0.0.1'])
-            # Remove duplicates while preserving order
-            dns_servers = list(dict.fromkeys(dns_servers))
-        
-        results = []
-        successful_queries = 0
-        total_response_time = 0
+        # Custom servers if specified, otherwise local + public resolvers
+        dns_servers = self.resolvers.servers_for(config.dns_servers)
         
-        for server in dns_servers:
-            try:
-                resolver = dns.resolver.Resolver()
-                resolver.nameservers = [server]
-                resolver.timeout = config.timeout
-                
-                start_time = time.time()
-                answers = resolver.resolve(target, record_type)
-                query_time = (time.time() - start_time) * 1000  # Convert to ms
-                
-                result = {
-                    "server": server,
-                    "success": True,
-                    "response_time": query_time,
-                    "answers": [str(answer) for answer in answers],
-                    "record_type": record_type
-                }
-                results.append(result)
-                successful_queries += 1
-                total_response_time += query_time
-                
-            except Exception as e:
-                results.append({
-                    "server": server,
-                    "success": False,
-                    "error": str(e),
-                    "record_type": record_type
-                })
+        # Query every server at once; the test takes as long as the slowest
+        results = list(await asyncio.gather(
+            *(self._query_dns_server(server, target, record_type, config.timeout) for server in dns_servers)
+        ))
+        successful_queries = sum(1 for r in results if r["success"])
+        total_response_time = sum(r["response_time"] for r in results if r["success"])
         
         # Calculate summary statistics
         avg_response_time = total_response_time / successful_queries if successful_queries > 0 else 0
@@ -187,6 +410,28 @@ class NetworkTester:
             }
         }
     
+    async def _query_dns_server(self, server: str, target: str, record_type: str, timeout: float) -> Dict[str, Any]:
+        try:
+            start_time = time.perf_counter()
+            answers = await self.resolvers.resolve(server, target, record_type, timeout)
+            query_time = (time.perf_counter() - start_time) * 1000  # Convert to ms
+            
+            return {
+                "server": server,
+                "success": True,
+                "response_time": query_time,
+                "answers": [str(answer) for answer in answers],
+                "record_type": record_type
+            }
+            
+        except Exception as e:
+            return {
+                "server": server,
+                "success": False,
+                "error": str(e),
+                "record_type": record_type
+            }
+    
     async def _traceroute_test(self, config: TestConfig) -> Dict[str, Any]:
         proc = await asyncio.create_subprocess_exec(
             'traceroute', '-m', '15', config.target,
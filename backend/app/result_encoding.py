@@ -0,0 +1,151 @@
+import hashlib
+import json
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+from .models import TestType
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Verbatim tool output per test type: kept out of test_results.data and only
+# stored, compressed, in result_raw when the config has store_raw set.
+# Traceroute output stays inline since it is the measurement itself.
+RAW_FIELDS = {
+    TestType.PING.value: ('output',),
+    TestType.HTTP.value: ('headers',),
+    TestType.SPEEDTEST_OOKLA.value: ('raw_data',),
+    TestType.IPERF3.value: ('raw_upload',),
+}
+
+# Floats are stored to this many significant digits; tool output rarely
+# carries more real precision than that
+SIGNIFICANT_DIGITS = 6
+
+RAW_TABLE = '''
+    CREATE TABLE IF NOT EXISTS result_raw (
+        id INTEGER PRIMARY KEY,
+        digest BLOB NOT NULL UNIQUE,
+        body BLOB NOT NULL
+    )
+'''
+
+RAW_INDEX = "CREATE INDEX IF NOT EXISTS idx_test_results_raw ON test_results (raw_id) WHERE raw_id IS NOT NULL"
+
+
+def split_raw(test_type, data: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Separate a result's metrics from its verbatim tool output"""
+    fields = RAW_FIELDS.get(getattr(test_type, 'value', test_type), ())
+    if not data or not any(field in data for field in fields):
+        return data, None
+    metrics = {key: value for key, value in data.items() if key not in fields}
+    raw = {key: data[key] for key in fields if key in data}
+    return metrics, raw
+
+
+def _round(value):
+    if isinstance(value, float):
+        return float(f'{value:.{SIGNIFICANT_DIGITS}g}')
+    if isinstance(value, dict):
+        return {key: _round(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_round(item) for item in value]
+    return value
+
+
+def encode_data(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Compact JSON for test_results.data: no whitespace, rounded floats"""
+    if not data:
+        return None
+    return json.dumps(_round(data), separators=(',', ':'))
+
+
+def encode_raw(raw: Dict[str, Any]) -> Tuple[bytes, bytes]:
+    """(digest, zlib body); identical output from repeated runs shares a row"""
+    canonical = json.dumps(raw, separators=(',', ':'), sort_keys=True).encode()
+    return hashlib.sha1(canonical).digest(), zlib.compress(canonical, 6)
+
+
+def decode_raw(body: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(body))
+
+
+def store_raw(conn: sqlite3.Connection, raw: Dict[str, Any]) -> int:
+    """Insert raw output unless it is already stored; returns its result_raw id"""
+    digest, body = encode_raw(raw)
+    conn.execute("INSERT OR IGNORE INTO result_raw (digest, body) VALUES (?, ?)", (digest, body))
+    return conn.execute("SELECT id FROM result_raw WHERE digest = ?", (digest,)).fetchone()[0]
+
+
+def delete_orphaned_raw(conn: sqlite3.Connection, batch_size: int) -> int:
+    cursor = conn.execute('''
+        DELETE FROM result_raw WHERE id IN (
+            SELECT id FROM result_raw r
+            WHERE NOT EXISTS (SELECT 1 FROM test_results t WHERE t.raw_id = r.id)
+            LIMIT ?
+        )
+    ''', (batch_size,))
+    return cursor.rowcount
+
+
+def dumps(value) -> bytes:
+    """JSON bytes via orjson when installed, the stdlib otherwise"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+class ResultRow:
+    """Read-side result built straight from a SQLite row.
+
+    Skips the TestResult dataclass: data stays as the stored JSON bytes
+    until someone asks for it, and to_json() splices those bytes into the
+    output instead of parsing and re-encoding them.
+    """
+
+    __slots__ = ('id', 'config_id', 'timestamp_ms', 'success', 'response_time', 'error', '_data_json',
+                 'agent_id', '_data')
+
+    def __init__(self, row):
+        (self.id, self.config_id, self.timestamp_ms, success,
+         self.response_time, self.error, self._data_json, self.agent_id) = row
+        self.success = bool(success)
+        self._data = None
+
+    @property
+    def timestamp(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp_ms / 1000, tz=timezone.utc)
+
+    @property
+    def data(self) -> Optional[Dict[str, Any]]:
+        if self._data is None and self._data_json:
+            self._data = json.loads(self._data_json)
+        return self._data
+
+    def dict(self) -> Dict[str, Any]:
+        """Same shape as TestResult.dict()"""
+        return {
+            "config_id": self.config_id,
+            "timestamp": self.timestamp.isoformat(),
+            "success": self.success,
+            "response_time": self.response_time,
+            "error": self.error,
+            "data": self.data,
+            "id": self.id,
+            "agent_id": self.agent_id,
+        }
+
+    def to_json(self) -> bytes:
+        head = dumps({
+            "config_id": self.config_id,
+            "timestamp": self.timestamp.isoformat(),
+            "success": self.success,
+            "response_time": self.response_time,
+            "error": self.error,
+        })
+        return b'%s,"data":%s,"id":%d,"agent_id":%s}' % (
+            head[:-1], self._data_json or b'null', self.id,
+            b'null' if self.agent_id is None else dumps(self.agent_id))
@@ -0,0 +1,136 @@
+import asyncio
+import os
+from typing import List, Optional, Tuple
+from .models import TestResult
+
+_STOP = object()
+
+# Seconds to wait before retrying a batch whose commit failed
+RETRY_DELAY = 0.5
+
+class ResultSink:
+    """Write-behind buffer that commits test results in batches.
+
+    Results are queued in memory and flushed with a single executemany
+    transaction once max_batch results are waiting or max_delay seconds have
+    passed since the first one arrived, whichever comes first. The queue is
+    bounded, so producers wait when the writer falls behind. A batch whose
+    commit fails is retried once; if that fails too its results are dropped
+    and counted in stats().
+    """
+
+    def __init__(self, db, max_batch: int = None, max_delay: float = None, max_pending: int = None):
+        self.db = db
+        self.max_batch = max_batch or int(os.getenv('RESULT_BATCH_SIZE', '500'))
+        self.max_delay = max_delay or float(os.getenv('RESULT_FLUSH_INTERVAL', '1.0'))
+        self.max_pending = max_pending or int(os.getenv('RESULT_QUEUE_SIZE', '10000'))
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.dropped = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._closed = False
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, result: TestResult) -> asyncio.Future:
+        """Queue a result, waiting while the buffer is full.
+
+        Returns a future that resolves once the result has been committed.
+        """
+        if self._closed or self._queue is None:
+            raise RuntimeError("ResultSink is not running")
+        committed = asyncio.get_running_loop().create_future()
+        await self._queue.put((result, committed))
+        # close() may have finished while we waited for room, and nothing
+        # would ever pick this result up
+        if self._task.done():
+            self._fail_pending()
+        return committed
+
+    async def close(self):
+        """Flush everything still queued and stop the writer task"""
+        if self._closed or self._task is None:
+            return
+        # From here put() refuses new results; producers already waiting
+        # for room are either flushed below or failed
+        self._closed = True
+        await self._queue.put(_STOP)
+        await self._task
+        self._fail_pending()
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def stats(self) -> dict:
+        return {"pending": self.pending(), "dropped": self.dropped}
+
+    def _fail_pending(self):
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP and not item[1].done():
+                item[1].set_exception(RuntimeError("ResultSink closed before the result was written"))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch: List[Tuple[TestResult, asyncio.Future]] = [item]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+        # Anything queued behind the stop marker still gets written,
+        # including results from producers that were waiting for room
+        while not self._queue.empty():
+            batch = []
+            while not self._queue.empty() and len(batch) < self.max_batch:
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[TestResult, asyncio.Future]]):
+        results = [result for result, _ in batch]
+        try:
+            await self.db.save_results(results)
+        except Exception as e:
+            print(f"Result flush error ({len(batch)} results), retrying: {e}")
+            await asyncio.sleep(RETRY_DELAY)
+            try:
+                await self.db.save_results(results)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"Result flush failed again, dropped {len(batch)} results: {e}")
+                for _, committed in batch:
+                    if not committed.done():
+                        committed.set_exception(e)
+                return
+
+        for _, committed in batch:
+            if not committed.done():
+                committed.set_result(None)
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from .models import TestType
+from .result_encoding import delete_orphaned_raw
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# Days of raw test_results kept per test type; None keeps rows forever
+DEFAULT_RAW_RETENTION = {
+    TestType.PING.value: 7,
+    TestType.HTTP.value: 7,
+    TestType.DNS.value: 7,
+    TestType.TRACEROUTE.value: 30,
+    TestType.SPEEDTEST_OOKLA.value: 90,
+    TestType.SPEEDTEST_FAST.value: 90,
+    TestType.IPERF3.value: 90,
+}
+
+# Days kept per rollup resolution; the coarse ones back long-range graphs
+DEFAULT_ROLLUP_RETENTION = {
+    '1m': 30,
+    '1h': None,
+    '1d': None,
+}
+
+
+def _parse_policy(value: Optional[str], defaults: Dict[str, Optional[int]]) -> Dict[str, Optional[int]]:
+    """Apply overrides like "ping=3,iperf3=forever" on top of the defaults"""
+    policy = dict(defaults)
+    if not value:
+        return policy
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        key, _, days = item.partition('=')
+        key, days = key.strip(), days.strip().lower()
+        if key not in policy:
+            raise ValueError(f"Unknown retention key: {key}")
+        policy[key] = None if days in ('', 'forever', 'none') else int(days)
+    return policy
+
+
+def _delete_batch(conn: sqlite3.Connection, table: str, column: str, config_id: str, cutoff: int, batch_size: int) -> int:
+    if table == 'test_results':
+        cursor = conn.execute('''
+            DELETE FROM test_results WHERE id IN (
+                SELECT id FROM test_results WHERE config_id = ? AND timestamp < ? LIMIT ?
+            )
+        ''', (config_id, cutoff, batch_size))
+    else:
+        cursor = conn.execute(f'''
+            DELETE FROM {table} WHERE config_id = ? AND {column} IN (
+                SELECT {column} FROM {table} WHERE config_id = ? AND {column} < ? LIMIT ?
+            )
+        ''', (config_id, config_id, cutoff, batch_size))
+    return cursor.rowcount
+
+
+def _page_stats(conn: sqlite3.Connection):
+    return (
+        conn.execute("PRAGMA page_size").fetchone()[0],
+        conn.execute("PRAGMA page_count").fetchone()[0],
+        conn.execute("PRAGMA freelist_count").fetchone()[0],
+        conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+    )
+
+
+def _incremental_vacuum(conn: sqlite3.Connection, pages: int):
+    # execute() only steps the pragma once, freeing a single page;
+    # executescript() runs it to completion
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+
+
+class RetentionManager:
+    """Deletes expired raw results and rollups, then returns the space to the OS.
+
+    Deletes go through the shared writer in small batches with a pause in
+    between, so result inserts queued behind them never wait long.
+    """
+
+    def __init__(self, db, interval: float = None, batch_size: int = None,
+                 vacuum_pages: int = None, pause: float = 0.05):
+        self.db = db
+        self.interval = interval or float(os.getenv('RETENTION_INTERVAL', '3600'))
+        self.batch_size = batch_size or int(os.getenv('RETENTION_BATCH_SIZE', '1000'))
+        self.vacuum_pages = vacuum_pages or int(os.getenv('RETENTION_VACUUM_PAGES', '1000'))
+        self.pause = pause
+        self.raw_policy = _parse_policy(os.getenv('RETENTION_RAW_DAYS'), DEFAULT_RAW_RETENTION)
+        self.rollup_policy = _parse_policy(os.getenv('RETENTION_ROLLUP_DAYS'), DEFAULT_ROLLUP_RETENTION)
+        self.last_run: Optional[dict] = None
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Retention error: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> dict:
+        started = time.perf_counter()
+        now = int(datetime.now(timezone.utc).timestamp() * 1000)
+        configs = await self.db.get_configs()
+
+        deleted_results = 0
+        for config in configs:
+            days = self.raw_policy.get(config.test_type)
+            if days is not None:
+                deleted_results += await self._purge('test_results', 'timestamp', config.id, now - days * DAY_MS)
+
+        deleted_rollups = 0
+        for name, days in self.rollup_policy.items():
+            if days is None:
+                continue
+            for config in configs:
+                for table in (f'results_rollup_{name}', f'results_phase_rollup_{name}'):
+                    deleted_rollups += await self._purge(table, 'bucket', config.id, now - days * DAY_MS)
+
+        # Raw output is shared between results, so it goes once nothing
+        # references it any more
+        deleted_raw = 0
+        while True:
+            deleted = await self.db.pool.write(delete_orphaned_raw, self.batch_size)
+            deleted_raw += deleted
+            if deleted < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+
+        bytes_reclaimed, bytes_free = await self._reclaim()
+
+        self.last_run = {
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration": time.perf_counter() - started,
+            "deleted_results": deleted_results,
+            "deleted_rollups": deleted_rollups,
+            "deleted_raw": deleted_raw,
+            "bytes_reclaimed": bytes_reclaimed,
+            "bytes_free": bytes_free,
+        }
+        if deleted_results or deleted_rollups or deleted_raw or bytes_reclaimed:
+            print(f"Retention: deleted {deleted_results} results, {deleted_rollups} rollup rows and "
+                  f"{deleted_raw} raw outputs, reclaimed {bytes_reclaimed} bytes")
+        return self.last_run
+
+    async def _purge(self, table: str, column: str, config_id: str, cutoff: int) -> int:
+        total = 0
+        while True:
+            deleted = await self.db.pool.write(_delete_batch, table, column, config_id, cutoff, self.batch_size)
+            total += deleted
+            if deleted < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause)
+
+    async def _reclaim(self):
+        """Release free pages in steps; returns (bytes reclaimed, bytes still free)"""
+        page_size, page_count, free, auto_vacuum = await self.db.pool.write(_page_stats)
+        if auto_vacuum != 2:
+            # Only incremental auto-vacuum can shrink the file without a full
+            # VACUUM; compact_db.py converts older databases offline
+            return 0, free * page_size
+
+        before = page_count
+        while free > 0:
+            await self.db.pool.write(_incremental_vacuum, min(free, self.vacuum_pages))
+            previous = free
+            page_size, page_count, free, _ = await self.db.pool.write(_page_stats)
+            if free >= previous:
+                break
+            await asyncio.sleep(self.pause)
+        return (before - page_count) * page_size, free * page_size
+
+    def policy(self) -> dict:
+        return {"raw_days": self.raw_policy, "rollup_days": self.rollup_policy}
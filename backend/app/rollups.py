@@ -0,0 +1,322 @@
+import json
+import math
+import re
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Rollup resolutions, finest first: name -> bucket width in epoch ms
+RESOLUTIONS = {
+    '1m': 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+}
+
+# Without an explicit bucket size, use the coarsest rollup that still gives
+# MIN_POINTS buckets and merge it down to at most MAX_POINTS
+MIN_POINTS = 100
+MAX_POINTS = 500
+
+# Relative accuracy of the percentile sketch: values land in log buckets of
+# width GAMMA, so estimates are within ~2% of the true value
+GAMMA = 1.04
+_LOG_GAMMA = math.log(GAMMA)
+_MIN_VALUE = 1e-6
+
+ROLLUP_TABLE = '''
+    CREATE TABLE IF NOT EXISTS results_rollup_{name} (
+        config_id TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        success_count INTEGER NOT NULL,
+        rt_count INTEGER NOT NULL,
+        rt_sum REAL NOT NULL,
+        rt_min REAL,
+        rt_max REAL,
+        sketch TEXT,
+        PRIMARY KEY (config_id, bucket)
+    ) WITHOUT ROWID
+'''
+
+# Per-phase latency (ms) of HTTP probes, rolled up alongside response_time
+PHASE_ROLLUP_TABLE = '''
+    CREATE TABLE IF NOT EXISTS results_phase_rollup_{name} (
+        config_id TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        phase TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        success_count INTEGER NOT NULL,
+        rt_count INTEGER NOT NULL,
+        rt_sum REAL NOT NULL,
+        rt_min REAL,
+        rt_max REAL,
+        sketch TEXT,
+        PRIMARY KEY (config_id, bucket, phase)
+    ) WITHOUT ROWID
+'''
+
+# connect_ms (TCP and TLS together) only appears in buckets from before
+# the two were timed separately
+PHASES = ('queue_ms', 'dns_ms', 'tcp_ms', 'tls_ms', 'connect_ms', 'ttfb_ms', 'transfer_ms', 'total_ms')
+
+_BUCKET_RE = re.compile(r'^(\d+)([smhd]?)$')
+_UNIT_MS = {'': 1000, 's': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+
+
+def parse_bucket(bucket: str) -> int:
+    """Parse '5m', '1h', '300' (seconds) etc. into milliseconds"""
+    match = _BUCKET_RE.match(bucket.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid bucket: {bucket}")
+    return int(match.group(1)) * _UNIT_MS[match.group(2)]
+
+
+def choose_resolution(bucket_ms: int) -> str:
+    """Coarsest rollup whose buckets still fit inside the requested bucket"""
+    chosen = '1m'
+    for name, width in RESOLUTIONS.items():
+        if width <= bucket_ms:
+            chosen = name
+    return chosen
+
+
+def default_bucket(range_ms: int) -> int:
+    """Bucket size for a range, bounding the rollup rows read per config"""
+    width = RESOLUTIONS['1m']
+    for candidate in RESOLUTIONS.values():
+        if range_ms // candidate >= MIN_POINTS:
+            width = candidate
+    return max(width, range_ms // MAX_POINTS)
+
+
+class Aggregate:
+    """Mergeable summary of the results that fell into one bucket"""
+
+    __slots__ = ('count', 'success_count', 'rt_count', 'rt_sum', 'rt_min', 'rt_max', 'sketch')
+
+    def __init__(self):
+        self.count = 0
+        self.success_count = 0
+        self.rt_count = 0
+        self.rt_sum = 0.0
+        self.rt_min: Optional[float] = None
+        self.rt_max: Optional[float] = None
+        self.sketch: Dict[int, int] = {}
+
+    def add(self, success: bool, response_time: Optional[float]):
+        self.count += 1
+        if not success:
+            return
+        self.success_count += 1
+        # Latency stats only describe successful probes
+        if response_time is None:
+            return
+        self.rt_count += 1
+        self.rt_sum += response_time
+        self.rt_min = response_time if self.rt_min is None else min(self.rt_min, response_time)
+        self.rt_max = response_time if self.rt_max is None else max(self.rt_max, response_time)
+        key = math.ceil(math.log(max(response_time, _MIN_VALUE)) / _LOG_GAMMA)
+        self.sketch[key] = self.sketch.get(key, 0) + 1
+
+    def merge(self, other: 'Aggregate'):
+        self.count += other.count
+        self.success_count += other.success_count
+        self.rt_count += other.rt_count
+        self.rt_sum += other.rt_sum
+        if other.rt_min is not None:
+            self.rt_min = other.rt_min if self.rt_min is None else min(self.rt_min, other.rt_min)
+        if other.rt_max is not None:
+            self.rt_max = other.rt_max if self.rt_max is None else max(self.rt_max, other.rt_max)
+        for key, value in other.sketch.items():
+            self.sketch[key] = self.sketch.get(key, 0) + value
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.rt_count:
+            return None
+        rank = q * (self.rt_count - 1)
+        seen = 0
+        for key in sorted(self.sketch):
+            seen += self.sketch[key]
+            if seen > rank:
+                estimate = 2 * GAMMA ** key / (GAMMA + 1)
+                return min(max(estimate, self.rt_min), self.rt_max)
+        return self.rt_max
+
+    def to_row(self) -> tuple:
+        sketch = json.dumps(self.sketch, separators=(',', ':')) if self.sketch else None
+        return (self.count, self.success_count, self.rt_count, self.rt_sum,
+                self.rt_min, self.rt_max, sketch)
+
+    @classmethod
+    def from_row(cls, row) -> 'Aggregate':
+        agg = cls()
+        (agg.count, agg.success_count, agg.rt_count, agg.rt_sum,
+         agg.rt_min, agg.rt_max, sketch) = row
+        if sketch:
+            agg.sketch = {int(key): value for key, value in json.loads(sketch).items()}
+        return agg
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "success_count": self.success_count,
+            "success_rate": (self.success_count / self.count) * 100 if self.count else None,
+            "min": self.rt_min,
+            "max": self.rt_max,
+            "mean": self.rt_sum / self.rt_count if self.rt_count else None,
+            "p50": self.quantile(0.50),
+            "p90": self.quantile(0.90),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+def _phase_summary(agg: Aggregate) -> dict:
+    summary = agg.summary()
+    del summary["success_count"], summary["success_rate"]
+    return summary
+
+
+_AGG_COLUMNS = "count, success_count, rt_count, rt_sum, rt_min, rt_max, sketch"
+
+
+def create_rollup_tables(conn: sqlite3.Connection):
+    for name in RESOLUTIONS:
+        conn.execute(ROLLUP_TABLE.format(name=name))
+        conn.execute(PHASE_ROLLUP_TABLE.format(name=name))
+
+
+def apply_rollups(conn: sqlite3.Connection, rows: Iterable[Tuple[str, int, bool, Optional[float]]]):
+    """Fold (config_id, timestamp_ms, success, response_time) rows into every rollup.
+
+    Must run on the writer connection, inside the transaction that inserted
+    the raw rows, so rollups never drift from test_results.
+    """
+    partials: Dict[str, Dict[Tuple[str, int], Aggregate]] = {name: {} for name in RESOLUTIONS}
+    for config_id, timestamp, success, response_time in rows:
+        for name, width in RESOLUTIONS.items():
+            key = (config_id, timestamp - timestamp % width)
+            agg = partials[name].get(key)
+            if agg is None:
+                agg = partials[name][key] = Aggregate()
+            agg.add(success, response_time)
+
+    for name, buckets in partials.items():
+        for (config_id, bucket), agg in buckets.items():
+            existing = conn.execute(
+                f"SELECT {_AGG_COLUMNS} FROM results_rollup_{name} WHERE config_id = ? AND bucket = ?",
+                (config_id, bucket)
+            ).fetchone()
+            if existing:
+                merged = Aggregate.from_row(existing)
+                merged.merge(agg)
+                agg = merged
+            conn.execute(
+                f"INSERT OR REPLACE INTO results_rollup_{name} (config_id, bucket, {_AGG_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (config_id, bucket) + agg.to_row()
+            )
+
+
+def apply_phase_rollups(conn: sqlite3.Connection, rows: Iterable[Tuple[str, int, Dict[str, Optional[float]]]]):
+    """Fold (config_id, timestamp_ms, timings) rows into the phase rollups.
+
+    Phases that didn't happen (None, e.g. connect on a reused connection)
+    are left out rather than counted as zero.
+    """
+    partials: Dict[str, Dict[Tuple[str, int, str], Aggregate]] = {name: {} for name in RESOLUTIONS}
+    for config_id, timestamp, timings in rows:
+        for phase in PHASES:
+            value = timings.get(phase)
+            if value is None:
+                continue
+            for name, width in RESOLUTIONS.items():
+                key = (config_id, timestamp - timestamp % width, phase)
+                agg = partials[name].get(key)
+                if agg is None:
+                    agg = partials[name][key] = Aggregate()
+                agg.add(True, value)
+
+    for name, buckets in partials.items():
+        for (config_id, bucket, phase), agg in buckets.items():
+            existing = conn.execute(
+                f"SELECT {_AGG_COLUMNS} FROM results_phase_rollup_{name} "
+                "WHERE config_id = ? AND bucket = ? AND phase = ?",
+                (config_id, bucket, phase)
+            ).fetchone()
+            if existing:
+                merged = Aggregate.from_row(existing)
+                merged.merge(agg)
+                agg = merged
+            conn.execute(
+                f"INSERT OR REPLACE INTO results_phase_rollup_{name} (config_id, bucket, phase, {_AGG_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (config_id, bucket, phase) + agg.to_row()
+            )
+
+
+def delete_rollups(conn: sqlite3.Connection, config_id: str):
+    for name in RESOLUTIONS:
+        conn.execute(f"DELETE FROM results_rollup_{name} WHERE config_id = ?", (config_id,))
+        conn.execute(f"DELETE FROM results_phase_rollup_{name} WHERE config_id = ?", (config_id,))
+
+
+def query_aggregates(
+    conn: sqlite3.Connection,
+    start: int,
+    end: int,
+    bucket_ms: Optional[int] = None,
+    config_id: Optional[str] = None
+) -> dict:
+    """Re-bucket the coarsest fitting rollup into bucket_ms wide buckets"""
+    if bucket_ms is None:
+        bucket_ms = default_bucket(end - start)
+    resolution = choose_resolution(bucket_ms)
+    width = RESOLUTIONS[resolution]
+    # Output buckets are whole multiples of the rollup they are built from
+    bucket_ms = max(width, bucket_ms - bucket_ms % width)
+
+    query = f"SELECT config_id, bucket, {_AGG_COLUMNS} FROM results_rollup_{resolution} WHERE bucket >= ? AND bucket < ?"
+    params: list = [start - start % width, end]
+    if config_id:
+        query += " AND config_id = ?"
+        params.append(config_id)
+    query += " ORDER BY config_id, bucket"
+
+    merged: Dict[Tuple[str, int], Aggregate] = {}
+    for row in conn.execute(query, params):
+        key = (row[0], row[1] - row[1] % bucket_ms)
+        agg = Aggregate.from_row(row[2:])
+        if key in merged:
+            merged[key].merge(agg)
+        else:
+            merged[key] = agg
+
+    phase_query = (f"SELECT config_id, bucket, phase, {_AGG_COLUMNS} FROM results_phase_rollup_{resolution} "
+                   "WHERE bucket >= ? AND bucket < ?")
+    if config_id:
+        phase_query += " AND config_id = ?"
+    phases: Dict[Tuple[str, int], Dict[str, Aggregate]] = {}
+    for row in conn.execute(phase_query, params):
+        key = (row[0], row[1] - row[1] % bucket_ms)
+        agg = Aggregate.from_row(row[3:])
+        bucket_phases = phases.setdefault(key, {})
+        if row[2] in bucket_phases:
+            bucket_phases[row[2]].merge(agg)
+        else:
+            bucket_phases[row[2]] = agg
+
+    buckets: List[dict] = []
+    for (cfg, bucket), agg in merged.items():
+        entry = {"config_id": cfg, "bucket": bucket}
+        entry.update(agg.summary())
+        if (cfg, bucket) in phases:
+            bucket_phases = phases[(cfg, bucket)]
+            entry["phases"] = {phase: _phase_summary(bucket_phases[phase])
+                               for phase in PHASES if phase in bucket_phases}
+        buckets.append(entry)
+
+    return {
+        "resolution": resolution,
+        "bucket_seconds": bucket_ms // 1000,
+        "buckets": buckets,
+    }
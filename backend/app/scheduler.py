@@ -0,0 +1,129 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from .models import TestConfig
+
+# Guards against a zero or negative interval spinning the loop
+MIN_INTERVAL = 0.1
+
+class Scheduler:
+    """Runs every enabled config on its own interval from a heap of deadlines.
+
+    The loop sleeps until the earliest deadline, or until a config change
+    wakes it. Each run costs one heap pop and push. Edited or deleted
+    configs leave stale heap entries behind; those are recognised by their
+    generation number and skipped.
+    """
+
+    def __init__(self, run: Callable[[TestConfig], Awaitable], jitter: float = None):
+        self._run = run
+        # Spread runs by up to this fraction of each config's interval
+        self.jitter = jitter if jitter is not None else float(os.getenv('SCHEDULER_JITTER', '0'))
+        self._heap: List[tuple] = []  # (deadline, seq, config_id, generation, base)
+        self._configs: Dict[str, TestConfig] = {}
+        self._generation: Dict[str, int] = {}
+        self._next_base: Dict[str, float] = {}
+        self._running: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def _offset(self, config: TestConfig) -> float:
+        if self.jitter <= 0:
+            return 0.0
+        return random.uniform(0, self.jitter * config.interval)
+
+    def _push(self, config: TestConfig, base: float):
+        self._next_base[config.id] = base
+        entry = (base + self._offset(config), next(self._seq), config.id,
+                 self._generation[config.id], base)
+        heapq.heappush(self._heap, entry)
+
+    def _notify(self):
+        # Drop stale entries once they outnumber live ones
+        if len(self._heap) > 2 * len(self._configs) + 64:
+            self._heap = [entry for entry in self._heap
+                          if self._generation.get(entry[2]) == entry[3]]
+            heapq.heapify(self._heap)
+        if self._wake is not None:
+            self._wake.set()
+
+    def load(self, configs: List[TestConfig]):
+        for config in configs:
+            self.upsert(config)
+
+    def upsert(self, config: TestConfig):
+        """Add or update a config; new configs run right away"""
+        if not config.enabled:
+            self.remove(config.id)
+            return
+
+        now = self._now()
+        previous = self._next_base.get(config.id)
+        self._generation[config.id] = self._generation.get(config.id, 0) + 1
+        self._configs[config.id] = config
+        if previous is None:
+            base = now
+        else:
+            # Keep the existing cadence unless the new interval is shorter
+            base = min(previous, now + max(config.interval, MIN_INTERVAL))
+        self._push(config, base)
+        self._notify()
+
+    def remove(self, config_id: str):
+        self._configs.pop(config_id, None)
+        self._next_base.pop(config_id, None)
+        if config_id in self._generation:
+            self._generation[config_id] += 1
+        self._notify()
+
+    def stats(self) -> dict:
+        return {
+            "configs": len(self._configs),
+            "running": len(self._running),
+            "heap_size": len(self._heap),
+        }
+
+    async def run_forever(self):
+        self._wake = asyncio.Event()
+        while True:
+            self._wake.clear()
+            now = self._now()
+
+            while self._heap and self._heap[0][0] <= now:
+                _, _, config_id, generation, base = heapq.heappop(self._heap)
+                if self._generation.get(config_id) != generation:
+                    continue
+
+                config = self._configs[config_id]
+                # Fixed cadence from the previous slot; if we fell behind,
+                # resume from now instead of firing a backlog of runs
+                self._push(config, max(base + max(config.interval, MIN_INTERVAL), now))
+
+                # Skip this slot if the previous run is still going
+                if config_id in self._running:
+                    continue
+                self._running.add(config_id)
+                task = asyncio.create_task(self._launch(config))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _launch(self, config: TestConfig):
+        try:
+            await self._run(config)
+        except Exception as e:
+            print(f"Scheduler error for {config.name}: {e}")
+        finally:
+            self._running.discard(config.id)
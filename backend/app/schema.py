@@ -0,0 +1,402 @@
+import asyncio
+import json
+import os
+import sqlite3
+from .result_encoding import RAW_INDEX, RAW_TABLE, encode_data, split_raw, store_raw
+from .rollups import apply_rollups, create_rollup_tables
+
+# Bumped whenever a migration below is added; stored in PRAGMA user_version
+SCHEMA_VERSION = 9
+
+MIGRATION_CHUNK_SIZE = int(os.getenv('MIGRATION_CHUNK_SIZE', '5000'))
+
+CONFIGS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS test_configs (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        test_type TEXT NOT NULL,
+        target TEXT NOT NULL,
+        interval INTEGER DEFAULT 30,
+        timeout INTEGER DEFAULT 5,
+        enabled BOOLEAN DEFAULT 1,
+        dns_servers TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        ping_count INTEGER DEFAULT 1,
+        ping_spacing REAL DEFAULT 0.2,
+        http_keepalive BOOLEAN DEFAULT 1,
+        http_body TEXT DEFAULT 'stream',
+        store_raw BOOLEAN DEFAULT 0
+    )
+'''
+
+# Columns added to test_configs by later schema versions
+CONFIG_COLUMNS = {
+    3: [('ping_count', 'INTEGER DEFAULT 1'), ('ping_spacing', 'REAL DEFAULT 0.2')],
+    4: [('http_keepalive', 'BOOLEAN DEFAULT 1'), ('http_body', "TEXT DEFAULT 'stream'")],
+    5: [('store_raw', 'BOOLEAN DEFAULT 0')],
+}
+
+# timestamp is UTC epoch milliseconds; id is the rowid, AUTOINCREMENT so
+# sqlite_sequence keeps the highest id ever used and deleting the newest
+# rows never hands their ids (or sync cursors) out again; raw_id points at
+# compressed tool output in result_raw; agent_id is the remote agent that
+# ran the test, NULL for this instance; idempotency_key is the client's key
+# for a bulk-loaded result, so a retried upload is not stored twice
+RESULTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        config_id TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        success BOOLEAN NOT NULL,
+        response_time REAL,
+        error TEXT,
+        data TEXT,
+        raw_id INTEGER,
+        agent_id TEXT,
+        idempotency_key TEXT,
+        FOREIGN KEY (config_id) REFERENCES test_configs (id)
+    )
+'''
+
+# Partial, so probe results (which have no key) cost nothing extra
+IDEMPOTENCY_INDEX = '''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_test_results_idempotency
+    ON test_results (idempotency_key) WHERE idempotency_key IS NOT NULL
+'''
+
+RESULTS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_test_results_config_ts ON test_results (config_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_test_results_ts ON test_results (timestamp)",
+    IDEMPOTENCY_INDEX,
+]
+
+# Resume points for chunked migrations that can't be made idempotent otherwise
+MIGRATION_STATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS migration_state (
+        name TEXT PRIMARY KEY,
+        position INTEGER NOT NULL
+    )
+'''
+
+# Remote probe agents; last_seq is the highest spool sequence number
+# stored, which makes resent batches idempotent
+AGENTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS agents (
+        id TEXT PRIMARY KEY,
+        site TEXT,
+        last_seq INTEGER NOT NULL DEFAULT 0,
+        last_seen INTEGER
+    )
+'''
+
+# State changes flagged by the detector: degraded, down or recovered;
+# detail is JSON with the figures behind the change
+EVENTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY,
+        config_id TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        detail TEXT
+    )
+'''
+
+EVENTS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_events_config_ts ON events (config_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_events_ts ON events (timestamp)",
+]
+
+# Legacy rows hold ISO strings with or without a 'Z' suffix; both are UTC
+ISO_TO_EPOCH_MS = "CAST(round((julianday({column}) - 2440587.5) * 86400000.0) AS INTEGER)"
+
+
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone()
+    return row is not None
+
+
+def user_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def create_schema(conn: sqlite3.Connection):
+    """Create any missing tables; brand new databases start at SCHEMA_VERSION"""
+    fresh = not _table_exists(conn, 'test_results')
+
+    conn.execute(CONFIGS_TABLE)
+    conn.execute(MIGRATION_STATE_TABLE)
+    conn.execute(RAW_TABLE)
+    conn.execute(AGENTS_TABLE)
+    conn.execute(EVENTS_TABLE)
+    for statement in EVENTS_INDEXES:
+        conn.execute(statement)
+    create_rollup_tables(conn)
+    if fresh:
+        conn.execute(RESULTS_TABLE.format(name='test_results'))
+        for statement in RESULTS_INDEXES:
+            conn.execute(statement)
+        conn.execute(RAW_INDEX)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+async def migrate(pool):
+    """Bring an existing database up to SCHEMA_VERSION in place"""
+    version = await pool.write(user_version)
+    if version < 1:
+        await _migrate_typed_results(pool)
+    if version < 2:
+        await _backfill_rollups(pool)
+    if version < 3:
+        await pool.write(_add_config_columns, 3)
+    if version < 4:
+        await pool.write(_add_config_columns, 4)
+    if version < 5:
+        await pool.write(_add_raw_storage)
+        await _compact_results(pool)
+    if version < 6:
+        await pool.write(_add_agent_column)
+    if version < 7:
+        await pool.write(_add_idempotency_key)
+    if version < 8:
+        await pool.write(_add_events)
+    if version < 9:
+        await _migrate_autoincrement(pool)
+
+
+def _copy_legacy_chunk(conn: sqlite3.Connection, chunk_size: int):
+    """Move one chunk of legacy rows into test_results_v1.
+
+    Copy and delete happen in the same transaction, so an interrupted
+    migration resumes where it stopped on the next start.
+    """
+    chunk = conn.execute(
+        "SELECT rowid FROM test_results ORDER BY rowid LIMIT ?", (chunk_size,)
+    ).fetchall()
+    if not chunk:
+        return 0, 0
+    last_rowid = chunk[-1][0]
+
+    cursor = conn.execute(f'''
+        INSERT INTO test_results_v1 (config_id, timestamp, success, response_time, error, data)
+        SELECT config_id, {ISO_TO_EPOCH_MS.format(column='timestamp')}, success, response_time, error, data
+        FROM test_results
+        WHERE rowid <= ? AND {ISO_TO_EPOCH_MS.format(column='timestamp')} IS NOT NULL
+        ORDER BY rowid
+    ''', (last_rowid,))
+    copied = cursor.rowcount
+    conn.execute("DELETE FROM test_results WHERE rowid <= ?", (last_rowid,))
+    return len(chunk), copied
+
+
+def _finish_typed_results(conn: sqlite3.Connection):
+    # DDL does not open a transaction implicitly; the swap must be atomic
+    conn.execute("BEGIN")
+    conn.execute("DROP TABLE test_results")
+    conn.execute("ALTER TABLE test_results_v1 RENAME TO test_results")
+    for statement in RESULTS_INDEXES:
+        conn.execute(statement)
+    conn.execute("PRAGMA user_version = 1")
+
+
+async def _migrate_typed_results(pool):
+    """v1: integer rowid keys, epoch-ms timestamps and (config_id, timestamp) indexes"""
+    total = await pool.write(lambda conn: conn.execute("SELECT COUNT(*) FROM test_results").fetchone()[0])
+    await pool.write(lambda conn: conn.execute(RESULTS_TABLE.format(name='test_results_v1')))
+    print(f"Migrating {total} test results to the typed schema...")
+
+    moved = skipped = 0
+    while True:
+        seen, copied = await pool.write(_copy_legacy_chunk, MIGRATION_CHUNK_SIZE)
+        if not seen:
+            break
+        moved += copied
+        skipped += seen - copied
+        print(f"Migrated {moved}/{total} results...")
+        # Let other queued work reach the writer between chunks
+        await asyncio.sleep(0)
+
+    await pool.write(_finish_typed_results)
+    if skipped:
+        print(f"Skipped {skipped} results with unparseable timestamps")
+    print(f"Migration complete! Migrated {moved} test results")
+
+
+def _rollup_chunk(conn: sqlite3.Connection, chunk_size: int) -> int:
+    row = conn.execute("SELECT position FROM migration_state WHERE name = 'rollups'").fetchone()
+    position = row[0] if row else 0
+    rows = conn.execute('''
+        SELECT id, config_id, timestamp, success, response_time
+        FROM test_results WHERE id > ? ORDER BY id LIMIT ?
+    ''', (position, chunk_size)).fetchall()
+    if not rows:
+        return 0
+
+    apply_rollups(conn, (row[1:] for row in rows))
+    conn.execute("INSERT OR REPLACE INTO migration_state (name, position) VALUES ('rollups', ?)", (rows[-1][0],))
+    return len(rows)
+
+
+def _finish_rollups(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM migration_state WHERE name = 'rollups'")
+    conn.execute("PRAGMA user_version = 2")
+
+
+async def _backfill_rollups(pool):
+    """v2: build the 1m/1h/1d rollups from the raw results already stored"""
+    print("Building result rollups...")
+    done = 0
+    while True:
+        count = await pool.write(_rollup_chunk, MIGRATION_CHUNK_SIZE)
+        if not count:
+            break
+        done += count
+        print(f"Rolled up {done} results...")
+        await asyncio.sleep(0)
+
+    await pool.write(_finish_rollups)
+    print(f"Rollups complete! Processed {done} test results")
+
+
+def _ensure_columns(conn: sqlite3.Connection, table: str, columns):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _add_config_columns(conn: sqlite3.Connection, version: int):
+    """v3: ping burst settings; v4: HTTP connection reuse and body handling"""
+    _ensure_columns(conn, 'test_configs', CONFIG_COLUMNS[version])
+    conn.execute(f"PRAGMA user_version = {version}")
+
+
+def _add_raw_storage(conn: sqlite3.Connection):
+    _ensure_columns(conn, 'test_configs', CONFIG_COLUMNS[5])
+    _ensure_columns(conn, 'test_results', [('raw_id', 'INTEGER')])
+    conn.execute(RAW_INDEX)
+
+
+def _add_agent_column(conn: sqlite3.Connection):
+    """v6: results can come from remote agents"""
+    _ensure_columns(conn, 'test_results', [('agent_id', 'TEXT')])
+    conn.execute("PRAGMA user_version = 6")
+
+
+def _add_idempotency_key(conn: sqlite3.Connection):
+    """v7: client keys that make bulk uploads safe to retry"""
+    _ensure_columns(conn, 'test_results', [('idempotency_key', 'TEXT')])
+    conn.execute(IDEMPOTENCY_INDEX)
+    conn.execute("PRAGMA user_version = 7")
+
+
+def _add_events(conn: sqlite3.Connection):
+    """v8: detector events; create_schema has already made the table"""
+    conn.execute("PRAGMA user_version = 8")
+
+
+RESULT_COPY_COLUMNS = ("id, config_id, timestamp, success, response_time, error, data, raw_id, "
+                       "agent_id, idempotency_key")
+
+
+def _copy_results_chunk(conn: sqlite3.Connection, chunk_size: int) -> int:
+    """Move one chunk of rows, ids included, into test_results_v9.
+
+    Copy and delete happen in the same transaction, so an interrupted
+    migration resumes where it stopped on the next start.
+    """
+    chunk = conn.execute("SELECT id FROM test_results ORDER BY id LIMIT ?", (chunk_size,)).fetchall()
+    if not chunk:
+        return 0
+    last_id = chunk[-1][0]
+    conn.execute(f'''
+        INSERT INTO test_results_v9 ({RESULT_COPY_COLUMNS})
+        SELECT {RESULT_COPY_COLUMNS} FROM test_results WHERE id <= ?
+    ''', (last_id,))
+    conn.execute("DELETE FROM test_results WHERE id <= ?", (last_id,))
+    return len(chunk)
+
+
+def _finish_autoincrement(conn: sqlite3.Connection):
+    conn.execute("BEGIN")
+    conn.execute("DROP TABLE test_results")
+    conn.execute("ALTER TABLE test_results_v9 RENAME TO test_results")
+    for statement in RESULTS_INDEXES:
+        conn.execute(statement)
+    conn.execute(RAW_INDEX)
+    conn.execute("PRAGMA user_version = 9")
+
+
+async def _migrate_autoincrement(pool):
+    """v9: AUTOINCREMENT ids, so the highest id used survives deletes and restarts"""
+    sql = await pool.write(lambda conn: conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name='test_results'"
+    ).fetchone()[0])
+    if 'AUTOINCREMENT' in sql.upper():
+        # Came through the v1 migration, which already uses the new table
+        await pool.write(lambda conn: conn.execute("PRAGMA user_version = 9"))
+        return
+
+    total = await pool.write(lambda conn: conn.execute("SELECT COUNT(*) FROM test_results").fetchone()[0])
+    await pool.write(lambda conn: conn.execute(RESULTS_TABLE.format(name='test_results_v9')))
+    print(f"Rebuilding {total} test results with AUTOINCREMENT ids...")
+
+    moved = 0
+    while True:
+        count = await pool.write(_copy_results_chunk, MIGRATION_CHUNK_SIZE)
+        if not count:
+            break
+        moved += count
+        print(f"Rebuilt {moved}/{total} results...")
+        await asyncio.sleep(0)
+
+    await pool.write(_finish_autoincrement)
+    print(f"Rebuild complete! Copied {moved} test results")
+
+
+def _compact_chunk(conn: sqlite3.Connection, chunk_size: int) -> int:
+    row = conn.execute("SELECT position FROM migration_state WHERE name = 'compact_results'").fetchone()
+    position = row[0] if row else 0
+    rows = conn.execute('''
+        SELECT r.id, c.test_type, r.data FROM test_results r
+        LEFT JOIN test_configs c ON c.id = r.config_id
+        WHERE r.id > ? ORDER BY r.id LIMIT ?
+    ''', (position, chunk_size)).fetchall()
+    if not rows:
+        return 0
+
+    updates = []
+    for result_id, test_type, data in rows:
+        if not data:
+            continue
+        try:
+            metrics, raw = split_raw(test_type, json.loads(data))
+        except ValueError:
+            continue
+        # Existing output is kept (compressed) whatever the config's store_raw
+        raw_id = store_raw(conn, raw) if raw else None
+        updates.append((encode_data(metrics), raw_id, result_id))
+    conn.executemany("UPDATE test_results SET data = ?, raw_id = ? WHERE id = ?", updates)
+    conn.execute("INSERT OR REPLACE INTO migration_state (name, position) VALUES ('compact_results', ?)", (rows[-1][0],))
+    return len(rows)
+
+
+def _finish_compact_results(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM migration_state WHERE name = 'compact_results'")
+    conn.execute("PRAGMA user_version = 5")
+
+
+async def _compact_results(pool):
+    """v5: move raw tool output into result_raw and re-encode data compactly"""
+    print("Compacting stored results...")
+    done = 0
+    while True:
+        count = await pool.write(_compact_chunk, MIGRATION_CHUNK_SIZE)
+        if not count:
+            break
+        done += count
+        print(f"Compacted {done} results...")
+        await asyncio.sleep(0)
+
+    await pool.write(_finish_compact_results)
+    # Freed pages go back to the OS on the next retention pass
+    print(f"Compaction complete! Processed {done} test results")
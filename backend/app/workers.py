@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Dict, List, Optional
+
+from .admission import BANDWIDTH, AdmissionController, BandwidthGate
+from .database import Database
+from .models import TestConfig
+from .network_tests import NetworkTester
+from .result_sink import ResultSink
+from .retention import RetentionManager
+from .scheduler import Scheduler
+
+# 0 runs probes inside the API process, as before
+PROBE_WORKERS = int(os.getenv('PROBE_WORKERS', '0'))
+# Seconds between stats reports from the worker and writer processes
+STATUS_INTERVAL = float(os.getenv('WORKER_STATUS_INTERVAL', '5'))
+# Points per worker on the hash ring; more points even out shard sizes
+RING_POINTS = 64
+
+_STOP = None
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash of config ids onto worker indexes.
+
+    Changing the worker count only moves the configs on the ring segments
+    that change hands, so most keep their worker across restarts.
+    """
+
+    def __init__(self, workers: int, points: int = RING_POINTS):
+        ring = sorted((_hash(f"worker-{index}#{point}"), index)
+                      for index in range(workers) for point in range(points))
+        self._keys = [key for key, _ in ring]
+        self._owners = [index for _, index in ring]
+
+    def owner(self, config_id: str) -> int:
+        position = bisect.bisect(self._keys, _hash(config_id)) % len(self._keys)
+        return self._owners[position]
+
+
+def _type_name(config: TestConfig) -> str:
+    return getattr(config.test_type, 'value', config.test_type)
+
+
+def owner_of(ring: HashRing, config: TestConfig) -> int:
+    # Bandwidth tests all go to worker 0, which keeps two of them from
+    # running at once; the BandwidthGate pauses the other workers' probes
+    if AdmissionController.classify(config.test_type) == BANDWIDTH:
+        return 0
+    return ring.owner(config.id)
+
+
+async def _drain(source: multiprocessing.Queue, handle):
+    """Feed items from a process queue to handle() until the stop marker"""
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await loop.run_in_executor(None, source.get)
+        if item is _STOP:
+            return
+        await handle(item)
+
+
+async def _report(status: multiprocessing.Queue, name: str, stats):
+    while True:
+        await asyncio.sleep(STATUS_INTERVAL)
+        try:
+            status.put_nowait((name, stats()))
+        except queue.Full:
+            pass
+
+
+async def _run_worker(index: int, workers: int, db_path: str, results, control, status, gate):
+    db = Database(db_path)
+    tester = NetworkTester()
+    admission = AdmissionController(gate=gate)
+    ring = HashRing(workers)
+
+    async def run(config: TestConfig):
+        async with admission.slot(config.test_type):
+            result = await tester.run_test(config)
+        results.put(result)
+
+    scheduler = Scheduler(run)
+    scheduler.load([config for config in await db.get_configs() if owner_of(ring, config) == index])
+    tasks = [
+        asyncio.create_task(scheduler.run_forever()),
+        asyncio.create_task(_report(status, f"worker-{index}", lambda: {
+            "scheduler": scheduler.stats(),
+            "admission": admission.stats(),
+        })),
+    ]
+
+    async def apply(message):
+        action, payload = message
+        if action == "upsert":
+            scheduler.upsert(payload)
+        elif action == "remove":
+            scheduler.remove(payload)
+
+    try:
+        await _drain(control, apply)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await tester.close()
+        await db.close()
+
+
+def worker_main(index: int, workers: int, db_path: str, results, control, status, gate):
+    """Probe worker: schedules and runs the configs on its shard"""
+    # Ctrl+C reaches the whole process group; shutdown is driven by the
+    # API process instead so the writer gets to flush
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, workers, db_path, results, control, status, gate))
+
+
+async def _run_writer(db_path: str, results, status):
+    db = Database(db_path)
+    sink = ResultSink(db)
+    retention = RetentionManager(db)
+    await sink.start()
+    tasks = [
+        asyncio.create_task(retention.run_forever()),
+        asyncio.create_task(_report(status, "writer", lambda: {
+            "result_sink": sink.stats(),
+            "retention": retention.last_run,
+        })),
+    ]
+
+    async def store(result):
+        # Don't wait for the commit; the sink batches behind this
+        await sink.put(result)
+
+    try:
+        await _drain(results, store)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await sink.close()
+        await db.close()
+
+
+def writer_main(db_path: str, results, status):
+    """Single writer: commits results from every worker in batches"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_writer(db_path, results, status))
+
+
+class WorkerPool:
+    """Probe worker processes plus the writer process they report to.
+
+    Each worker owns the configs the hash ring assigns it and runs its own
+    scheduler, admission control and NetworkTester. Results go over one
+    queue to the writer, which alone inserts them, batches through a
+    ResultSink and runs retention. The API process keeps serving reads and
+    follows new rows with Database.sync_results.
+    """
+
+    def __init__(self, workers: int = None, db_path: str = None):
+        self.workers = workers or PROBE_WORKERS
+        self.db_path = db_path or os.getenv('DB_PATH', 'network_tests.db')
+        self.ring = HashRing(self.workers)
+        # Processes are started fresh rather than forked from a process
+        # that already has threads and open sqlite handles
+        self._context = multiprocessing.get_context('spawn')
+        self._results = self._context.Queue()
+        self._status = self._context.Queue(maxsize=1000)
+        self._gate = BandwidthGate(self._context)
+        self._controls: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._writer: Optional[multiprocessing.Process] = None
+        self._stats: Dict[str, dict] = {}
+        self._stats_at: Dict[str, float] = {}
+        self._status_task: Optional[asyncio.Task] = None
+        self.test_types: Dict[str, str] = {}
+
+    def start(self, configs: List[TestConfig]):
+        self.test_types = {config.id: _type_name(config) for config in configs}
+        self._writer = self._context.Process(
+            target=writer_main, args=(self.db_path, self._results, self._status),
+            name="pingdumb-writer", daemon=True,
+        )
+        self._writer.start()
+        for index in range(self.workers):
+            control = self._context.Queue()
+            process = self._context.Process(
+                target=worker_main,
+                args=(index, self.workers, self.db_path, self._results, control, self._status, self._gate),
+                name=f"pingdumb-worker-{index}", daemon=True,
+            )
+            process.start()
+            self._controls.append(control)
+            self._processes.append(process)
+        self._status_task = asyncio.create_task(_drain(self._status, self._record))
+        print(f"Started {self.workers} probe workers and a writer process")
+
+    async def _record(self, item):
+        name, stats = item
+        self._stats[name] = stats
+        self._stats_at[name] = time.time()
+
+    def upsert(self, config: TestConfig):
+        self.test_types[config.id] = _type_name(config)
+        owner = owner_of(self.ring, config)
+        for index, control in enumerate(self._controls):
+            # A test type change can move a config between shards
+            control.put(("upsert" if index == owner else "remove",
+                         config if index == owner else config.id))
+
+    def remove(self, config_id: str):
+        self.test_types.pop(config_id, None)
+        for control in self._controls:
+            control.put(("remove", config_id))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for process in self._processes if process.is_alive()),
+            "writer_alive": bool(self._writer and self._writer.is_alive()),
+            "bandwidth_gate": self._gate.stats(),
+            "processes": {
+                name: dict(stats, reported_at=self._stats_at[name])
+                for name, stats in sorted(self._stats.items())
+            },
+        }
+
+    def retention_last_run(self) -> Optional[dict]:
+        return self._stats.get("writer", {}).get("retention")
+
+    async def close(self):
+        """Stop the workers first, then let the writer flush what they sent"""
+        loop = asyncio.get_running_loop()
+        for control in self._controls:
+            control.put(_STOP)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, 10)
+        self._results.put(_STOP)
+        if self._writer is not None:
+            await loop.run_in_executor(None, self._writer.join, 30)
+        self._status.put(_STOP)
+        if self._status_task is not None:
+            await self._status_task
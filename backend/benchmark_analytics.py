@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""/api/analytics cost on a synthetic database vs. pulling the raw rows.
+
+Fills a temporary database (and its rollups) with --rows results spread over
+--configs configs and --days days, with short outages sprinkled in and a few
+DNS configs carrying per-server results. Then times, against reading and
+serializing the rows the way /api/results does (which the dashboard used to
+download to compute its stats in the browser):
+- the exact analytics read over the last ANALYTICS_MAX_HOURS, with NumPy and
+  with the pure-Python fallback, without and with dns_servers
+- the rollup summary /api/analytics serves for the whole --days window
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from app import analytics
+from app.database import RESULT_COLUMNS
+from app.rollups import apply_rollups
+from app.result_encoding import ResultRow
+from app.schema import create_schema
+
+DNS_SERVERS = ("8.8.8.8", "1.1.1.1", "9.9.9.9")
+
+
+def populate(path: str, rows: int, configs: int, days: int, dns_configs: int):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    create_schema(conn)
+    rng = random.Random(1)
+    end = int(time.time() * 1000)
+    span = days * 24 * 3600 * 1000
+    per_config = rows // configs
+    step = span // per_config
+
+    for index in range(configs):
+        config_id = f"config-{index}"
+        dns = index < dns_configs
+        conn.execute("INSERT INTO test_configs (id, name, test_type, target) VALUES (?, ?, ?, ?)",
+                     (config_id, config_id, "dns" if dns else "ping", "example.com"))
+        batch = []
+        down = 0
+        for i in range(per_config):
+            if down:
+                down -= 1
+            elif rng.random() < 0.0005:
+                down = rng.randint(1, 40)
+            ok = not down
+            data = None
+            if dns:
+                data = json.dumps({"results": [
+                    {"server": server, "success": ok, "response_time": rng.lognormvariate(2.5 + n * 0.3, 0.4)}
+                    for n, server in enumerate(DNS_SERVERS)
+                ]}, separators=(",", ":"))
+            batch.append((config_id, end - span + i * step, ok, rng.lognormvariate(-4, 0.5) if ok else None, data))
+        conn.executemany(
+            "INSERT INTO test_results (config_id, timestamp, success, response_time, data) VALUES (?, ?, ?, ?, ?)",
+            batch,
+        )
+        apply_rollups(conn, (row[:4] for row in batch))
+        conn.commit()
+    conn.close()
+    return end - span, end + 1
+
+
+def fetch_rows(conn: sqlite3.Connection, start: int, end: int):
+    count = size = 0
+    cursor = conn.execute(
+        f"SELECT {RESULT_COLUMNS} FROM test_results WHERE timestamp >= ? AND timestamp < ?", (start, end)
+    )
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            return count, size
+        count += len(rows)
+        size += sum(len(ResultRow(row).to_json()) + 1 for row in rows)
+
+
+def timed(label: str, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    print(f"{label:<44} {time.perf_counter() - start:>8.2f} s")
+    return result
+
+
+def run(rows: int, configs: int, days: int, dns_configs: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "analytics.db")
+        print(f"Generating {rows} results for {configs} configs over {days} days...")
+        start, end = timed("  generate", populate, path, rows, configs, days, dns_configs)
+        conn = sqlite3.connect(path)
+        # Warm the page cache so every variant reads from memory
+        conn.execute("SELECT COUNT(*), SUM(success) FROM test_results").fetchone()
+        raw_start = max(start, end - analytics.MAX_HOURS * 3600 * 1000)
+
+        count, size = timed(f"{days}d of rows as /api/results JSON (before)", fetch_rows, conn, start, end)
+        raw_count, _ = fetch_rows(conn, raw_start, end)
+        label = f"{analytics.MAX_HOURS}h analytics"
+        result = timed(f"{label}, NumPy", analytics.analyze, conn, raw_start, end)
+        timed(f"{label}, NumPy, dns_servers", analytics.analyze, conn, raw_start, end, None, 1, True)
+        numpy = analytics.numpy
+        analytics.numpy = None
+        try:
+            timed(f"{label}, pure Python", analytics.analyze, conn, raw_start, end)
+            timed(f"{label}, pure Python, dns_servers", analytics.analyze, conn, raw_start, end, None, 1, True)
+        finally:
+            analytics.numpy = numpy
+        summary = timed(f"{days}d analytics from {analytics.ROLLUP_RESOLUTION} rollups", analytics.summarize,
+                        conn, start, end)
+        conn.close()
+
+        print(f"{count} rows ({size / 1e6:.0f} MB of JSON before), {raw_count} in the raw analytics window")
+        for label, sample in (("raw", result[0]), ("rollup", summary[0])):
+            print(f"{sample['config_id']} ({label}): availability {sample['availability']:.3f}% "
+                  f"p50 {sample['p50'] * 1000:.2f}ms p99 {sample['p99'] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--configs", type=int, default=50)
+    # Windows past ANALYTICS_MAX_HOURS (a week by default) come from the rollups
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--dns-configs", type=int, default=5)
+    args = parser.parse_args()
+    run(args.rows, args.configs, args.days, args.dns_configs)
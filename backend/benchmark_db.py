@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Insert/read throughput of the pooled Database vs. the old connect-per-call path.
+
+Also reports the longest event loop stall seen while the workload runs, which is
+what skews the scheduler and the RTTs it records.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from app.database import Database
+from app.models import TestResult
+
+LEGACY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS test_results (
+        id TEXT PRIMARY KEY,
+        config_id TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        success BOOLEAN NOT NULL,
+        response_time REAL,
+        error TEXT,
+        data TEXT
+    )
+'''
+
+def make_result(i: int) -> TestResult:
+    return TestResult(
+        config_id=f"config-{i % 50}",
+        timestamp=datetime.utcnow(),
+        success=True,
+        response_time=0.012,
+        data={"rtt": 12.3}
+    )
+
+async def legacy_insert(db_path: str, result: TestResult):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO test_results (id, config_id, timestamp, success, response_time, error, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (str(uuid.uuid4()), result.config_id, result.timestamp.isoformat() + 'Z',
+          result.success, result.response_time, result.error, json.dumps(result.data)))
+    conn.commit()
+    conn.close()
+
+async def legacy_read(db_path: str):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM test_results ORDER BY timestamp DESC LIMIT 100")
+    rows = cursor.fetchall()
+    conn.close()
+    return [TestResult(id=row[0], config_id=row[1], timestamp=datetime.fromisoformat(row[2]),
+                       success=bool(row[3]), response_time=row[4], error=row[5],
+                       data=json.loads(row[6]) if row[6] else None) for row in rows]
+
+async def measure(label: str, make_calls, count: int, concurrency: int):
+    """Run count calls with the given concurrency, tracking event loop stalls"""
+    max_stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal max_stall
+        while not done:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_stall = max(max_stall, time.perf_counter() - before - 0.001)
+
+    tick_task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    for offset in range(0, count, concurrency):
+        await asyncio.gather(*(make_calls(offset + i) for i in range(min(concurrency, count - offset))))
+    elapsed = time.perf_counter() - start
+    done = True
+    await tick_task
+
+    print(f"{label:<28} {count / elapsed:>10.0f} ops/s   max loop stall {max_stall * 1000:>8.1f} ms")
+
+async def run(inserts: int, reads: int, concurrency: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.execute(LEGACY_SCHEMA)
+        conn.commit()
+        conn.close()
+
+        print("before: connect/close per call, inline on the event loop")
+        await measure("  inserts", lambda i: legacy_insert(legacy_path, make_result(i)), inserts, concurrency)
+        await measure("  reads (latest 100)", lambda i: legacy_read(legacy_path), reads, concurrency)
+
+        db = Database(os.path.join(tmp, "pooled.db"))
+        await db.init_db()
+
+        print("after: persistent writer + reader pool, WAL")
+        await measure("  inserts", lambda i: db.save_result(make_result(i)), inserts, concurrency)
+        await measure("  reads (latest 100)", lambda i: db.get_recent_results(100), reads, concurrency)
+        await db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--inserts", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(run(args.inserts, args.reads, args.concurrency))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Rows/s for turning test_results rows into the /api/results JSON body.
+
+before: TestResult dataclass per row, json.loads of data, asdict(), json.dumps
+after:  ResultRow with lazy data, serialized by splicing the stored JSON
+"""
+import argparse
+import json
+import random
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from app import result_encoding
+from app.database import RESULT_COLUMNS
+from app.models import TestResult
+from app.result_encoding import ResultRow, encode_data
+from app.schema import create_schema
+
+
+def make_data(i: int):
+    kind = i % 3
+    if kind == 0:
+        return {"rtt": random.uniform(1, 50)}
+    if kind == 1:
+        return {"status_code": 200, "content_length": random.randint(1000, 50000),
+                "reused_connection": True,
+                "timings": {"dns_ms": None, "tcp_ms": None, "tls_ms": None, "ttfb_ms": random.uniform(10, 90),
+                            "transfer_ms": random.uniform(1, 20), "total_ms": random.uniform(20, 120)}}
+    return {"record_type": "A", "target": "example.com", "servers_tested": 2, "successful_queries": 2,
+            "results": [{"server": server, "success": True, "response_time": random.uniform(5, 40),
+                         "answers": ["93.184.216.34"], "record_type": "A"} for server in ("8.8.8.8", "1.1.1.1")]}
+
+
+def load(rows: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    create_schema(conn)
+    now = int(time.time() * 1000)
+    conn.executemany(
+        "INSERT INTO test_results (config_id, timestamp, success, response_time, error, data) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"config-{i % 20}", now - i * 1000, 1, random.random(), None, encode_data(make_data(i))) for i in range(rows)]
+    )
+    return conn
+
+
+def legacy_body(conn: sqlite3.Connection) -> bytes:
+    rows = conn.execute("SELECT id, config_id, timestamp, success, response_time, error, data FROM test_results").fetchall()
+    results = [TestResult(id=row[0], config_id=row[1],
+                          timestamp=datetime.fromtimestamp(row[2] / 1000, tz=timezone.utc),
+                          success=bool(row[3]), response_time=row[4], error=row[5],
+                          data=json.loads(row[6]) if row[6] else None) for row in rows]
+    return json.dumps([result.dict() for result in results]).encode()
+
+
+def lean_body(conn: sqlite3.Connection) -> bytes:
+    rows = conn.execute(f"SELECT {RESULT_COLUMNS} FROM test_results").fetchall()
+    return b"[" + b",".join(ResultRow(row).to_json() for row in rows) + b"]"
+
+
+def measure(label: str, fn, conn, rows: int, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(conn)
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<28} {rows / best:>10.0f} rows/s")
+
+
+def run(rows: int, repeat: int):
+    conn = load(rows)
+    assert json.loads(legacy_body(conn)) == json.loads(lean_body(conn))
+
+    measure("before: dataclass + asdict", legacy_body, conn, rows, repeat)
+    orjson = result_encoding.orjson
+    result_encoding.orjson = None
+    measure("after: ResultRow (json)", lean_body, conn, rows, repeat)
+    result_encoding.orjson = orjson
+    if orjson is not None:
+        measure("after: ResultRow (orjson)", lean_body, conn, rows, repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""DNS probe throughput: per-probe resolver setup vs. the shared ResolverRegistry.
+
+Queries go to a stub nameserver on 127.0.0.1 so the numbers reflect client
+overhead (resolv.conf parsing, resolver construction, socket setup) rather
+than network latency.
+"""
+import argparse
+import asyncio
+import time
+
+import dns.asyncresolver
+import dns.message
+import dns.rrset
+
+from app.dns_resolvers import ResolverRegistry
+
+
+class StubServer(asyncio.DatagramProtocol):
+    """Answers every query with the same A record, patching in the query id"""
+
+    def __init__(self):
+        query = dns.message.make_query('example.com', 'A')
+        response = dns.message.make_response(query)
+        response.answer.append(dns.rrset.from_text('example.com.', 60, 'IN', 'A', '192.0.2.1'))
+        self.template = response.to_wire()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(data[:2] + self.template[2:], addr)
+
+
+async def legacy_probe(port: int):
+    # What _dns_test did per server: a fresh resolver that re-reads
+    # resolv.conf and opens a new socket for the query
+    resolver = dns.asyncresolver.Resolver()
+    resolver.nameservers = ['127.0.0.1']
+    resolver.port = port
+    resolver.timeout = 2
+    answers = await resolver.resolve('example.com', 'A')
+    return [str(answer) for answer in answers]
+
+
+async def registry_probe(registry: ResolverRegistry, port: int):
+    registry.servers_for(None)
+    answers = await registry.resolve('127.0.0.1', 'example.com', 'A', 2, port)
+    return [str(answer) for answer in answers]
+
+
+async def measure(label: str, make_probe, count: int, concurrency: int):
+    start = time.perf_counter()
+    for offset in range(0, count, concurrency):
+        await asyncio.gather(*(make_probe() for _ in range(min(concurrency, count - offset))))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count / elapsed:>10.0f} probes/s")
+
+
+async def run(probes: int, concurrency: int):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(StubServer, local_addr=('127.0.0.1', 0))
+    port = transport.get_extra_info('sockname')[1]
+
+    print("before: new Resolver (resolv.conf parse + socket) per probe")
+    await measure("  probes", lambda: legacy_probe(port), probes, concurrency)
+
+    registry = ResolverRegistry()
+    print("after: cached nameservers, one shared socket per server")
+    await measure("  probes", lambda: registry_probe(registry, port), probes, concurrency)
+
+    registry.close()
+    transport.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--probes", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.probes, args.concurrency))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Checks for the ICMP engine against a loopback target.
+
+Needs permission to open an ICMP socket: an unprivileged ping socket
+(net.ipv4.ping_group_range) or root for a raw one. Covers concurrent
+probes, matching replies by (identifier, sequence) and nonce, timeouts,
+and falling back from the datagram socket to a raw one and from the
+engine to the ping subprocess. Exits non-zero if any check fails.
+"""
+import argparse
+import asyncio
+import shutil
+import socket
+import struct
+import sys
+import time
+from unittest import mock
+
+from app import icmp
+from app.icmp import ICMP_ECHO_REPLY, IcmpEngine, IcmpUnavailable
+from app.models import TestConfig, TestType
+from app.network_tests import NetworkTester
+
+TARGET = "127.0.0.1"
+failures = []
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    print(f"{'ok  ' if ok else 'FAIL'} {name}{': ' + detail if detail else ''}")
+    if not ok:
+        failures.append(name)
+
+
+class _DropSends:
+    """Socket stand-in that swallows echo requests, so no reply ever comes"""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def sendto(self, packet, address):
+        return len(packet)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+def _reply(engine: IcmpEngine, ident: int, seq: int, nonce: int) -> bytes:
+    packet = struct.pack('!BBHHHQ', ICMP_ECHO_REPLY, 0, 0, ident, seq, nonce)
+    # Raw sockets see the IP header too; _on_reply only reads its length
+    return bytes([0x45]) + bytes(19) + packet if engine._raw else packet
+
+
+async def check_concurrent(probes: int):
+    engine = IcmpEngine()
+    start = time.perf_counter()
+    rtts = await asyncio.gather(*(engine.ping(TARGET, 2) for _ in range(probes)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = [rtt for rtt in rtts if isinstance(rtt, BaseException)]
+    check("concurrent probes", not errors and all(0 <= rtt < 2000 for rtt in rtts),
+          f"{probes} probes in {elapsed:.2f}s, {len(errors)} errors, "
+          f"{'raw' if engine._raw else 'datagram'} socket, "
+          f"kernel timestamps {'on' if engine._kernel_timestamps else 'off'}")
+    check("pending cleared", engine.pending() == 0)
+    engine.close()
+
+
+async def check_matching():
+    engine = IcmpEngine()
+    await engine.ping(TARGET, 2)
+    engine._sock = _DropSends(engine._sock)
+
+    task = asyncio.create_task(engine.ping(TARGET, 2))
+    await asyncio.sleep(0.01)
+    (ident, seq), request = next(iter(engine._pending.items()))
+    now = time.monotonic_ns()
+    engine._on_reply(_reply(engine, ident ^ 1, seq, request.nonce), now, None)
+    check("other identifier ignored", not request.future.done())
+    engine._on_reply(_reply(engine, ident, seq ^ 1, request.nonce), now, None)
+    check("other sequence ignored", not request.future.done())
+    engine._on_reply(_reply(engine, ident, seq, request.nonce ^ 1), now, None)
+    check("wrong nonce ignored", not request.future.done())
+    engine._on_reply(_reply(engine, ident, seq, request.nonce), now, None)
+    rtt = await task
+    check("matching reply resolves", rtt >= 0, f"{rtt:.3f} ms")
+    engine.close()
+
+
+async def check_timeout():
+    engine = IcmpEngine()
+    await engine.ping(TARGET, 2)
+    engine._sock = _DropSends(engine._sock)
+    start = time.perf_counter()
+    try:
+        await engine.ping(TARGET, 0.2)
+        check("timeout", False, "got a reply to a dropped request")
+    except IcmpUnavailable as e:
+        check("timeout", False, str(e))
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        check("timeout", "timed out" in str(e) and elapsed < 0.5, f"{e} after {elapsed:.2f}s")
+    check("pending cleared after timeout", engine.pending() == 0)
+    engine.close()
+
+
+async def check_fallback():
+    real_socket = socket.socket
+
+    def no_datagram(family=-1, kind=-1, proto=-1, *args):
+        if kind == socket.SOCK_DGRAM and proto == socket.IPPROTO_ICMP:
+            raise PermissionError("ping sockets disabled")
+        return real_socket(family, kind, proto, *args)
+
+    def no_icmp(family=-1, kind=-1, proto=-1, *args):
+        if proto == socket.IPPROTO_ICMP:
+            raise PermissionError("ICMP sockets disabled")
+        return real_socket(family, kind, proto, *args)
+
+    engine = IcmpEngine()
+    with mock.patch.object(icmp.socket, 'socket', no_datagram):
+        try:
+            await engine.ping(TARGET, 2)
+            check("raw socket when datagram is refused", engine._raw)
+        except IcmpUnavailable as e:
+            print(f"skip raw socket when datagram is refused: {e} (not root)")
+    engine.close()
+
+    engine = IcmpEngine()
+    with mock.patch.object(icmp.socket, 'socket', no_icmp):
+        try:
+            await engine.ping(TARGET, 2)
+            check("unavailable without ICMP sockets", False)
+        except IcmpUnavailable:
+            check("unavailable without ICMP sockets", engine.available is False)
+
+    if not shutil.which("ping"):
+        print("skip ping subprocess fallback: no ping binary")
+        return
+    tester = NetworkTester()
+    tester.icmp = engine
+    try:
+        result = await tester._ping_test(TestConfig(name="loopback", test_type=TestType.PING, target=TARGET, timeout=2))
+        check("ping subprocess fallback", result.get("rtt") is not None and "output" in result)
+    finally:
+        await tester.close()
+
+
+async def main(probes: int):
+    await check_concurrent(probes)
+    await check_matching()
+    await check_timeout()
+    await check_fallback()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--probes", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.probes))
+    if failures:
+        print(f"{len(failures)} checks failed")
+        sys.exit(1)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+
+def compact_db():
+    db_path = os.getenv('DB_PATH', 'network_tests.db')
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    before = os.path.getsize(db_path)
+    cursor.execute("PRAGMA auto_vacuum")
+    mode = cursor.fetchone()[0]
+
+    print(f"Compacting {db_path} ({before} bytes)...")
+    if mode != 2:
+        # Switching to incremental auto-vacuum needs one full VACUUM; after
+        # that the retention task can release space while the app runs
+        print("Enabling incremental auto-vacuum...")
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("VACUUM")
+    conn.close()
+
+    after = os.path.getsize(db_path)
+    print(f"\nCompaction complete!")
+    print(f"Size: {before} -> {after} bytes ({before - after} reclaimed)")
+
+if __name__ == "__main__":
+    compact_db()
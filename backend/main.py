@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import os
 import uvicorn
 from app.api import app
 
@@ -7,6 +8,10 @@ if __name__ == "__main__":
         "app.api:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
-        log_level="info"
+        # Auto-reload is for development; it doubles the process count
+        reload=os.getenv('RELOAD', 'false').lower() == 'true',
+        log_level="info",
+        # Compresses WebSocket frames for clients that offer it; batched
+        # result messages are repetitive JSON and shrink well
+        ws_per_message_deflate=True
     )
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
+import json
 import sqlite3
 import sys
+from app.result_encoding import encode_data, split_raw, store_raw
+from app.schema import ISO_TO_EPOCH_MS, create_schema
 
 def migrate_data():
     # Connect to both databases
@@ -9,6 +12,7 @@ def migrate_data():
     
     old_cursor = old_db.cursor()
     new_cursor = new_db.cursor()
+    create_schema(new_db)
     
     print("Starting data migration...")
     
@@ -28,6 +32,7 @@ def migrate_data():
             print(f"Error migrating config {config[0]}: {e}")
     
     print(f"Migrated {len(configs)} test configurations")
+    test_types = {config[0]: config[2] for config in configs}
     
     # Migrate test_results
     print("Migrating test results...")
@@ -45,11 +50,27 @@ def migrate_data():
             
         for result in results:
             try:
-                new_cursor.execute("""
-                    INSERT OR REPLACE INTO test_results 
-                    (id, config_id, timestamp, success, response_time, error, data)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, result)
+                # Raw tool output moves to result_raw, as in the v5 migration
+                data, raw = split_raw(test_types.get(result[1]), json.loads(result[6])) if result[6] else (None, None)
+                # Old ids are uuid strings; rows get fresh integer ids and
+                # epoch-ms timestamps, and re-runs skip rows already copied
+                new_cursor.execute(f"""
+                    INSERT INTO test_results 
+                    (config_id, timestamp, success, response_time, error, data)
+                    SELECT ?, ts, ?, ?, ?, ?
+                    FROM (SELECT {ISO_TO_EPOCH_MS.format(column='?')} AS ts)
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM test_results WHERE config_id = ? AND timestamp = ts
+                    )
+                """, (result[1], result[3], result[4], result[5], encode_data(data),
+                      result[2], result[1]))
+                if not new_cursor.rowcount:
+                    continue
+                # Only for rows actually inserted, so a resumed run leaves
+                # no raw blobs behind that nothing points at
+                if raw:
+                    new_cursor.execute("UPDATE test_results SET raw_id = ? WHERE id = ?",
+                                       (store_raw(new_db, raw), new_cursor.lastrowid))
                 migrated += 1
             except Exception as e:
                 print(f"Error migrating result {result[0]}: {e}")
@@ -71,7 +92,7 @@ def migrate_data():
     date_range = new_cursor.fetchone()
     
     print(f"New database contains {new_count} results")
-    print(f"Date range: {date_range[0]} to {date_range[1]}")
+    print(f"Date range (epoch ms): {date_range[0]} to {date_range[1]}")
     
     # Close connections
     old_db.close()
@@ -1,6 +1,6 @@
 'use client'
 
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { Button } from '@/components/ui/button'
 import { Badge } from '@/components/ui/badge'
@@ -61,6 +61,8 @@ export default function Dashboard() {
     setRenderKey(prev => prev + 1) // Force re-render
   }
   const [ws, setWs] = useState<WebSocket | null>(null)
+  // Position in the results stream as of the last fetch, used to catch up after a reconnect
+  const syncCursor = useRef<string | null>(null)
 
   useEffect(() => {
     fetchConfigs()
@@ -119,6 +121,7 @@ export default function Dashboard() {
       const url = `http://localhost:8000/api/results?${params}`
       
       const response = await fetch(url)
+      syncCursor.current = response.headers.get('X-Sync-Cursor')
       const data = await response.json()
       setResults(data)
     } catch (error) {
@@ -126,23 +129,80 @@ export default function Dashboard() {
     }
   }
 
-  const connectWebSocket = () => {
+  // Sync cursors are base64url "s:<last id>"; live results move it forward
+  const cursorId = (cursor: string) =>
+    Number(atob(cursor.replace(/-/g, '+').replace(/_/g, '/')).split(':')[1])
+  const advanceSyncCursor = (results: TestResult[]) => {
+    if (!syncCursor.current || results.length === 0) return
+    const newest = Math.max(...results.map(result => Number(result.id)))
+    if (newest > cursorId(syncCursor.current)) {
+      syncCursor.current = btoa(`s:${newest}`).replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '')
+    }
+  }
+
+  // Fetch results committed while the WebSocket was down, or dropped by it
+  const syncMissedResults = async (from = syncCursor.current) => {
+    try {
+      if (!from) return
+      const params = new URLSearchParams({ cursor: from })
+      const response = await fetch(`http://localhost:8000/api/results/sync?${params}`)
+      if (!response.ok) return
+      const data = await response.json()
+      if (data.has_more) {
+        // More than a page behind: only the newest 100 are shown, so
+        // reload those (and the cursor) instead of paging through the gap
+        await fetchResults(true)
+        return
+      }
+      if (cursorId(data.cursor) > cursorId(syncCursor.current ?? from)) syncCursor.current = data.cursor
+      if (data.results.length > 0) {
+        // Sync returns oldest first; the list is newest first
+        const missed: TestResult[] = data.results.reverse()
+        setResults(prev => {
+          const known = new Set(prev.map(result => result.id))
+          return [...missed.filter(result => !known.has(result.id)), ...prev].slice(0, 100)
+        })
+      }
+    } catch (error) {
+      console.error('Failed to sync results:', error)
+    }
+  }
+
+  const connectWebSocket = (reconnect = false) => {
     const websocket = new WebSocket('ws://localhost:8000/ws')
     
     websocket.onmessage = (event) => {
-      const result = JSON.parse(event.data)
-      setResults(prev => [result, ...prev.slice(0, 99)])
+      const message = JSON.parse(event.data)
+      // Detector state changes (degraded/down/recovered) aren't results
+      if (message.type === 'event') {
+        console.log('Detector event', message.event)
+        return
+      }
+      // The server dropped results this client was too slow for; fetch them
+      if (message.type === 'dropped' || message.dropped) {
+        console.log(`WebSocket dropped ${message.count ?? message.dropped} results, resyncing`)
+        // From the cursor as it was, before the results that follow the gap
+        syncMissedResults(syncCursor.current)
+        if (message.type === 'dropped') return
+      }
+      // Batched: one message per window, oldest result first
+      const incoming: TestResult[] = message.type === 'batch' ? message.results.reverse() : [message]
+      advanceSyncCursor(incoming)
+      setResults(prev => [...incoming, ...prev].slice(0, 100))
       // Don't force re-render on every WebSocket update - only when timezone changes
     }
 
     websocket.onopen = () => {
       console.log('WebSocket connected')
       setWs(websocket)
+      // Coalesce live results so bursts of fast probes re-render once per window
+      websocket.send(JSON.stringify({ action: 'batch', window_ms: 250 }))
+      if (reconnect) syncMissedResults()
     }
 
     websocket.onclose = () => {
       console.log('WebSocket disconnected')
-      setTimeout(connectWebSocket, 5000)
+      setTimeout(() => connectWebSocket(true), 5000)
     }
   }
 
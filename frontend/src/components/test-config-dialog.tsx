@@ -16,6 +16,11 @@ interface TestConfig {
   interval: number
   timeout: number
   enabled: boolean
+  ping_count?: number
+  ping_spacing?: number
+  http_keepalive?: boolean
+  http_body?: string
+  store_raw?: boolean
 }
 
 interface TestConfigDialogProps {
@@ -33,7 +38,12 @@ export function TestConfigDialog({ open, onOpenChange, onSave, editingConfig }:
     interval: 30,
     timeout: 5,
     enabled: true,
-    dns_servers: [] as string[]
+    dns_servers: [] as string[],
+    ping_count: 1,
+    ping_spacing: 0.2,
+    http_keepalive: true,
+    http_body: 'stream',
+    store_raw: false
   })
 
   useEffect(() => {
@@ -45,7 +55,12 @@ export function TestConfigDialog({ open, onOpenChange, onSave, editingConfig }:
         interval: editingConfig.interval,
         timeout: editingConfig.timeout,
         enabled: editingConfig.enabled,
-        dns_servers: (editingConfig as any).dns_servers || []
+        dns_servers: (editingConfig as any).dns_servers || [],
+        ping_count: editingConfig.ping_count ?? 1,
+        ping_spacing: editingConfig.ping_spacing ?? 0.2,
+        http_keepalive: editingConfig.http_keepalive ?? true,
+        http_body: editingConfig.http_body ?? 'stream',
+        store_raw: editingConfig.store_raw ?? false
       })
     } else {
       setFormData({
@@ -55,7 +70,12 @@ export function TestConfigDialog({ open, onOpenChange, onSave, editingConfig }:
         interval: 30,
         timeout: 5,
         enabled: true,
-        dns_servers: []
+        dns_servers: [],
+        ping_count: 1,
+        ping_spacing: 0.2,
+        http_keepalive: true,
+        http_body: 'stream',
+        store_raw: false
       })
     }
   }, [editingConfig, open])
@@ -225,6 +245,64 @@ export function TestConfigDialog({ open, onOpenChange, onSave, editingConfig }:
             </div>
           </div>
 
+          {formData.test_type === 'ping' && (
+            <div className="grid grid-cols-2 gap-4">
+              <div className="space-y-2">
+                <Label htmlFor="ping_count">Packets per Test</Label>
+                <Input
+                  id="ping_count"
+                  type="number"
+                  value={formData.ping_count}
+                  onChange={(e) => setFormData({ ...formData, ping_count: parseInt(e.target.value) || 1 })}
+                  min="1"
+                  max="100"
+                />
+              </div>
+
+              <div className="space-y-2">
+                <Label htmlFor="ping_spacing">Packet Spacing (seconds)</Label>
+                <Input
+                  id="ping_spacing"
+                  type="number"
+                  value={formData.ping_spacing}
+                  onChange={(e) => setFormData({ ...formData, ping_spacing: parseFloat(e.target.value) || 0 })}
+                  min="0"
+                  max="5"
+                  step="0.05"
+                />
+              </div>
+            </div>
+          )}
+
+          {formData.test_type === 'http' && (
+            <div className="grid grid-cols-2 gap-4">
+              <div className="space-y-2">
+                <Label>Response Body</Label>
+                <Select
+                  value={formData.http_body}
+                  onValueChange={(value) => setFormData({ ...formData, http_body: value })}
+                >
+                  <SelectTrigger>
+                    <SelectValue />
+                  </SelectTrigger>
+                  <SelectContent>
+                    <SelectItem value="stream">Download and count bytes</SelectItem>
+                    <SelectItem value="headers">Headers only</SelectItem>
+                  </SelectContent>
+                </Select>
+              </div>
+
+              <div className="flex items-center space-x-2 pt-6">
+                <Switch
+                  id="http_keepalive"
+                  checked={formData.http_keepalive}
+                  onCheckedChange={(checked) => setFormData({ ...formData, http_keepalive: checked })}
+                />
+                <Label htmlFor="http_keepalive">Reuse connections</Label>
+              </div>
+            </div>
+          )}
+
           {formData.test_type === 'dns' && (
             <div className="space-y-2">
               <Label>DNS Servers to Test</Label>
@@ -268,6 +346,17 @@ export function TestConfigDialog({ open, onOpenChange, onSave, editingConfig }:
             </div>
           )}
 
+          {['ping', 'http', 'speedtest_ookla', 'iperf3'].includes(formData.test_type) && (
+            <div className="flex items-center space-x-2">
+              <Switch
+                id="store_raw"
+                checked={formData.store_raw}
+                onCheckedChange={(checked) => setFormData({ ...formData, store_raw: checked })}
+              />
+              <Label htmlFor="store_raw">Keep raw tool output (headers, JSON reports)</Label>
+            </div>
+          )}
+
           <div className="flex items-center space-x-2">
             <Switch
               id="enabled"